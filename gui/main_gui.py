@@ -4,11 +4,14 @@ from Tkinter import *
 import ttk
 from tkFileDialog import askopenfilename
 from autoscrollbar import AutoScrollable
+import atexit
 import glob
 import os
+import shutil
+import tempfile
 
 sys.path.append( os.path.dirname( os.path.dirname( os.path.abspath(__file__) ) ) )
-from src import models, model_solvers, reaction_factories
+from src import models, model_solvers, reaction_factories, trajectory_store
 import custom_widgets
 import plot_methods
 
@@ -129,9 +132,17 @@ class CalculatorResultFrame(ttk.Frame):
         self.plot_frame = ttk.Frame(self.full_container.frame)
         self.plot_frame.grid(column=1, row=2)
 
+        # the trajectories are written to memory-mapped files here rather than held in memory, see trajectory_store
+        self.trajectory_directory = tempfile.mkdtemp()
+        atexit.register(shutil.rmtree, self.trajectory_directory, True)
+        self.simulation_count = 0
+
     def prep(self):
         solver = model_solvers.ODESolver(self.controller.get_model())
-        self.species_to_column_mapping, self.solution, self.sim_time = solver.equilibrium_solution()
+        # each simulation gets its own file, since the plots may still hold a view of the previous one
+        self.simulation_count += 1
+        store = os.path.join(self.trajectory_directory, 'trajectory_%d.npy' % self.simulation_count)
+        self.species_to_column_mapping, self.solution, self.sim_time = solver.equilibrium_solution(store=store)
         print self.solution[-1,:]
         dl = ttk.Label(self.full_container.frame, text="Final concentrations",anchor=W)
         dl.config(font=40)
@@ -145,6 +156,17 @@ class CalculatorResultFrame(ttk.Frame):
                                                                           self.create_plot)
             result_widget.grid(column=0, row=index, sticky=W)
         self.clear_plot()
+        self.remove_store(self.simulation_count - 1)
+
+    def remove_store(self, simulation):
+        # the store of an earlier simulation is deleted once nothing shows it.  If it cannot be deleted yet, it is
+        # removed with the directory on exit.
+        store = os.path.join(self.trajectory_directory, 'trajectory_%d.npy' % simulation)
+        for path in [store, trajectory_store.times_path(store)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
 
     def clear_plot(self):
         print 'clear plots'
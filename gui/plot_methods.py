@@ -1,10 +1,58 @@
 __author__ = 'brian'
 
+import numpy as np
+from src import decimation
 from matplotlib.figure import Figure
 from matplotlib.backends.backend_tkagg import NavigationToolbar2TkAgg
 import seaborn as sns
 sns.set_style('darkgrid')
 
+# the number of points drawn for each pixel of the width of the axes
+POINTS_PER_PIXEL = 2
+
+
+class DecimatedLine(object):
+    """
+    Draws a trajectory with only as many points as the axes have room for, POINTS_PER_PIXEL for each pixel of their
+    width, chosen by decimation.lttb from the part of the trajectory in view.  The points are chosen again whenever the
+    limits of the x-axis change, such as when zooming or panning with the CustomToolbar, so zooming in shows the detail
+    of the full trajectory.
+    """
+
+    def __init__(self, ax, t, y):
+        """
+        :param ax: a matplotlib Axes instance
+
+        :param t: a sorted numPy array of times
+
+        :param y: a numPy array of values, the same length as t
+        """
+        self.ax = ax
+        self.t = np.asarray(t)
+        self.y = np.asarray(y)
+        kept = decimation.lttb(self.t, self.y, self._points())
+        self.line, = ax.plot(self.t[kept], self.y[kept])
+        ax.callbacks.connect('xlim_changed', lambda changed_ax: self.refine())
+
+    def _points(self):
+        """
+        :return: the number of points which are drawn
+        """
+        return int(POINTS_PER_PIXEL*self.ax.bbox.width)
+
+    def refine(self):
+        """
+        Chooses the points drawn for the current limits of the x-axis.  One point beyond each limit is included, so
+        the line runs to the edges of the axes.
+
+        :return: None
+        """
+        low, high = self.ax.get_xlim()
+        start = max(np.searchsorted(self.t, low, side='left') - 1, 0)
+        stop = min(np.searchsorted(self.t, high, side='right') + 1, len(self.t))
+        kept = start + decimation.lttb(self.t[start:stop], self.y[start:stop], self._points())
+        self.line.set_data(self.t[kept], self.y[kept])
+
 
 def plot_evolution(t,y, current_h, current_w, title='', species=None):
     dpi = 100 # a reasonable value
@@ -14,11 +62,13 @@ def plot_evolution(t,y, current_h, current_w, title='', species=None):
     plot_width = 0.5*(current_w/float(dpi))
     fig = Figure(figsize=(plot_width, plot_height), dpi=dpi)
     ax = fig.add_subplot(111)
-    ax.plot(t, y)
+    # the full trajectory can have many more points than there are pixels, so only a shape-preserving subset is drawn
+    trajectory = DecimatedLine(ax, t, y)
     ax.set_title(title)
     ax.set_ylabel('[%s] (nM)' % species if species else 'Concentration (nM)')
     ax.set_xlabel('Time (s)')
     fig.tight_layout()
+    trajectory.refine()
     return fig
 
 
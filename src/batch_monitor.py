@@ -0,0 +1,186 @@
+__author__ = 'brian'
+
+import logging
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+# resource is only available on Unix
+try:
+    import resource
+except ImportError:
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# the number of slowest rows reported in a BatchSummary
+SLOWEST_ROWS = 10
+
+# the columns of the slowest rows which precede the initial conditions
+SLOWEST_COLUMNS = ['row', 'solve_time', 'steps', 'converged', 'residual', 'count']
+
+
+def peak_memory_mb():
+    """
+    :return: the peak resident memory of this process in megabytes, or NaN where it is not available
+    """
+    if resource is None:
+        return np.nan
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # reported in bytes on macOS and in kilobytes elsewhere
+    return peak/2.0**20 if sys.platform == 'darwin' else peak/2.0**10
+
+
+class BatchSummary(object):
+    """
+    Describes a finished batch run: the rows solved, how many were distinct (rows repeating an earlier row of their
+    chunk are not solved again), how many converged and how many were found in the cache or interpolated from a
+    lookup table (see lookup_tables), the Newton iterations taken, the wall-clock time and throughput, the peak memory
+    of the process, and the slowest rows.
+
+    The slowest rows are a Pandas DataFrame giving the label of each row, its estimated solve time in seconds (see
+    AlgebraicEquilibriumSolver.ensemble_equilibrium_solution), its steps, whether it converged, its residual, the
+    number of rows sharing its result and its initial conditions.
+    """
+
+    def __init__(self, rows, converged, cached, steps, elapsed, solve_time, peak_memory, slowest, unique_rows=None):
+        self.rows = rows
+        self.unique_rows = rows if unique_rows is None else unique_rows
+        self.dedup_ratio = rows/float(self.unique_rows) if self.unique_rows > 0 else 1.0
+        self.converged = converged
+        self.cached = cached
+        self.steps = steps
+        self.elapsed = elapsed
+        self.rows_per_second = rows/elapsed if elapsed > 0 else np.nan
+        self.solve_time = solve_time
+        self.peak_memory_mb = peak_memory
+        self.slowest = slowest
+
+    def to_dict(self):
+        """
+        :return: a dictionary of the summary, with the slowest rows as a list of dictionaries
+        """
+        return {'rows': self.rows,
+                'unique_rows': self.unique_rows,
+                'dedup_ratio': self.dedup_ratio,
+                'converged': self.converged,
+                'cached': self.cached,
+                'steps': self.steps,
+                'elapsed': self.elapsed,
+                'rows_per_second': self.rows_per_second,
+                'solve_time': self.solve_time,
+                'peak_memory_mb': self.peak_memory_mb,
+                'slowest': self.slowest.to_dict(orient='records')}
+
+    def __str__(self):
+        solved = self.unique_rows - self.cached
+        lines = ['Solved %d rows in %.2f s (%.0f rows/s): %d converged, %d found in the cache or a lookup table.'
+                 % (self.rows, self.elapsed, self.rows_per_second, self.converged, self.cached),
+                 '%d distinct rows (%.2f rows per distinct row).' % (self.unique_rows, self.dedup_ratio),
+                 '%d Newton iterations (%.1f per row solved), peak memory %.0f MB.'
+                 % (self.steps, self.steps/float(solved) if solved > 0 else 0.0, self.peak_memory_mb)]
+        if self.slowest.shape[0] > 0:
+            lines += ['Slowest rows:', self.slowest.to_string(index=False)]
+        return '\n'.join(lines)
+
+
+class BatchMonitor(object):
+    """
+    Follows a batch run as its chunks are solved (see batch_process.process_batch), calling a progress callback as
+    the rows of each are solved and collecting the BatchSummary.
+    """
+
+    def __init__(self, total_rows=None, progress=None, slowest_rows=SLOWEST_ROWS):
+        """
+
+        :param total_rows: (optional) the number of rows in the batch, if known
+
+        :param progress: (optional) a callable, called after each chunk, and after each group of rows solved within a
+        chunk, with the number of rows done so far, the total number of rows (or None) and the seconds elapsed
+
+        :param slowest_rows: (optional) the number of slowest rows kept for the summary
+
+        :return: None
+        """
+        self.total_rows = total_rows
+        self.progress = progress
+        self.slowest_rows = slowest_rows
+        self.start = time.time()
+        self.rows = 0
+        self.unique_rows = 0
+        self.converged = 0
+        self.cached = 0
+        self.steps = 0
+        self.solve_time = 0.0
+        self._slowest = None
+
+    def record(self, labels, report, initial_conditions, species, counts=None):
+        """
+        Adds a solved chunk of rows
+
+        :param labels: a numPy array of the labels of the rows
+
+        :param report: the model_solvers.ConvergenceReport of the rows, with steps and solve times
+
+        :param initial_conditions: a (N x M) numPy array of the initial conditions of the rows
+
+        :param species: a list of the M species, ordered according to the species-to-index map
+
+        :param counts: (optional) a numPy array giving the number of rows of the batch which each row stands for,
+        when repeated rows were solved once.  Defaults to one each.
+
+        :return: None
+        """
+        if counts is None:
+            counts = np.ones(len(labels), dtype=int)
+        self.rows += int(np.sum(counts))
+        self.unique_rows += len(labels)
+        self.converged += int(np.sum(counts[report.converged]))
+        # rows found in the cache or interpolated from a lookup table take no steps
+        self.cached += int(np.sum(counts[report.converged & (report.steps == 0)]))
+        self.steps += int(np.sum(report.steps))
+        self.solve_time += float(np.nansum(report.solve_time))
+
+        slowest = np.argsort(-report.solve_time, kind='mergesort')[:self.slowest_rows]
+        rows = pd.DataFrame({'row': np.asarray(labels)[slowest],
+                             'solve_time': report.solve_time[slowest],
+                             'steps': report.steps[slowest],
+                             'converged': report.converged[slowest],
+                             'residual': report.residual[slowest],
+                             'count': counts[slowest]},
+                            columns=SLOWEST_COLUMNS)
+        rows = pd.concat([rows, pd.DataFrame(initial_conditions[slowest], columns=species)], axis=1)
+        if self._slowest is not None:
+            rows = pd.concat([self._slowest, rows], ignore_index=True)
+        self._slowest = rows.sort_values('solve_time', ascending=False, kind='mergesort') \
+            .head(self.slowest_rows).reset_index(drop=True)
+
+        if self.progress is not None:
+            self.progress(self.rows, self.total_rows, time.time() - self.start)
+
+    def update(self, chunk_rows):
+        """
+        Reports progress part way through a chunk, before it is recorded
+
+        :param chunk_rows: the number of rows of the chunk done so far
+
+        :return: None
+        """
+        if self.progress is not None:
+            self.progress(self.rows + chunk_rows, self.total_rows, time.time() - self.start)
+
+    def finish(self):
+        """
+        Completes the run, writing the summary to the log
+
+        :return: a BatchSummary
+        """
+        slowest = self._slowest
+        if slowest is None:
+            slowest = pd.DataFrame(columns=SLOWEST_COLUMNS)
+        summary = BatchSummary(self.rows, self.converged, self.cached, self.steps, time.time() - self.start,
+                               self.solve_time, peak_memory_mb(), slowest, self.unique_rows)
+        logger.info(str(summary))
+        return summary
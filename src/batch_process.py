@@ -1,15 +1,364 @@
-import reaction_factories
+import batch_monitor
+import lookup_tables
 import model_solvers
-import models
+import parameter_sweep
+import result_cache
+import result_writers
 
+import logging
+import multiprocessing
 import os
+import shutil
+import tempfile
+from multiprocessing import sharedctypes
+import numpy as np
 import pandas as pd
 
+from custom_exceptions import *
+
+logger = logging.getLogger(__name__)
+
+# the number of worker processes used by process_batch unless told otherwise.  None uses one per core.
+BATCH_WORKERS = None
+
+# batches with fewer rows to solve than this stay in the calling process, since starting the workers costs more
+# than it saves
+PARALLEL_MIN_ROWS = 2000
+
+# the rows are split into this many shards per worker, which evens out the load
+SHARDS_PER_WORKER = 4
+
+# when progress is followed, rows solved in this process are solved this many at a time, with progress reported
+# after each
+PROGRESS_ROWS = 1000
+
+# process_batch_file reads and solves this many rows at a time
+BATCH_CHUNK_ROWS = 50000
+
+# the file in a temporary directory which holds the trajectories of a chunk while they are written out
+TRAJECTORY_STORE_FILE = 'trajectories.npy'
+
+# the state of a worker process, set up once by _initialize_worker
+_worker = {}
+
 class BatchCalculationException(Exception):
     pass
 
 
-def process_batch(df, eqn_file):
+def initial_condition_matrix(solver, df):
+    """
+    Builds the (N x M) matrix of initial conditions from a dataframe, with the columns ordered as the solver
+    expects.  Species that are not given in the dataframe start at zero concentration.
+
+    :param solver: a model_solvers.Solver instance
+
+    :param df: a Pandas DataFrame with columns named after the species
+
+    :return: a (N x M) numPy array
+    """
+    species_set = set(solver.get_species_mapping().keys())
+
+    # From a general model file we cannot judge which species are necessary for creating
+    # a sensible reaction system.  We also would like to allow more columns than just the
+    # data we're operating on, so we want to ignore those columns.  
+    col_set = set(df.columns.tolist())
+    if len(col_set.intersection(species_set)) == 0:
+        raise BatchCalculationException('The input dataframe did not contain any columns headers in common with our reaction system.')
+
+    sample_to_column_mapping = solver.get_species_mapping()
+    ic_matrix = np.zeros((df.shape[0], len(sample_to_column_mapping)))
+    for s in species_set.intersection(col_set):
+        ic_matrix[:, sample_to_column_mapping[s]] = df[s].values.astype(float)
+    return ic_matrix
+
+
+def _shared_array(values):
+    """
+    Copies an array into shared memory, which the worker processes inherit instead of receiving a pickled copy
+
+    :param values: a numPy array of floats
+
+    :return: a 2-tuple of the multiprocessing RawArray and the shape of the array
+    """
+    raw = sharedctypes.RawArray('d', int(values.size))
+    np.frombuffer(raw, dtype=float)[:] = values.ravel()
+    return raw, values.shape
+
+
+def _shared_view(shared):
+    """
+    :param shared: a 2-tuple created by _shared_array
+
+    :return: a numPy array using the shared memory
+    """
+    raw, shape = shared
+    return np.frombuffer(raw, dtype=float).reshape(shape)
+
+
+def _initialize_worker(eqn_file, X0, k, result, report):
+    """
+    Sets up a worker process: the model is read and compiled once, and the shared arrays are wrapped as numPy arrays
+
+    :param eqn_file: a formatted model file
+
+    :param X0: the shared (N x M) initial conditions
+
+    :param k: the shared rate constants, either of length 2J or (N x 2J)
+
+    :param result: the shared (N x M) array receiving the equilibrium concentrations
+
+    :param report: the shared (N x 5) array receiving whether each row converged, its convergence time, its
+    residual, its steps and its solve time (see model_solvers.ConvergenceReport)
+
+    :return: None
+    """
+    _worker['solver'] = create_solver(eqn_file)
+    _worker['X0'] = _shared_view(X0)
+    _worker['k'] = _shared_view(k)
+    _worker['result'] = _shared_view(result)
+    _worker['report'] = _shared_view(report)
+
+
+def _solve_shard(shard):
+    """
+    Solves a contiguous range of rows in a worker process, writing the results into the shared arrays
+
+    :param shard: a 2-tuple of the first row and one past the last row
+
+    :return: the number of rows solved
+    """
+    start, stop = shard
+    solver = _worker['solver']
+    k = _worker['k'] if _worker['k'].ndim == 1 else _worker['k'][start:stop]
+    _worker['result'][start:stop] = solver.ensemble_equilibrium_solution(_worker['X0'][start:stop], k,
+                                                                         warm_start=True)
+    report = solver.get_convergence_report()
+    _worker['report'][start:stop] = np.column_stack([report.converged, report.convergence_time, report.residual,
+                                                     report.steps, report.solve_time])
+    return stop - start
+
+
+def worker_count(workers):
+    """
+    :param workers: the number of worker processes requested, or None for BATCH_WORKERS
+
+    :return: the number of worker processes to use, which is 1 if the work should stay in the calling process
+    """
+    if workers is None:
+        workers = BATCH_WORKERS
+    if workers is None:
+        try:
+            workers = multiprocessing.cpu_count()
+        except NotImplementedError:
+            workers = 1
+
+    # daemonic processes (e.g. some task queue workers) are not allowed to start their own
+    if workers > 1 and multiprocessing.current_process().daemon:
+        logger.info('Solving the batch serially, since this process cannot start worker processes.')
+        workers = 1
+    return max(int(workers), 1)
+
+
+def _serial_equilibrium_solution(solver, X0, k, progress=None):
+    """
+    Solves many sets of initial conditions in this process.  To report progress the rows are ordered by similarity
+    (see AlgebraicEquilibriumSolver.similarity_order) and solved PROGRESS_ROWS at a time, so the warm starts within
+    each group stay effective.
+
+    :param solver: a model_solvers.AlgebraicEquilibriumSolver for the model
+
+    :param X0: a (N x M) numPy array of initial conditions, all finite
+
+    :param k: an array of rate constants, either of length 2J or (N x 2J)
+
+    :param progress: (optional) a callable, called with the number of rows solved so far after each group
+
+    :return: a 2-tuple of the (N x M) numPy array of equilibrium concentrations and a model_solvers.ConvergenceReport
+    """
+    n_rows = X0.shape[0]
+    if progress is None or n_rows <= PROGRESS_ROWS:
+        X = solver.ensemble_equilibrium_solution(X0, k, warm_start=True)
+        return X, solver.get_convergence_report()
+
+    order = solver.similarity_order(X0, k)
+    per_row_k = k.ndim == 2
+    result = np.empty(X0.shape)
+    report_values = np.empty((n_rows, 5))
+    for start in range(0, n_rows, PROGRESS_ROWS):
+        rows = order[start:start + PROGRESS_ROWS]
+        result[rows] = solver.ensemble_equilibrium_solution(X0[rows], k[rows] if per_row_k else k, warm_start=True)
+        report = solver.get_convergence_report()
+        report_values[rows] = np.column_stack([report.converged, report.convergence_time, report.residual,
+                                               report.steps, report.solve_time])
+        progress(start + len(rows))
+    report = model_solvers.ConvergenceReport(report_values[:, 0] > 0, report_values[:, 1], report_values[:, 2],
+                                             report_values[:, 3].astype(int), report_values[:, 4])
+    return result, report
+
+
+def _parallel_equilibrium_solution(eqn_file, solver, X0, k, workers, progress=None):
+    """
+    Solves many sets of initial conditions over a pool of worker processes.  The rows are ordered by similarity
+    (see AlgebraicEquilibriumSolver.similarity_order), so each shard holds similar rows and the warm starts within
+    it stay effective.  The initial conditions, rate constants and results are passed through shared memory, and
+    the results are put back in the original order.
+
+    :param eqn_file: a formatted model file
+
+    :param solver: a model_solvers.AlgebraicEquilibriumSolver for the model
+
+    :param X0: a (N x M) numPy array of initial conditions, all finite
+
+    :param k: an array of rate constants, either of length 2J or (N x 2J)
+
+    :param workers: the number of worker processes
+
+    :param progress: (optional) a callable, called with the number of rows solved so far as each shard finishes
+
+    :return: a 2-tuple of the (N x M) numPy array of equilibrium concentrations and a model_solvers.ConvergenceReport
+    """
+    n_rows = X0.shape[0]
+    order = solver.similarity_order(X0, k)
+    per_row_k = k.ndim == 2
+
+    shared_X0 = _shared_array(X0[order])
+    shared_k = _shared_array(k[order] if per_row_k else k)
+    shared_result = _shared_array(np.nan*np.ones(X0.shape))
+    shared_report = _shared_array(np.nan*np.ones((n_rows, 5)))
+
+    bounds = np.linspace(0, n_rows, workers*SHARDS_PER_WORKER + 1).astype(int)
+    shards = [(start, stop) for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+    pool = multiprocessing.Pool(workers, _initialize_worker,
+                                (eqn_file, shared_X0, shared_k, shared_result, shared_report))
+    try:
+        done = 0
+        for rows in pool.imap_unordered(_solve_shard, shards):
+            done += rows
+            if progress is not None:
+                progress(done)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    result = np.empty(X0.shape)
+    result[order] = _shared_view(shared_result)
+    report_values = np.empty((n_rows, 5))
+    report_values[order] = _shared_view(shared_report)
+    report = model_solvers.ConvergenceReport(report_values[:, 0] > 0, report_values[:, 1], report_values[:, 2],
+                                             report_values[:, 3].astype(int), report_values[:, 4])
+    return result, report
+
+
+def create_solver(eqn_file):
+    """
+    :param eqn_file: a formatted model file
+
+    :return: a model_solvers.AlgebraicEquilibriumSolver for the model, which interpolates from the model's lookup
+    table if one has been built (see lookup_tables.create_solver)
+    """
+    return lookup_tables.create_solver(eqn_file)
+
+
+def species_names(solver):
+    """
+    :param solver: a model_solvers.Solver instance
+
+    :return: a list of the species, ordered according to the species-to-index map
+    """
+    names = ['']*len(solver.get_species_mapping())
+    for sample, col_idx in solver.get_species_mapping().items():
+        names[col_idx] = sample
+    return names
+
+
+def _distinct_rows(ic_matrix, rate_constants=None):
+    """
+    Finds the rows of a batch which are identical, once rounded as for the cache keys (see result_cache.quantize).
+    Exports often repeat rows, such as duplicate draws or concentrations filled in with a default value.
+
+    :param ic_matrix: a (N x M) numPy array of initial conditions
+
+    :param rate_constants: (optional) a (N x 2J) numPy array of per-row rate constants
+
+    :return: a 3-tuple of numPy arrays: the first row of each distinct row, in the order they appear; for each row,
+    the position of its distinct row in the first array; and the number of rows sharing each distinct row
+    """
+    values = ic_matrix if rate_constants is None else np.hstack([ic_matrix, rate_constants])
+    if values.shape[0] == 0:
+        empty = np.zeros(0, dtype=int)
+        return empty, empty, empty
+
+    # non-finite values all round to zero, so they are marked separately
+    keys = np.ascontiguousarray(np.hstack([result_cache.quantize(values).reshape(values.shape[0], -1),
+                                           ~np.isfinite(values)]))
+    keys = keys.view(np.dtype((np.void, keys.dtype.itemsize*keys.shape[1]))).ravel()
+    _, first, inverse, counts = np.unique(keys, return_index=True, return_inverse=True, return_counts=True)
+
+    # np.unique sorts the keys, so put the distinct rows back in the order of the batch
+    order = np.argsort(first)
+    position = np.empty(len(order), dtype=int)
+    position[order] = np.arange(len(order))
+    return first[order], position[inverse], counts[order]
+
+
+def solve_dataframe(solver, eqn_file, df, n_workers, monitor=None):
+    """
+    Finds the equilibrium for each row of a dataframe, see process_batch
+
+    :param solver: a model_solvers.AlgebraicEquilibriumSolver for the model
+
+    :param eqn_file: the formatted model file of the solver, which the worker processes read
+
+    :param df: a Pandas DataFrame with columns named after the species
+
+    :param n_workers: the number of worker processes, see worker_count
+
+    :param monitor: (optional) a batch_monitor.BatchMonitor which records the rows
+
+    :return: a Pandas DataFrame with the columns of df followed by the equilibrium concentration of each species
+    """
+    ic_matrix = initial_condition_matrix(solver, df)
+
+    # per-row rate constants, if the dataframe has any rate constant columns
+    rate_constants = parameter_sweep.rate_constants_from_dataframe(solver, df)
+
+    # identical rows are solved once, and the results copied to all of them
+    distinct, inverse, counts = _distinct_rows(ic_matrix, rate_constants)
+
+    # rows already solved are taken from the cache.  The rest of a batch are typically similar, so most can start
+    # from the equilibrium of a neighbouring row.
+    def solve(X0, k):
+        progress = None
+        if monitor is not None and monitor.progress is not None:
+            # the rows of the dataframe are counted as done in proportion to its distinct rows, those in the cache
+            # being done already
+            cached = len(distinct) - X0.shape[0]
+            progress = lambda done: monitor.update(df.shape[0]*(cached + done)//len(distinct))
+        if n_workers > 1 and X0.shape[0] >= PARALLEL_MIN_ROWS:
+            return _parallel_equilibrium_solution(eqn_file, solver, X0, k, n_workers, progress)
+        return _serial_equilibrium_solution(solver, X0, k, progress)
+
+    distinct_vals, report = result_cache.cached_ensemble_equilibrium_solution(
+        solver, ic_matrix[distinct], None if rate_constants is None else rate_constants[distinct], solve=solve)
+    final_vals = distinct_vals[inverse]
+
+    # flag the rows which did not reach equilibrium, so their results are not silently trusted
+    unconverged_rows = np.where(~report.converged[inverse])[0]
+    if len(unconverged_rows) > 0:
+        logger.warning('%d of %d rows did not reach equilibrium.  Row labels: %s'
+                       % (len(unconverged_rows), df.shape[0], ', '.join(map(str, df.index[unconverged_rows]))))
+    if monitor is not None:
+        monitor.record(df.index.values[distinct], report, ic_matrix[distinct], species_names(solver), counts)
+
+    results = pd.DataFrame(final_vals, index=df.index, columns=species_names(solver))
+    df = pd.concat([df,results], axis=1)
+    return df
+
+
+def process_batch(df, eqn_file, workers=None, progress=None, summary=False):
     """
     df is a Pandas DataFrame instance.
     eqn_file is a formatted model file
@@ -20,46 +369,155 @@ def process_batch(df, eqn_file):
     Furthermore, the values in the dataframe should all have the same units-- we make no 
     consideration for the relative units here-- that should all be cleared up prior to 
     calling this function.
+
+    The dataframe may also have rate constant columns named kf_q and kr_q, giving the forward and reverse rate
+    constants of reaction q (numbered in the order of the model file) for each row.  Rate constants without a
+    column, and empty cells, take the values given in the model file.
+
+    Large batches are split across a pool of worker processes.  workers (optional) sets their number, defaulting to
+    BATCH_WORKERS (one per core, if that is None); with a single worker the batch is solved in this process.
+
+    progress (optional) is called as the rows are solved, see batch_monitor.BatchMonitor.  A summary of the run
+    (see batch_monitor.BatchSummary) is written to the log, and also returned if summary is True, as the second
+    item of a 2-tuple after the results.
     """
+    solver = create_solver(eqn_file)
+    monitor = batch_monitor.BatchMonitor(df.shape[0], progress)
+    result = solve_dataframe(solver, eqn_file, df, worker_count(workers), monitor)
+    batch_summary = monitor.finish()
+    if summary:
+        return result, batch_summary
+    return result
 
-    factory = reaction_factories.FileReactionFactory(eqn_file)
-    model = models.Model(factory)
-    solver = model_solvers.ODESolverWJacobian(model)
 
-    # get all the species given in the model file:
-    species_set = set()
-    for rx in factory.get_reactions():
-        species_set = species_set.union(rx.get_all_species())
+def input_columns(solver, input_path, passthrough=None, sep='\t'):
+    """
+    Decides which columns of a delimited file are read, see process_batch_file
 
-    # From a general model file we cannot judge which species are necessary for creating
-    # a sensible reaction system.  We also would like to allow more columns than just the
-    # data we're operating on, so we want to ignore those columns.  
-    col_set = set(df.columns.tolist())
-    if len(col_set.intersection(species_set)) == 0:
-        raise BatchCalculationException('The input dataframe did not contain any columns headers in common with our reaction system.')
+    :param solver: a model_solvers.Solver instance
 
-    def process(row, species_set):
-        """
-        A method for using with apply on the row axis
-        sets up the initiial conditions and runs until convergence
-        returns a pandas Series with the equilibrium concentrations of all species
-        """
-        ic = {}
-        for s in species_set:
-            try:
-                ic[s] = row[s]
-            except KeyError as ex:
-                ic[s] = 0.0
-
-        sample_to_column_mapping, solution, t = solver.equilibrium_solution(X0=ic)
-
-        final_vals = solution[-1,:]
-        index = ['']*len(final_vals)
-        for sample, col_idx in sample_to_column_mapping.items():
-            index[col_idx] = sample
-        s = pd.Series(final_vals, index=index)
-        return s
-
-    results = df.apply(process, args=(species_set,), axis=1)
-    df = pd.concat([df,results], axis=1)
-    return df
+    :param input_path: the path of the input file, with a header row
+
+    :param passthrough: (optional) a list of further input columns copied to the output, or None for all of them
+
+    :param sep: (optional) the delimiter of the input file
+
+    :return: a list of the columns, in the order of the input file
+    """
+    header = pd.read_csv(input_path, sep=sep, nrows=0).columns.tolist()
+    species = set(solver.get_species_mapping().keys())
+    if len(species.intersection(header)) == 0:
+        raise BatchCalculationException('The input file did not contain any columns headers in common with our reaction system.')
+    if passthrough is None:
+        return header
+    missing = set(passthrough).difference(header)
+    if len(missing) > 0:
+        raise BatchCalculationException('The input file did not contain the columns: %s'
+                                        % ', '.join(map(str, sorted(missing))))
+    needed = species.union(passthrough)
+    return [c for c in header if c in needed or parameter_sweep.RATE_CONSTANT_COLUMN.match(str(c))]
+
+
+def read_chunks(input_path, columns, chunk_size=None, sep='\t', skip_rows=0):
+    """
+    Reads a delimited file in chunks of rows
+
+    :param input_path: the path of the input file, with a header row
+
+    :param columns: the columns read, see input_columns
+
+    :param chunk_size: (optional) the number of rows in each chunk.  Defaults to BATCH_CHUNK_ROWS
+
+    :param sep: (optional) the delimiter of the input file
+
+    :param skip_rows: (optional) the number of rows after the header which are not read.  They are passed over as
+    lines of text, without being parsed.
+
+    :return: a generator of Pandas DataFrames, indexed by the row of the input file
+    """
+    if chunk_size is None:
+        chunk_size = BATCH_CHUNK_ROWS
+    header = pd.read_csv(input_path, sep=sep, nrows=0).columns.tolist()
+    with open(input_path) as f:
+        for line in range(skip_rows + 1):
+            f.readline()
+        for chunk in pd.read_csv(f, sep=sep, header=None, names=header, usecols=columns, chunksize=chunk_size):
+            chunk.index += skip_rows
+            # usecols does not keep the order given, so restore the order of the input file
+            yield chunk[columns]
+
+
+def process_batch_file(input_path, output_path, eqn_file, passthrough=None, chunk_size=None, sep='\t',
+                       output_sep=',', workers=None, output_format=None, trajectories=False, progress=None):
+    """
+    Streaming form of process_batch for delimited files of any size.  The input is read in chunks of rows, and the
+    results of each chunk are appended to the output file before the next is read, so the memory used does not
+    grow with the number of rows.  The model is read and compiled once for all the chunks.
+
+    Only the species columns, the rate constant columns (see process_batch) and the passthrough columns are read
+    from the input.  The output has the columns read, in the order of the input file, followed by the equilibrium
+    concentration of each species.
+
+    The output may be written as CSV or in one of the columnar formats (Parquet, Arrow or HDF5, see
+    result_writers), which store the numeric columns as float64.  HDF5 files can also hold the trajectory of each
+    row, see ODESolverWJacobian.ensemble_trajectories and result_writers.HDF5Writer.  The trajectories of each chunk
+    are integrated into a memory-mapped file in a temporary directory (see trajectory_store) and copied from there,
+    so they are never held in memory all at once.
+
+    :param input_path: the path of the input file, with a header row
+
+    :param output_path: the path of the output file, which is overwritten
+
+    :param eqn_file: a formatted model file
+
+    :param passthrough: (optional) a list of further input columns copied to the output, such as sample labels.  By
+    default every input column is kept; an empty list keeps only the columns needed for the calculation.
+
+    :param chunk_size: (optional) the number of rows read and solved at a time.  Defaults to BATCH_CHUNK_ROWS
+
+    :param sep: (optional) the delimiter of the input file.  Defaults to a tab
+
+    :param output_sep: (optional) the delimiter of the output file, for CSV
+
+    :param workers: (optional) the number of worker processes, see process_batch
+
+    :param output_format: (optional) the name of an output format, see result_writers.available_formats.  Defaults
+    to the format given by the extension of output_path, or CSV.
+
+    :param trajectories: (optional) if True, the trajectory of each row is stored too
+
+    :param progress: (optional) a callable, called as the rows are solved, see batch_monitor.BatchMonitor
+
+    :return: a batch_monitor.BatchSummary of the run, which is also written to the log
+    """
+    solver = create_solver(eqn_file)
+    n_workers = worker_count(workers)
+    columns = input_columns(solver, input_path, passthrough, sep)
+
+    if output_format is None:
+        output_format = result_writers.format_from_path(output_path)
+    options = {'sep': output_sep} if output_format == result_writers.CSVWriter.name else {}
+
+    n_rows = 0
+    monitor = batch_monitor.BatchMonitor(progress=progress)
+    trajectory_directory = tempfile.mkdtemp() if trajectories else None
+    try:
+        with result_writers.get_writer(output_path, output_format, **options) as writer:
+            if trajectories and not writer.stores_trajectories:
+                raise OutputFormatException('The %s format cannot store trajectories' % output_format)
+            for chunk in read_chunks(input_path, columns, chunk_size, sep):
+                writer.write(solve_dataframe(solver, eqn_file, chunk, n_workers, monitor))
+                if trajectories:
+                    t, X = solver.ensemble_trajectories(initial_condition_matrix(solver, chunk),
+                                                        parameter_sweep.rate_constants_from_dataframe(solver, chunk),
+                                                        store=os.path.join(trajectory_directory,
+                                                                           TRAJECTORY_STORE_FILE))
+                    writer.write_trajectories(chunk.index.values, t, X, species_names(solver))
+                    del X
+                n_rows += chunk.shape[0]
+            if n_rows == 0:
+                writer.write(pd.DataFrame(columns=columns + species_names(solver)))
+    finally:
+        if trajectory_directory is not None:
+            shutil.rmtree(trajectory_directory, ignore_errors=True)
+    return monitor.finish()
@@ -0,0 +1,268 @@
+__author__ = 'brian'
+
+# Runs a batch from the command line, for inputs too large for the web uploader:
+#
+#     python batch_runner.py model_file input_file output_file [--workers N] [--chunk-size N] [--format F]
+#
+# The input is solved in numbered chunks, each written to its own file in a work directory next to the output
+# (output_file.chunks) and recorded in a manifest as it finishes.  If the run is stopped, running the same command
+# again resumes from the first unfinished chunk.  Once all the chunks are done they are joined into the output file.
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sys
+import time
+
+import pandas as pd
+
+import batch_monitor
+import batch_process
+import result_writers
+from custom_exceptions import *
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = 'manifest.json'
+
+# the work directory is the output path with this suffix
+CHUNK_DIRECTORY_SUFFIX = '.chunks'
+
+
+def _file_hash(path):
+    """
+    :param path: the path of a file
+
+    :return: the sha1 hex digest of the contents of the file
+    """
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _run_settings(eqn_file, input_path, chunk_size, output_format, passthrough, sep):
+    """
+    Describes everything which determines the contents of the chunks, so a run is only resumed with the same model,
+    input and options
+
+    :return: a dictionary which can be stored as JSON
+    """
+    status = os.stat(input_path)
+    return {'model': _file_hash(eqn_file),
+            'input': os.path.abspath(input_path),
+            'input_size': status.st_size,
+            'input_modified': status.st_mtime,
+            'chunk_size': chunk_size,
+            'output_format': output_format,
+            'passthrough': None if passthrough is None else list(passthrough),
+            'sep': sep}
+
+
+def _write_json(data, path):
+    """
+    Writes a JSON file atomically, so a run stopped partway never leaves a truncated file
+
+    :return: None
+    """
+    temporary = path + '.tmp'
+    with open(temporary, 'w') as f:
+        json.dump(data, f, indent=1, sort_keys=True)
+    os.rename(temporary, path)
+
+
+def _chunk_path(directory, number, output_format):
+    """
+    :return: the path of the file holding the results of a chunk
+    """
+    return os.path.join(directory, 'chunk_%06d.%s' % (number, output_format))
+
+
+def _load_manifest(directory, settings, restart):
+    """
+    Reads the manifest of an earlier run, or starts a new one
+
+    :param directory: the work directory
+
+    :param settings: the settings of this run, see _run_settings
+
+    :param restart: if True, any earlier run is discarded
+
+    :return: the manifest, a dictionary with the settings, the rows in each finished chunk (keyed by the chunk number
+    as a string), the total number of chunks once known, and whether the output has been written
+    """
+    path = os.path.join(directory, MANIFEST_FILE)
+    if os.path.exists(path) and not restart:
+        with open(path) as f:
+            manifest = json.load(f)
+        if manifest['settings'] != settings:
+            raise batch_process.BatchCalculationException('%s holds a run with a different model, input or options.  '
+                                                          'Run with --restart to discard it.' % directory)
+        return manifest
+
+    if os.path.exists(directory):
+        shutil.rmtree(directory)
+    os.makedirs(directory)
+    manifest = {'settings': settings, 'completed': {}, 'chunks': None, 'finished': False}
+    _write_json(manifest, path)
+    return manifest
+
+
+def _join_chunks(directory, manifest, output_path, output_format, columns):
+    """
+    Writes the results of all the chunks, in order, into the output file
+
+    :return: None
+    """
+    paths = [_chunk_path(directory, number, output_format) for number in range(manifest['chunks'])]
+    if output_format == result_writers.CSVWriter.name and len(paths) > 0:
+        # CSV chunks are joined as text, which keeps the header exactly as written
+        with open(output_path, 'w') as output:
+            for number, path in enumerate(paths):
+                with open(path) as chunk:
+                    if number > 0:
+                        chunk.readline()
+                    shutil.copyfileobj(chunk, output)
+        return
+
+    with result_writers.get_writer(output_path, output_format) as writer:
+        for path in paths:
+            writer.write(result_writers.read_results(path, output_format))
+        if len(paths) == 0:
+            writer.write(pd.DataFrame(columns=columns))
+
+
+def run_batch(eqn_file, input_path, output_path, chunk_size=None, workers=None, output_format=None, passthrough=None,
+              sep='\t', restart=False, keep_chunks=False, progress=None):
+    """
+    Solves a delimited file of initial conditions (see batch_process.process_batch_file) in numbered chunks, with a
+    checkpoint after each.  The results of each chunk are written to a file in the work directory, output_path +
+    CHUNK_DIRECTORY_SUFFIX, and then recorded in its manifest.  Calling this again with the same model, input and
+    options skips the chunks already recorded, so an interrupted run continues where it stopped.
+
+    :param eqn_file: a formatted model file
+
+    :param input_path: the path of the input file, with a header row
+
+    :param output_path: the path of the output file
+
+    :param chunk_size: (optional) the number of rows in each chunk.  Defaults to batch_process.BATCH_CHUNK_ROWS
+
+    :param workers: (optional) the number of worker processes, see batch_process.process_batch
+
+    :param output_format: (optional) the name of an output format, see result_writers.available_formats.  Defaults
+    to the format given by the extension of output_path.
+
+    :param passthrough: (optional) a list of further input columns copied to the output, see
+    batch_process.process_batch_file
+
+    :param sep: (optional) the delimiter of the input file
+
+    :param restart: (optional) if True, any earlier run is discarded rather than resumed
+
+    :param keep_chunks: (optional) if True, the work directory is kept once the output is written
+
+    :param progress: (optional) a callable, called as the rows of the chunks solved in this run are solved, see
+    batch_monitor.BatchMonitor.  A summary of the chunks solved in this run is written to the log.
+
+    :return: the number of rows in the output
+    """
+    if chunk_size is None:
+        chunk_size = batch_process.BATCH_CHUNK_ROWS
+    if output_format is None:
+        output_format = result_writers.format_from_path(output_path)
+    directory = output_path + CHUNK_DIRECTORY_SUFFIX
+    manifest_path = os.path.join(directory, MANIFEST_FILE)
+    manifest = _load_manifest(directory, _run_settings(eqn_file, input_path, chunk_size, output_format,
+                                                       passthrough, sep), restart)
+    if manifest['finished'] and os.path.exists(output_path):
+        logger.info('%s is already complete.' % output_path)
+        return sum(manifest['completed'].values())
+    if len(manifest['completed']) > 0:
+        logger.info('Resuming %s: %d chunks were already finished.' % (output_path, len(manifest['completed'])))
+
+    solver = batch_process.create_solver(eqn_file)
+    n_workers = batch_process.worker_count(workers)
+    columns = batch_process.input_columns(solver, input_path, passthrough, sep)
+
+    # the rows of the chunks finished before the first unfinished one are skipped without being parsed
+    n_chunks = 0
+    while str(n_chunks) in manifest['completed'] and os.path.exists(_chunk_path(directory, n_chunks, output_format)):
+        n_chunks += 1
+    skip_rows = sum(manifest['completed'][str(number)] for number in range(n_chunks))
+
+    monitor = batch_monitor.BatchMonitor(progress=progress)
+    for number, chunk in enumerate(batch_process.read_chunks(input_path, columns, chunk_size, sep, skip_rows),
+                                   n_chunks):
+        n_chunks = number + 1
+        path = _chunk_path(directory, number, output_format)
+        if str(number) in manifest['completed'] and os.path.exists(path):
+            continue
+        start = time.time()
+        result = batch_process.solve_dataframe(solver, eqn_file, chunk, n_workers, monitor)
+
+        # the chunk is only recorded once its file is complete
+        temporary = path + '.tmp'
+        with result_writers.get_writer(temporary, output_format) as writer:
+            writer.write(result)
+        os.rename(temporary, path)
+        manifest['completed'][str(number)] = chunk.shape[0]
+        _write_json(manifest, manifest_path)
+        logger.info('Chunk %d (%d rows) finished in %.1f s.' % (number, chunk.shape[0], time.time() - start))
+
+    monitor.finish()
+    manifest['chunks'] = n_chunks
+    _join_chunks(directory, manifest, output_path, output_format, columns + batch_process.species_names(solver))
+    manifest['finished'] = True
+    _write_json(manifest, manifest_path)
+    if not keep_chunks:
+        shutil.rmtree(directory)
+    n_rows = sum(manifest['completed'].values())
+    logger.info('Wrote %d rows to %s.' % (n_rows, output_path))
+    return n_rows
+
+
+def main(argv=None):
+    """
+    Parses the command line and runs the batch, see run_batch
+
+    :param argv: (optional) the command line arguments.  Defaults to sys.argv[1:]
+
+    :return: the exit status
+    """
+    parser = argparse.ArgumentParser(description='Solve a table of initial conditions for the equilibrium of a '
+                                                 'model, in chunks which are resumed if the run is interrupted.')
+    parser.add_argument('model', help='the model file')
+    parser.add_argument('input', help='the input table, with a column for each species given')
+    parser.add_argument('output', help='the output file')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='the number of worker processes (default: one per core)')
+    parser.add_argument('--chunk-size', type=int, default=batch_process.BATCH_CHUNK_ROWS,
+                        help='the number of rows in each chunk (default: %(default)s)')
+    parser.add_argument('--format', dest='output_format', choices=result_writers.available_formats(), default=None,
+                        help='the output format (default: from the extension of the output file, or csv)')
+    parser.add_argument('--passthrough', nargs='*', default=None,
+                        help='the input columns copied to the output, besides those used (default: all)')
+    parser.add_argument('--sep', default='\t', help='the delimiter of the input table (default: tab)')
+    parser.add_argument('--restart', action='store_true', help='discard an earlier run instead of resuming it')
+    parser.add_argument('--keep-chunks', action='store_true',
+                        help='keep the work directory once the output is written')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    try:
+        run_batch(args.model, args.input, args.output, chunk_size=args.chunk_size, workers=args.workers,
+                  output_format=args.output_format, passthrough=args.passthrough, sep=args.sep,
+                  restart=args.restart, keep_chunks=args.keep_chunks)
+    except (batch_process.BatchCalculationException, OutputFormatException) as ex:
+        logger.error(str(ex))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
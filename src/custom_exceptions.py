@@ -64,3 +64,39 @@ class ReactionErrorWithTrackerException(Exception):
     def __init__(self, error_index, detailed_message):
         self.error_index = error_index
         self.detailed_message = detailed_message
+
+
+class InvalidOutputModeException(Exception):
+    pass
+
+
+class UnknownIntegratorException(Exception):
+    pass
+
+
+class UnknownTolerancePresetException(Exception):
+    pass
+
+
+class InvalidRateConstantException(Exception):
+    pass
+
+
+class InvalidFitParameterException(Exception):
+    pass
+
+
+class MissingObservationsException(Exception):
+    pass
+
+
+class UnknownOutputFormatException(Exception):
+    pass
+
+
+class OutputFormatException(Exception):
+    pass
+
+
+class LookupTableException(Exception):
+    pass
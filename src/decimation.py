@@ -0,0 +1,47 @@
+__author__ = 'brian'
+
+# Chooses the points of a long trajectory to draw, so that plots of millions of points stay responsive.
+
+import numpy as np
+
+
+def lttb(t, y, n_out):
+    """
+    Downsamples a trajectory with the largest-triangle-three-buckets algorithm, which keeps the peaks and the shape
+    of the curve.  The first and last points are kept and the others are split into n_out - 2 buckets of consecutive
+    points.  Going through the buckets in order, the point kept from each is the one forming the largest triangle
+    with the point kept from the previous bucket and the mean of the next bucket.
+
+    :param t: a sorted numPy array of times
+
+    :param y: a numPy array of values, the same length as t
+
+    :param n_out: the number of points to keep
+
+    :return: a numPy array of the indexes of the points kept, in increasing order.  If there are no more than n_out
+    points, all of them are kept.  Fewer than three points keep only the endpoints: the first and last for two, and
+    the first for one.
+    """
+    n = len(t)
+    if n <= n_out:
+        return np.arange(n)
+    if n_out < 3:
+        return np.array([0, n - 1][:max(n_out, 0)], dtype=int)
+
+    # bucket b holds the points edges[b] up to edges[b+1]
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    counts = np.diff(edges).astype(float)
+    mean_t = np.append(np.add.reduceat(t[1:n - 1], edges[:-1] - 1)/counts, t[n - 1])
+    mean_y = np.append(np.add.reduceat(y[1:n - 1], edges[:-1] - 1)/counts, y[n - 1])
+
+    kept = np.empty(n_out, dtype=int)
+    kept[0] = 0
+    kept[-1] = n - 1
+    previous = 0
+    for b in range(n_out - 2):
+        start, stop = edges[b], edges[b + 1]
+        area = np.abs((t[previous] - mean_t[b + 1])*(y[start:stop] - y[previous]) -
+                      (t[previous] - t[start:stop])*(mean_y[b + 1] - y[previous]))
+        previous = start + np.argmax(area)
+        kept[b + 1] = previous
+    return kept
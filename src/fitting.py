@@ -0,0 +1,284 @@
+__author__ = 'brian'
+
+import logging
+import re
+
+import numpy as np
+import pandas as pd
+
+import batch_process
+import model_solvers
+import models
+import reaction_factories
+from custom_exceptions import *
+
+logger = logging.getLogger(__name__)
+
+# a measured equilibrium concentration is given in a column named after the species with this suffix, e.g. T_eq
+MEASURED_SUFFIX = '_eq'
+
+# The parameters which may be fitted: kf_q and kr_q are the forward and reverse rate constants of reaction q, and
+# K_q is its equilibrium constant kf_q/kr_q, which is varied through kf_q with kr_q held fixed.
+FIT_PARAMETER = re.compile(r'^(kf|kr|K)_(\d+)$')
+
+# Levenberg-Marquardt settings.  A start stops once an accepted step reduces the cost by less than FIT_FTOL times
+# the cost, or changes no logarithm of a parameter by more than FIT_XTOL.  It is abandoned once the damping exceeds
+# FIT_MAX_DAMPING without finding a step which reduces the cost.
+FIT_MAX_ITERATIONS = 200
+FIT_FTOL = 1e-10
+FIT_XTOL = 1e-10
+FIT_INITIAL_DAMPING = 1e-3
+FIT_MAX_DAMPING = 1e12
+
+# the starts after the first are drawn log-uniformly within this many decades of the values in the model
+START_SPREAD_DECADES = 1.0
+
+
+class FitResult(object):
+    """
+    The outcome of fit_rate_constants.
+
+    parameters is a dictionary mapping each fitted parameter to its value at the best start (the one with the lowest
+    cost), and rate_constants is the full array of rate constants there, ordered as in Solver._get_rate_constants.
+    cost is half the sum of the squared residuals and converged tells whether the best start met the stopping
+    criteria.  starts is a Pandas DataFrame with the final parameters, cost, convergence and number of iterations
+    of every start, and predicted is a Pandas DataFrame of the equilibrium concentrations at the best fit.
+    """
+
+    def __init__(self, parameters, rate_constants, cost, converged, starts, predicted):
+        self.parameters = parameters
+        self.rate_constants = rate_constants
+        self.cost = cost
+        self.converged = converged
+        self.starts = starts
+        self.predicted = predicted
+
+
+def _parameter_columns(solver, parameters):
+    """
+    Locates the fitted parameters in the array of rate constants
+
+    :param solver: a model_solvers.Solver instance
+
+    :param parameters: a list of parameter names (see FIT_PARAMETER)
+
+    :return: a list with the index of the rate constant varied by each parameter
+    """
+    columns = []
+    for name in parameters:
+        match = FIT_PARAMETER.match(str(name))
+        if match is None or int(match.group(2)) >= solver.J:
+            raise InvalidFitParameterException('Cannot fit %s.  Parameters are named kf_q, kr_q or K_q, where q is '
+                                               'a reaction index below %d.' % (name, solver.J))
+        kind, q = match.group(1), int(match.group(2))
+        columns.append(q + solver.J if kind == 'kr' else q)
+        if kind == 'K' and ('kf_%d' % q in parameters or 'kr_%d' % q in parameters):
+            raise InvalidFitParameterException('Cannot fit K_%d together with a rate constant of reaction %d.'
+                                               % (q, q))
+    if len(set(columns)) != len(columns):
+        raise InvalidFitParameterException('Each parameter may only be given once.')
+    return columns
+
+
+def _rate_constants(solver, parameters, columns, theta):
+    """
+    Creates the rate constants for sets of parameter values
+
+    :param theta: a (S x P) numPy array of the natural logarithms of the parameters
+
+    :return: a (S x 2J) numPy array
+    """
+    k = np.tile(solver.kvals, (theta.shape[0], 1))
+    values = np.exp(theta)
+    for i, name in enumerate(parameters):
+        if name.startswith('K_'):
+            k[:, columns[i]] = values[:, i]*k[:, columns[i] + solver.J]
+        else:
+            k[:, columns[i]] = values[:, i]
+    return k
+
+
+def _rate_constants_to_parameters(solver, parameters, columns):
+    """
+    :return: the values of the parameters given by the rate constants of the model
+    """
+    values = np.empty(len(parameters))
+    for i, name in enumerate(parameters):
+        values[i] = solver.kvals[columns[i]]
+        if name.startswith('K_'):
+            reverse = solver.kvals[columns[i] + solver.J]
+            values[i] = values[i]/reverse if reverse > 0 else np.nan
+    if not np.all(values > 0) or not np.all(np.isfinite(values)):
+        raise InvalidFitParameterException('The fitted parameters need positive starting values in the model file.')
+    return values
+
+
+def _observations(solver, df, relative):
+    """
+    Reads the measured equilibrium concentrations from the dataframe
+
+    :return: a 3-tuple of (N x M) numPy arrays.  The measured concentrations, a boolean array marking the entries
+    which were measured, and the scale dividing each residual.
+    """
+    measured = np.nan*np.ones((df.shape[0], solver.M))
+    for symbol, index in solver.get_species_mapping().items():
+        column = symbol + MEASURED_SUFFIX
+        if column in df.columns:
+            measured[:, index] = pd.to_numeric(df[column], errors='coerce').values.astype(float)
+
+    observed = np.isfinite(measured)
+    if relative:
+        observed[observed] = measured[observed] > 0
+    if not np.any(observed):
+        raise MissingObservationsException('The dataframe does not contain any measured equilibrium concentrations.  '
+                                           'These are given in columns named after the species with the suffix %s'
+                                           % MEASURED_SUFFIX)
+    scale = np.where(observed, measured, 1.0) if relative else np.ones(measured.shape)
+    return measured, observed, scale
+
+
+def _levenberg_marquardt(evaluate, theta):
+    """
+    Minimizes half the sum of squared residuals from several starting points at once.  Every iteration evaluates
+    the trial steps of all the active starts together.
+
+    :param evaluate: a callable taking a (S x P) array of parameters and a guess for the equilibrium states (or
+    None), and returning the states, the (S x R) residuals, their (S x R x P) Jacobian and the S-length cost, which
+    is infinite where the equilibrium could not be found
+
+    :param theta: a (S x P) numPy array of starting parameters
+
+    :return: a 4-tuple of the (S x P) final parameters, their cost, a boolean array marking the starts which met the
+    stopping criteria, and the number of iterations of each start
+    """
+    theta = np.array(theta, dtype=float)
+    n_starts = theta.shape[0]
+    X, r, Jr, cost = evaluate(theta, None)
+    damping = FIT_INITIAL_DAMPING*np.ones(n_starts)
+    converged = np.zeros(n_starts, dtype=bool)
+    active = np.isfinite(cost)
+    iterations = np.zeros(n_starts, dtype=int)
+
+    identity = np.eye(theta.shape[1])
+    for iteration in range(FIT_MAX_ITERATIONS):
+        rows = np.where(active)[0]
+        if len(rows) == 0:
+            break
+        iterations[rows] += 1
+
+        # damp each direction in proportion to its curvature, so the step does not depend on the parameter scaling
+        JtJ = np.einsum('srp,srq->spq', Jr[rows], Jr[rows])
+        gradient = np.einsum('srp,sr->sp', Jr[rows], r[rows])
+        curvature = np.maximum(np.diagonal(JtJ, axis1=1, axis2=2), np.finfo(float).tiny)
+        A = JtJ + damping[rows, np.newaxis, np.newaxis]*curvature[:, :, np.newaxis]*identity
+        step = -np.linalg.solve(A, gradient[:, :, np.newaxis])[:, :, 0]
+
+        X_trial, r_trial, Jr_trial, cost_trial = evaluate(theta[rows] + step, X[rows])
+        accepted = cost_trial < cost[rows]
+        small_step = np.max(np.abs(step), axis=1) <= FIT_XTOL
+        small_reduction = accepted & (cost[rows] - cost_trial <= FIT_FTOL*cost[rows])
+
+        a = rows[accepted]
+        theta[a] += step[accepted]
+        X[a] = X_trial[accepted]
+        r[a] = r_trial[accepted]
+        Jr[a] = Jr_trial[accepted]
+        cost[a] = cost_trial[accepted]
+        damping[a] = np.maximum(damping[a]*0.3, np.finfo(float).eps)
+        damping[rows[~accepted]] *= 10
+
+        done = small_step | small_reduction
+        converged[rows[done]] = True
+        active[rows[done]] = False
+        active[rows[damping[rows] > FIT_MAX_DAMPING]] = False
+    return theta, cost, converged, iterations
+
+
+def fit_rate_constants(eqn_file, df, parameters, n_starts=1, start_spread=START_SPREAD_DECADES, random_state=None,
+                       relative=True):
+    """
+    Estimates rate constants or equilibrium constants from measured equilibrium concentrations by least squares.
+
+    Each row of the dataframe is one experiment.  As for batch_process.process_batch, its initial conditions are
+    given in columns named after the species.  The measured equilibrium concentrations are given in columns named
+    after the species with the suffix MEASURED_SUFFIX (e.g. T_eq); empty cells are not used.
+
+    The parameters are fitted on a logarithmic scale with a Levenberg-Marquardt iteration.  The gradient of the
+    equilibrium with respect to the parameters comes from the implicit function theorem (see
+    AlgebraicEquilibriumSolver.equilibrium_sensitivities), so every evaluation of the objective is a single
+    batched equilibrium solve of all the experiments for all the starts, started from the previous equilibria.
+
+    :param eqn_file: a formatted model file.  Its rate constants are the starting point of the fit, and the values
+    of those which are not fitted.
+
+    :param df: a Pandas DataFrame of initial conditions and measured equilibrium concentrations
+
+    :param parameters: a list of the parameters to fit.  kf_q and kr_q are the forward and reverse rate constants of
+    reaction q (numbered in the order of the model file) and K_q is the equilibrium constant kf_q/kr_q.
+
+    :param n_starts: (optional) the number of starting points.  The first is the model file; the others are drawn
+    log-uniformly within start_spread decades of it.
+
+    :param start_spread: (optional) see n_starts
+
+    :param random_state: (optional) a seed for drawing the starting points
+
+    :param relative: (optional) if True (the default), residuals are relative to the measured concentrations.
+    Otherwise they are the differences in concentration.
+
+    :return: a FitResult
+    """
+    factory = reaction_factories.FileReactionFactory(eqn_file)
+    solver = model_solvers.AlgebraicEquilibriumSolver(models.Model(factory))
+    parameters = list(parameters)
+    columns = _parameter_columns(solver, parameters)
+
+    X0 = batch_process.initial_condition_matrix(solver, df)
+    measured, observed, scale = _observations(solver, df, relative)
+    rows = np.all(np.isfinite(X0), axis=1)
+    if not np.all(rows):
+        logger.warning('%d rows with missing initial conditions are not used in the fit.' % np.sum(~rows))
+    X0, measured, observed, scale = X0[rows], measured[rows], observed[rows], scale[rows]
+    n_rows = X0.shape[0]
+
+    start = np.log(_rate_constants_to_parameters(solver, parameters, columns))
+    random = np.random.RandomState(random_state)
+    theta = np.tile(start, (n_starts, 1))
+    theta[1:] += random.uniform(-start_spread, start_spread, (n_starts - 1, len(parameters)))*np.log(10)
+
+    def evaluate(theta, guess):
+        k = np.repeat(_rate_constants(solver, parameters, columns, theta), n_rows, axis=0)
+        X0_starts = np.tile(X0, (theta.shape[0], 1))
+        X = solver.ensemble_equilibrium_solution(X0_starts, k,
+                                                 initial_guess=None if guess is None else guess.reshape(-1, solver.M))
+        found = solver.get_convergence_report().converged.reshape(-1, n_rows)
+
+        # the parameters scale their rate constant, so dX/dlog(parameter) = dX/dk*k
+        dX = solver.equilibrium_sensitivities(X0_starts, k, X, columns, initial_conditions=False)[1] * \
+            k[:, np.newaxis, columns]
+        X = X.reshape(-1, n_rows, solver.M)
+        dX = dX.reshape(-1, n_rows, solver.M, len(columns))
+        r = ((X - np.where(observed, measured, 0.0))/scale)[:, observed]
+        Jr = (dX/scale[:, :, np.newaxis])[:, observed, :]
+        cost = 0.5*np.sum(r**2, axis=1)
+        cost[~np.all(found, axis=1) | ~np.isfinite(cost)] = np.inf
+        return X, r, Jr, cost
+
+    theta, cost, converged, iterations = _levenberg_marquardt(evaluate, theta)
+    best = np.argmin(cost)
+    values = np.exp(theta)
+    logger.info('Fitted %s with cost %g (best of %d starts).' % (', '.join(parameters), cost[best], n_starts))
+
+    starts = pd.DataFrame(values, columns=parameters)
+    starts['cost'] = cost
+    starts['converged'] = converged
+    starts['iterations'] = iterations
+
+    k_best = _rate_constants(solver, parameters, columns, theta[best:best + 1])[0]
+    species = [''] * solver.M
+    for symbol, index in solver.get_species_mapping().items():
+        species[index] = symbol
+    predicted = pd.DataFrame(solver.ensemble_equilibrium_solution(X0, k_best), index=df.index[rows],
+                             columns=species)
+    return FitResult(dict(zip(parameters, values[best])), k_best, cost[best], converged[best], starts, predicted)
+
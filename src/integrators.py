@@ -0,0 +1,401 @@
+__author__ = 'brian'
+
+import warnings
+
+import numpy as np
+from scipy import integrate, sparse
+from scipy.sparse import linalg as sparse_linalg
+
+# solve_ivp (scipy >= 1.0) provides the BDF, Radau and RK45 integrators
+try:
+    from scipy.integrate import solve_ivp
+except ImportError:
+    solve_ivp = None
+
+from custom_exceptions import *
+
+
+# The (rtol, atol) pairs which may be requested by name.  'standard' matches the defaults of scipy.integrate.odeint
+TOLERANCE_PRESETS = {
+    'fast': (1e-4, 1e-7),
+    'standard': (1.49012e-8, 1.49012e-8),
+    'reference': (1e-11, 1e-13),
+}
+
+# systems whose stiffness (see estimate_stiffness) is below this are not considered stiff
+STIFFNESS_THRESHOLD = 1e3
+
+# the number of rows whose Jacobian is examined when estimating the stiffness of an ensemble
+STIFFNESS_SAMPLE_ROWS = 8
+
+
+class Integrator(object):
+    """
+    A base class for the integrators which advance a stack of independent systems in time.
+
+    The systems are passed as a (N x m) array of states.  rhs(Y) returns the (N x m) time rate-of-change and jac(Y)
+    returns either the (N x m x m) stack of Jacobians of the rows, or, for sparse_jacobian=True, a single
+    (N*m x N*m) scipy.sparse matrix for the whole stack.
+
+    Derived classes set a name, under which they are registered (see register_integrator), and implement integrate.
+    """
+    name = None
+
+    # whether the integrator can make use of a sparse Jacobian.  Others receive it as a dense matrix.
+    supports_sparse = False
+
+    def integrate(self, rhs, jac, Y0, t, rtol, atol, sparse_jacobian=False):
+        """
+        :param rhs: a callable taking a (N x m) state array and returning the (N x m) time rate-of-change
+
+        :param jac: a callable taking a (N x m) state array and returning the Jacobian, as described above
+
+        :param Y0: a (N x m) numPy array of starting states
+
+        :param t: a numPy array of the times at which the states are reported, starting with the time of Y0
+
+        :param rtol: the relative tolerance
+
+        :param atol: the absolute tolerance
+
+        :param sparse_jacobian: (optional) whether jac returns a sparse matrix rather than a stack of blocks
+
+        :return: a (len(t) x N x m) numPy array of the states at each of the times
+        """
+        raise NotImplementedError
+
+
+class OdeintIntegrator(Integrator):
+    """
+    LSODA through scipy.integrate.odeint, which switches between Adams and BDF methods as the stiffness changes.
+    The block-diagonal Jacobian of a stack is passed as a banded matrix, so the cost of the linear algebra grows
+    linearly with the number of rows.  A sparse Jacobian is packed into the bands it occupies, since LSODA takes no
+    sparse matrices and the dense (N*m x N*m) matrix would not fit in memory for large stacks.
+    """
+    name = 'lsoda'
+
+    # the maximum number of internal steps the integrator may take between two output times
+    MAX_STEPS = 100000
+
+    def integrate(self, rhs, jac, Y0, t, rtol, atol, sparse_jacobian=False):
+        n_rows, m = Y0.shape
+        if sparse_jacobian:
+            # the sparse Jacobians keep the same pattern of entries as the states change
+            entries = sparse.coo_matrix(jac(Y0))
+            ml = int(max(np.max(entries.row - entries.col), 0)) if entries.nnz else 0
+            mu = int(max(np.max(entries.col - entries.row), 0)) if entries.nnz else 0
+            Dfun = lambda y, time: banded_sparse(jac(y.reshape(n_rows, m)), ml, mu)
+            bands = {'ml': ml, 'mu': mu}
+        else:
+            Dfun = lambda y, time: banded_block_diagonal(jac(y.reshape(n_rows, m)))
+            bands = {'ml': m - 1, 'mu': m - 1}
+        Y = integrate.odeint(lambda y, time: rhs(y.reshape(n_rows, m)).ravel(),
+                             Y0.ravel(),
+                             t,
+                             Dfun=Dfun,
+                             rtol=rtol,
+                             atol=atol,
+                             mxstep=OdeintIntegrator.MAX_STEPS,
+                             **bands)
+        return Y.reshape(len(t), n_rows, m)
+
+
+class SolveIvpIntegrator(Integrator):
+    """
+    A method of scipy.integrate.solve_ivp.  The Jacobian of a stack is passed to the implicit methods (BDF and Radau)
+    as a sparse block-diagonal matrix, which they factor with a sparse LU decomposition.  The explicit methods (RK45)
+    never use the Jacobian.
+    """
+    supports_sparse = True
+
+    def __init__(self, name, method, implicit=True):
+        self.name = name
+        self.method = method
+        self.implicit = implicit
+
+    def integrate(self, rhs, jac, Y0, t, rtol, atol, sparse_jacobian=False):
+        n_rows, m = Y0.shape
+        if sparse_jacobian:
+            jac_func = lambda time, y: jac(y.reshape(n_rows, m))
+        elif n_rows == 1:
+            jac_func = lambda time, y: jac(y.reshape(1, m))[0]
+        else:
+            jac_func = lambda time, y: sparse_block_diagonal(jac(y.reshape(n_rows, m)))
+        options = {'jac': jac_func} if self.implicit else {}
+        solution = solve_ivp(lambda time, y: rhs(y.reshape(n_rows, m)).ravel(),
+                             (t[0], t[-1]),
+                             Y0.ravel(),
+                             method=self.method,
+                             t_eval=t,
+                             rtol=rtol,
+                             atol=atol,
+                             **options)
+        Y = np.empty((len(t), n_rows*m))
+        Y.fill(np.nan)
+        Y[:solution.y.shape[1]] = solution.y.T
+        if not solution.success:
+            warnings.warn('%s integration failed: %s' % (self.method, solution.message))
+        return Y.reshape(len(t), n_rows, m)
+
+
+class RosenbrockIntegrator(Integrator):
+    """
+    A linearly implicit Rosenbrock method of order 2 with an embedded third order error estimate, following the
+    ode23s method of Shampine and Reichelt (SIAM J. Sci. Comput. 18, 1997).  Each step needs one Jacobian and one
+    factorization of W = I - h*d*J, and no Newton iterations, so it is cheap at loose tolerances for stiff systems.
+
+    The whole stack takes common steps.  The blocks of W are inverted together, or a sparse W is factored with a
+    sparse LU decomposition.  States between steps come from the continuous extension of the method.
+    """
+    name = 'rosenbrock'
+    supports_sparse = True
+
+    D = 1.0/(2.0 + np.sqrt(2.0))
+    E32 = 6.0 + np.sqrt(2.0)
+
+    # the maximum number of steps, accepted or rejected, over the whole integration
+    MAX_STEPS = 100000
+
+    def integrate(self, rhs, jac, Y0, t, rtol, atol, sparse_jacobian=False):
+        d = RosenbrockIntegrator.D
+        result = np.empty((len(t),) + Y0.shape)
+        result.fill(np.nan)
+        result[0] = Y0
+
+        t_now, t_end = t[0], t[-1]
+        y = np.array(Y0, dtype=float)
+        F0 = rhs(y)
+        threshold = atol/rtol
+
+        # the initial step size, chosen so that the first step changes the state by about rtol**(1/3)
+        rh = 1.25*np.max(np.abs(F0)/np.maximum(np.abs(y), threshold))/rtol**(1.0/3)
+        h = t_end - t_now if rh*(t_end - t_now) <= 1 else 1.0/rh
+
+        next_output = 1
+        jacobian = None
+        steps = 0
+        while next_output < len(t):
+            if steps == RosenbrockIntegrator.MAX_STEPS:
+                warnings.warn('Rosenbrock integration failed: exceeded %d steps' % RosenbrockIntegrator.MAX_STEPS)
+                break
+            steps += 1
+            if h <= 16*np.finfo(float).eps*abs(t_now) or h == 0:
+                warnings.warn('Rosenbrock integration failed: step size too small at t=%g' % t_now)
+                break
+            final_step = h >= t_end - t_now
+            if final_step:
+                h = t_end - t_now
+
+            # the Jacobian is only recomputed after an accepted step
+            if jacobian is None:
+                jacobian = jac(y)
+            solve = self._factor(jacobian, h*d, y.shape, sparse_jacobian)
+
+            k1 = solve(F0)
+            F1 = rhs(y + 0.5*h*k1)
+            k2 = solve(F1 - k1) + k1
+            y_new = y + h*k2
+            F2 = rhs(y_new)
+            k3 = solve(F2 - RosenbrockIntegrator.E32*(k2 - F1) - 2.0*(k1 - F0))
+
+            scale = np.maximum(np.maximum(np.abs(y), np.abs(y_new)), threshold)
+            err = h/6.0*np.max(np.abs(k1 - 2.0*k2 + k3)/scale)/rtol
+            if not np.isfinite(err):
+                err = np.inf
+
+            if err <= 1.0:
+                t_new = t_end if final_step else t_now + h
+                while next_output < len(t) and t[next_output] <= t_new:
+                    s = (t[next_output] - t_now)/h
+                    result[next_output] = y + h*(s*(1 - s)/(1 - 2*d)*k1 + s*(s - 2*d)/(1 - 2*d)*k2)
+                    next_output += 1
+                t_now, y, F0 = t_new, y_new, F2
+                jacobian = None
+            h *= 5.0 if err == 0 else min(5.0, max(0.1, 0.8*err**(-1.0/3)))
+        return result
+
+    @staticmethod
+    def _factor(jacobian, hd, shape, sparse_jacobian):
+        """
+        Prepares the solution of W.x = b with W = I - hd*J
+
+        :param jacobian: the (N x m x m) stack of Jacobians, or a sparse (N*m x N*m) matrix
+
+        :param hd: the step size times the method constant d
+
+        :param shape: the (N x m) shape of the states
+
+        :param sparse_jacobian: whether the Jacobian is a sparse matrix
+
+        :return: a callable taking a (N x m) array b and returning the (N x m) solution x
+        """
+        if sparse_jacobian:
+            lu = sparse_linalg.splu(sparse.csc_matrix(sparse.identity(jacobian.shape[0]) - hd*jacobian))
+            return lambda b: lu.solve(b.ravel()).reshape(shape)
+        W_inv = np.linalg.inv(np.eye(shape[1])[np.newaxis, :, :] - hd*jacobian)
+        return lambda b: np.einsum('nij,nj->ni', W_inv, b)
+
+
+def banded_block_diagonal(blocks):
+    """
+    Packs a block-diagonal matrix into the banded storage expected by scipy.integrate.odeint.  With (m x m) blocks
+    both the upper and lower bandwidths are m-1.
+
+    :param blocks: a (N x m x m) numPy array of the diagonal blocks
+
+    :return: a (2m-1 x N*m) numPy array holding the bands of the matrix
+    """
+    n_rows, m = blocks.shape[:2]
+
+    # odeint expects jac[i - j + mu, j] to hold the derivative of equation i with respect to variable j
+    a, b = np.indices((m, m))
+    band_rows = np.broadcast_to(a - b + m - 1, blocks.shape)
+    band_cols = np.arange(n_rows)[:, np.newaxis, np.newaxis]*m + b[np.newaxis, :, :]
+    band = np.zeros((2*m - 1, n_rows*m))
+    band[band_rows, band_cols] = blocks
+    return band
+
+
+def banded_sparse(matrix, ml, mu):
+    """
+    Packs a sparse matrix into the banded storage expected by scipy.integrate.odeint, without forming the dense
+    matrix
+
+    :param matrix: a square scipy.sparse matrix whose entries all lie within the bands
+
+    :param ml: the lower bandwidth
+
+    :param mu: the upper bandwidth
+
+    :return: a (ml+mu+1 x n) numPy array holding the bands of the matrix
+    """
+    entries = sparse.coo_matrix(matrix)
+    band = np.zeros((ml + mu + 1, matrix.shape[1]))
+    band[entries.row - entries.col + mu, entries.col] = entries.data
+    return band
+
+
+def sparse_block_diagonal(blocks):
+    """
+    Assembles a block-diagonal sparse matrix
+
+    :param blocks: a (N x m x m) numPy array of the diagonal blocks
+
+    :return: a (N*m x N*m) scipy.sparse.csc_matrix
+    """
+    n_rows, m = blocks.shape[:2]
+    a, b = np.indices((m, m))
+    offsets = np.arange(n_rows)[:, np.newaxis, np.newaxis]*m
+    return sparse.csc_matrix((blocks.ravel(), ((offsets + a).ravel(), (offsets + b).ravel())),
+                             shape=(n_rows*m, n_rows*m))
+
+
+# the available integrators, keyed by name
+_integrators = {}
+
+
+def register_integrator(integrator):
+    """
+    Makes an integrator available by its name, replacing any integrator registered under the same name
+
+    :param integrator: an instance of a class derived from Integrator
+
+    :return: None
+    """
+    _integrators[integrator.name] = integrator
+
+
+def get_integrator(name):
+    """
+    :param name: the name of a registered integrator
+
+    :return: the Integrator instance
+    """
+    if name not in _integrators:
+        raise UnknownIntegratorException('Unknown integrator %s.  Available integrators are: %s'
+                                         % (name, ', '.join(available_integrators())))
+    return _integrators[name]
+
+
+def available_integrators():
+    """
+    :return: a sorted list of the names of the registered integrators
+    """
+    return sorted(_integrators.keys())
+
+
+def get_tolerances(preset):
+    """
+    :param preset: the name of one of the TOLERANCE_PRESETS
+
+    :return: a 2-tuple of the relative and absolute tolerance
+    """
+    if preset not in TOLERANCE_PRESETS:
+        raise UnknownTolerancePresetException('Unknown tolerance preset %s.  Choose one of: %s'
+                                              % (preset, ', '.join(sorted(TOLERANCE_PRESETS.keys()))))
+    return TOLERANCE_PRESETS[preset]
+
+
+def estimate_stiffness(jacobian, tspan, sparse_jacobian=False):
+    """
+    Estimates the stiffness of a system as the rate of its fastest mode times the length of the integration, which
+    is the number of the shortest time constants that fit in the integration.  The ratio of the fastest to the
+    slowest rate is not used, since our systems relax to equilibrium: once they are there, nothing changes on any
+    time scale, but an explicit method is still limited to steps around the shortest time constant.
+
+    For a stack of Jacobians the rates are the absolute values of the eigenvalues, and the largest among the first
+    STIFFNESS_SAMPLE_ROWS rows is used.  A sparse Jacobian is too large for an eigendecomposition, so the fastest
+    rate is bounded by the largest absolute row sum instead (Gershgorin's theorem).
+
+    :param jacobian: a (N x m x m) stack of Jacobians, or a sparse matrix
+
+    :param tspan: the length of the integration
+
+    :param sparse_jacobian: whether the Jacobian is a sparse matrix
+
+    :return: a float
+    """
+    if sparse_jacobian:
+        entries = sparse.coo_matrix(jacobian)
+        fastest = np.max(np.bincount(entries.row, weights=np.abs(entries.data))) if entries.nnz else 0.0
+    elif jacobian.shape[1] == 0:
+        fastest = 0.0
+    else:
+        fastest = np.max(np.abs(np.linalg.eigvals(jacobian[:STIFFNESS_SAMPLE_ROWS])))
+    return fastest*tspan
+
+
+def select_integrator(stiffness, sparse_jacobian=False):
+    """
+    Chooses an integrator for a system.  The stiffness only decides the choice for a sparse Jacobian; systems with a
+    stack of Jacobian blocks always use LSODA.
+
+    LSODA detects stiffness itself: it stays with its explicit Adams methods on systems which are not stiff, so it
+    never needs the Jacobian, and on stiff systems with the banded block-diagonal Jacobian its compiled BDF was
+    faster than the other integrators at every tolerance preset.  A sparse Jacobian would have to be passed to LSODA
+    in banded storage, which for large models spans most of the matrix, so systems on the sparse path use RK45 if
+    they are not stiff and BDF with a sparse LU decomposition if they are.  Without solve_ivp they use the
+    Rosenbrock integrator.
+
+    :param stiffness: the stiffness of the system, see estimate_stiffness.  Not used without a sparse Jacobian, so
+    it need not be estimated then and may be None.
+
+    :param sparse_jacobian: whether the Jacobian is a sparse matrix
+
+    :return: an Integrator instance
+    """
+    if not sparse_jacobian:
+        return get_integrator('lsoda')
+    if solve_ivp is None:
+        return get_integrator('rosenbrock')
+    if stiffness < STIFFNESS_THRESHOLD:
+        return get_integrator('rk45')
+    return get_integrator('bdf')
+
+
+register_integrator(OdeintIntegrator())
+register_integrator(RosenbrockIntegrator())
+if solve_ivp is not None:
+    register_integrator(SolveIvpIntegrator('bdf', 'BDF'))
+    register_integrator(SolveIvpIntegrator('radau', 'Radau'))
+    register_integrator(SolveIvpIntegrator('rk45', 'RK45', implicit=False))
@@ -0,0 +1,575 @@
+__author__ = 'brian'
+
+# Precomputed equilibrium surfaces for fixed models.
+#
+# Models such as those in the models directory have fixed rate constants and only a few required initial conditions,
+# so their equilibrium is a smooth function of three or four inputs.  build_table solves a model once over a grid of
+# those inputs, offline:
+#
+#     python lookup_tables.py table_directory models/Testosterone.model models/Vermeulen.model
+#
+# and TabulatedEquilibriumSolver answers rows inside the grid by interpolation, solving the rest as
+# AlgebraicEquilibriumSolver does.  Tables are only used once a directory is set in TABLE_DIRECTORY.
+
+import argparse
+import hashlib
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+from scipy import ndimage
+
+import model_solvers
+import models
+import reaction_factories
+import result_cache
+from custom_exceptions import *
+
+logger = logging.getLogger(__name__)
+
+# the directory searched for tables by create_solver.  None disables the tables.
+TABLE_DIRECTORY = None
+
+# the default largest error accepted, in the natural log of each concentration (roughly the relative error)
+TABLE_TOLERANCE = 1e-3
+
+# without a range given, each input spans this many decades either side of its initial condition in the model file
+DEFAULT_DECADES = 2
+
+# each axis starts with this many points and is refined by halving its spacing, while the grid stays within
+# MAX_TABLE_POINTS
+INITIAL_AXIS_POINTS = 9
+MAX_TABLE_POINTS = 250000
+
+# an axis is refined until this fraction of the grid points is predicted to interpolate within the tolerance along
+# it.  Regions where the surface bends sharply (e.g. where a binding protein saturates) would otherwise take the
+# whole budget, and fall back to solving anyway.
+REFINEMENT_QUANTILE = 0.97
+
+# the smallest concentration stored; the surfaces are interpolated in the log of the concentrations
+MIN_CONCENTRATION = 1e-300
+
+TABLE_SUFFIX = '.npz'
+
+# the tables read so far, keyed by their path and modification time, so that each is only read from disk once
+_loaded_tables = {}
+
+
+def table_key(solver):
+    """
+    Identifies the equilibrium surface of a model: its structure (see Solver.get_model_hash) and its rate constants,
+    quantized as for the cache keys (see result_cache.quantize).
+
+    :param solver: a model_solvers.Solver instance
+
+    :return: a hex string
+    """
+    return hashlib.sha1(solver.get_model_hash() + '|' + result_cache.quantize(solver.kvals).tobytes()).hexdigest()
+
+
+class EquilibriumTable(object):
+    """
+    The equilibrium concentrations of every species of a model over a grid of its required initial conditions (the
+    inputs), with all other species starting at zero.
+
+    The grid is evenly spaced in the log of each input.  The log of each equilibrium concentration is interpolated
+    with a cubic spline, whose coefficients are stored (see _spline_coefficients).  Each cell of the grid also holds
+    an estimate of the largest interpolation error within it, in the log of the concentrations: the error measured at
+    the centre of each cell, maximized over the neighbouring cells, since the spline through a cell depends on the
+    points around it.
+    """
+
+    def __init__(self, key, inputs, species, rate_constants, lower, upper, coefficients, cell_error, tolerance):
+        """
+
+        :param key: the table_key of the model
+
+        :param inputs: a list of the d species which are the inputs
+
+        :param species: a list of the M species, ordered according to the species-to-index map
+
+        :param rate_constants: the 2J-length array of rate constants of the model
+
+        :param lower: a d-length array of the log of the smallest value of each input
+
+        :param upper: a d-length array of the log of the largest value of each input
+
+        :param coefficients: a (M x (n_1 + 2) x ... x (n_d + 2)) array of the spline coefficients of the log
+        concentrations
+
+        :param cell_error: a ((n_1 - 1) x ... x (n_d - 1)) array of the estimated error in each cell
+
+        :param tolerance: the tolerance the table was built for
+
+        :return: None
+        """
+        self.key = key
+        self.inputs = list(inputs)
+        self.species = list(species)
+        self.rate_constants = np.asarray(rate_constants, dtype=float)
+        self.lower = np.asarray(lower, dtype=float)
+        self.upper = np.asarray(upper, dtype=float)
+        self.coefficients = np.asarray(coefficients, dtype=float)
+        self.cell_error = np.asarray(cell_error, dtype=float)
+        self.tolerance = float(tolerance)
+
+    @property
+    def shape(self):
+        """
+        :return: the number of points along each axis
+        """
+        return tuple(n - 2 for n in self.coefficients.shape[1:])
+
+    def _grid_coordinates(self, points):
+        """
+        :param points: a (N x d) numPy array of the log of the inputs
+
+        :return: a (d x N) numPy array of the positions of the points in units of the grid spacing, from the first
+        point of each axis
+        """
+        spacing = (self.upper - self.lower)/(np.array(self.shape) - 1)
+        return ((points - self.lower)/spacing).T
+
+    def interpolate(self, inputs):
+        """
+        Interpolates the equilibrium for many rows at once
+
+        :param inputs: a (N x d) numPy array of the inputs, ordered as EquilibriumTable.inputs
+
+        :return: a 2-tuple of the (N x M) numPy array of equilibrium concentrations and a N-length array of the
+        estimated error of each row.  Rows outside the grid give NaN for both.
+        """
+        inputs = np.atleast_2d(np.asarray(inputs, dtype=float))
+        n_rows = inputs.shape[0]
+        X = np.nan*np.ones((n_rows, len(self.species)))
+        error = np.nan*np.ones(n_rows)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            points = np.log(inputs)
+        inside = np.where(np.all((points >= self.lower) & (points <= self.upper), axis=1))[0]
+        if len(inside) == 0:
+            return X, error
+
+        coordinates = self._grid_coordinates(points[inside])
+        for j in range(len(self.species)):
+            # the first coefficient of each axis lies before the grid
+            X[inside, j] = ndimage.map_coordinates(self.coefficients[j], coordinates + 1, order=3, mode='nearest',
+                                                   prefilter=False)
+        X[inside] = np.exp(X[inside])
+        cells = np.minimum(np.floor(coordinates).astype(int), np.array(self.cell_error.shape)[:, np.newaxis] - 1)
+        error[inside] = self.cell_error[tuple(cells)]
+        return X, error
+
+    def save(self, path):
+        """
+        Writes the table to a numPy .npz file
+
+        :param path: the path of the file
+
+        :return: None
+        """
+        np.savez_compressed(path, key=self.key, inputs=self.inputs, species=self.species,
+                            rate_constants=self.rate_constants, lower=self.lower, upper=self.upper,
+                            coefficients=self.coefficients, cell_error=self.cell_error, tolerance=self.tolerance)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Reads a table written by EquilibriumTable.save
+
+        :param path: the path of the file
+
+        :return: an EquilibriumTable
+        """
+        with np.load(path) as data:
+            return cls(str(data['key']), [str(x) for x in data['inputs']], [str(x) for x in data['species']],
+                       data['rate_constants'], data['lower'], data['upper'], data['coefficients'],
+                       data['cell_error'], float(data['tolerance']))
+
+
+def _input_matrix(solver, inputs, values):
+    """
+    :param solver: a model_solvers.Solver instance
+
+    :param inputs: a list of the d input species
+
+    :param values: a (N x d) numPy array of their initial concentrations
+
+    :return: the (N x M) numPy array of initial conditions, with the other species at zero
+    """
+    mapping = solver.get_species_mapping()
+    X0 = np.zeros((values.shape[0], solver.M))
+    for i, symbol in enumerate(inputs):
+        X0[:, mapping[symbol]] = values[:, i]
+    return X0
+
+
+def _solve_points(solver, inputs, points):
+    """
+    Solves the equilibrium at points given in the log of the inputs
+
+    :return: a 2-tuple of the (N x M) numPy array of the log concentrations (zero where the row did not converge) and
+    a N-length boolean array of the rows which converged
+    """
+    X = solver.ensemble_equilibrium_solution(_input_matrix(solver, inputs, np.exp(points)), warm_start=True)
+    converged = solver.get_convergence_report().converged
+    log_X = np.log(np.maximum(np.where(converged[:, np.newaxis], X, 1.0), MIN_CONCENTRATION))
+    return log_X, converged
+
+
+def _grid_points(lower, upper, shape):
+    """
+    :return: a (prod(shape) x d) numPy array of the points of the grid, with the last axis varying fastest
+    """
+    axes = [np.linspace(low, high, n) for low, high, n in zip(lower, upper, shape)]
+    return np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1).reshape(-1, len(shape))
+
+
+def _spline_matrix(n):
+    """
+    Creates the matrix giving the coefficients of the cubic B-spline interpolating n evenly spaced values.  There is
+    one coefficient beyond each end, fixed by the not-a-knot condition (the third derivative is continuous at the
+    second and second-to-last points).  scipy.ndimage.spline_filter instead mirrors the values at the ends, which
+    flattens the spline there and spoils the surfaces near the edges of the grid.
+
+    :param n: the number of values
+
+    :return: a ((n + 2) x n) numPy array
+    """
+    A = np.zeros((n + 2, n + 2))
+    for i in range(n):
+        A[i, i:i + 3] = [1/6.0, 4/6.0, 1/6.0]
+    A[n, :5] = [1, -4, 6, -4, 1]
+    A[n + 1, -5:] = [1, -4, 6, -4, 1]
+    return np.linalg.inv(A)[:, :n]
+
+
+def _spline_coefficients(values):
+    """
+    :param values: a (n_1 x ... x n_d x M) numPy array of the log concentrations at the points of the grid
+
+    :return: the (M x (n_1 + 2) x ... x (n_d + 2)) numPy array of the spline coefficients, see _spline_matrix
+    """
+    for axis in range(values.ndim - 1):
+        values = np.moveaxis(np.tensordot(_spline_matrix(values.shape[axis]), values, axes=([1], [axis])), 0, axis)
+    return np.moveaxis(values, -1, 0)
+
+
+def _axis_error(values, axis):
+    """
+    Predicts the error of cubic interpolation along one axis of the grid.  Every other point is predicted from the
+    points either side of it, at twice the spacing, and the error is scaled down by 2^4 as for cubic interpolation.
+
+    :param values: a (n_1 x ... x n_d x M) numPy array of the log concentrations at the points of the grid
+
+    :param axis: the axis
+
+    :return: the REFINEMENT_QUANTILE quantile of the predicted error over the points, taking the largest error of
+    the species at each
+    """
+    n = values.shape[axis]
+    if n < 7:
+        return np.inf
+    take = lambda start: np.take(values, np.arange(start, start + n - 6, 2), axis=axis)
+    predicted = (-take(0) + 9*take(2) + 9*take(4) - take(6))/16.0
+    error = np.max(np.abs(predicted - take(3)), axis=-1)/16.0
+    return np.percentile(error, 100*REFINEMENT_QUANTILE)
+
+
+def build_table(eqn_file, ranges=None, tolerance=TABLE_TOLERANCE, max_points=MAX_TABLE_POINTS):
+    """
+    Solves a model over a grid of its required initial conditions.  Each axis starts with INITIAL_AXIS_POINTS
+    points, and the axis along which interpolation is predicted to be worst (see REFINEMENT_QUANTILE) has its
+    spacing halved, until every axis is within the tolerance or the grid would exceed max_points.  The error of the
+    final grid is then measured at the centre of every cell (see EquilibriumTable).
+
+    :param eqn_file: a formatted model file, with required initial conditions
+
+    :param ranges: (optional) a dictionary mapping input species to the (smallest, largest) concentrations
+    covered.  Other inputs span DEFAULT_DECADES either side of their initial condition in the model file.
+
+    :param tolerance: (optional) the largest acceptable error, in the natural log of the concentrations
+
+    :param max_points: (optional) the largest number of points in the grid
+
+    :return: an EquilibriumTable
+    """
+    factory = reaction_factories.FileReactionFactory(eqn_file)
+    solver = model_solvers.AlgebraicEquilibriumSolver(models.Model(factory))
+    mapping = solver.get_species_mapping()
+    inputs = sorted(factory.get_required_initial_conditions())
+    if ranges is None:
+        ranges = {}
+    unknown = set(ranges).difference(inputs)
+    if len(unknown) > 0:
+        raise LookupTableException('Ranges were given for species which are not required initial conditions: %s'
+                                   % ', '.join(sorted(unknown)))
+
+    lower, upper = [], []
+    for symbol in inputs:
+        if symbol in ranges:
+            low, high = ranges[symbol]
+        else:
+            value = solver.initial_conditions[mapping[symbol]]
+            if value <= 0:
+                raise LookupTableException('%s has no initial condition in the model file, so its range must be '
+                                           'given.' % symbol)
+            low, high = value*10**-DEFAULT_DECADES, value*10**DEFAULT_DECADES
+        if not 0 < low < high:
+            raise LookupTableException('The range of %s must be positive and increasing' % symbol)
+        lower.append(np.log(low))
+        upper.append(np.log(high))
+
+    start = time.time()
+    shape = [INITIAL_AXIS_POINTS]*len(inputs)
+    while True:
+        values, converged = _solve_points(solver, inputs, _grid_points(lower, upper, shape))
+        values = values.reshape(tuple(shape) + (solver.M,))
+        errors = np.array([_axis_error(values, axis) for axis in range(len(inputs))])
+        refinable = [axis for axis in range(len(inputs))
+                     if errors[axis] > tolerance and np.prod(shape)/shape[axis]*(2*shape[axis] - 1) <= max_points]
+        if len(refinable) == 0:
+            break
+        axis = max(refinable, key=lambda a: errors[a])
+        shape[axis] = 2*shape[axis] - 1
+    logger.info('Solved a grid of %s points for %s in %.1f s' % (' x '.join(map(str, shape)), eqn_file,
+                                                                  time.time() - start))
+
+    coefficients = _spline_coefficients(values)
+    species = ['']*solver.M
+    for symbol, index in mapping.items():
+        species[index] = symbol
+    table = EquilibriumTable(table_key(solver), inputs, species, solver.kvals, lower, upper, coefficients,
+                             np.zeros(tuple(n - 1 for n in shape)), tolerance)
+
+    # the error at the centre of each cell, and at any cell touching a point which did not converge
+    spacing = (table.upper - table.lower)/(np.array(shape) - 1)
+    centres = _grid_points(table.lower + spacing/2, table.upper - spacing/2, table.cell_error.shape)
+    centre_values, centre_converged = _solve_points(solver, inputs, centres)
+    interpolated, _ = table.interpolate(np.exp(centres))
+    error = np.max(np.abs(np.log(np.maximum(interpolated, MIN_CONCENTRATION)) - centre_values), axis=1)
+    error[~centre_converged] = np.inf
+    error = error.reshape(table.cell_error.shape)
+    failed = ndimage.maximum_filter(~converged.reshape(shape), size=2, mode='constant')[tuple(slice(1, None)
+                                                                                          for _ in shape)]
+    error[failed] = np.inf
+    table.cell_error = ndimage.maximum_filter(error, size=3, mode='nearest')
+    logger.info('%.0f%% of the cells of the table are within the tolerance'
+                % (100*np.mean(table.cell_error <= tolerance)))
+    return table
+
+
+def table_path(solver, directory=None):
+    """
+    :param solver: a model_solvers.Solver instance
+
+    :param directory: (optional) the directory of the tables.  Defaults to TABLE_DIRECTORY
+
+    :return: the path of the table for the model, or None if there is no directory
+    """
+    if directory is None:
+        directory = TABLE_DIRECTORY
+    if directory is None:
+        return None
+    return os.path.join(directory, table_key(solver) + TABLE_SUFFIX)
+
+
+def load_table(solver, directory=None):
+    """
+    Finds the table of a model, if one has been built
+
+    :param solver: a model_solvers.Solver instance
+
+    :param directory: (optional) the directory of the tables.  Defaults to TABLE_DIRECTORY
+
+    :return: an EquilibriumTable, or None.  A table is read again only if its file has changed since it was last read.
+    """
+    path = table_path(solver, directory)
+    if path is None or not os.path.exists(path):
+        return None
+    loaded_key = (path, os.path.getmtime(path))
+    if loaded_key not in _loaded_tables:
+        try:
+            _loaded_tables[loaded_key] = EquilibriumTable.load(path)
+        except (IOError, KeyError, ValueError) as ex:
+            logger.warning('Could not read the equilibrium table %s: %s' % (path, ex))
+            return None
+    table = _loaded_tables[loaded_key]
+    if table.key != table_key(solver) or table.species != sorted(solver.get_species_mapping(),
+                                                                  key=solver.get_species_mapping().get):
+        logger.warning('%s is not the table of this model' % path)
+        return None
+    return table
+
+
+class TabulatedEquilibriumSolver(model_solvers.AlgebraicEquilibriumSolver):
+    """
+    An AlgebraicEquilibriumSolver which interpolates the equilibrium from an EquilibriumTable where it can.  A row is
+    interpolated if it uses the rate constants of the table, only the inputs of the table are nonzero, the inputs
+    lie within the grid, and the estimated error of its cell is within the table tolerance.  The other rows are
+    solved.
+
+    In the ConvergenceReport, interpolated rows have converged, taking no steps; their error is given by
+    get_table_error.
+    """
+
+    def __init__(self, model, table=None, table_tolerance=None, directory=None, **options):
+        """
+
+        :param model: a models.Model instance
+
+        :param table: (optional) an EquilibriumTable.  Defaults to the table found by load_table, if any.  Without a
+        table every row is solved, as by AlgebraicEquilibriumSolver.
+
+        :param table_tolerance: (optional) the largest estimated error accepted.  Defaults to the tolerance of the
+        table.
+
+        :param directory: (optional) the directory searched for the table when none is given.  Defaults to
+        TABLE_DIRECTORY
+
+        :param options: further keyword arguments for ODESolverWJacobian, such as the tolerance preset of the
+        integrators
+
+        :return: None
+        """
+        super(TabulatedEquilibriumSolver, self).__init__(model, **options)
+        self.table = load_table(self, directory) if table is None else table
+        self.table_tolerance = table_tolerance
+        self._table_error = None
+
+    def get_table_error(self):
+        """
+        :return: a numPy array with the estimated error of each row of the last ensemble_equilibrium_solution which
+        was interpolated, and NaN for those solved
+        """
+        return self._table_error
+
+    def _table_rows(self, X0, k):
+        """
+        :return: the indices of the rows which the table may answer, see TabulatedEquilibriumSolver
+        """
+        if self.table is None:
+            return np.zeros(0, dtype=int)
+        mapping = self.get_species_mapping()
+        columns = [mapping[symbol] for symbol in self.table.inputs]
+        others = np.setdiff1d(np.arange(self.M), columns)
+        eligible = np.all(X0[:, others] == 0, axis=1) & np.all(X0[:, columns] > 0, axis=1)
+        table_k = result_cache.quantize(self.table.rate_constants).reshape(1, -1)
+        eligible &= np.all(result_cache.quantize(np.atleast_2d(k)).reshape(np.atleast_2d(k).shape[0], -1)
+                           == table_k, axis=1)
+        return np.where(eligible)[0]
+
+    def ensemble_equilibrium_solution(self, X0, k=None, chunk_size=None, initial_guess=None, warm_start=False):
+        """
+        Determines the equilibrium state for many sets of initial conditions at once, see
+        AlgebraicEquilibriumSolver.ensemble_equilibrium_solution
+
+        :return: a (N x M) numPy array giving the equilibrium concentrations for each row
+        """
+        X0 = self.check_initial_condition_matrix(X0)
+        if k is None:
+            k = self.kvals
+        k = np.asarray(k, dtype=float)
+        per_row_k = k.ndim == 2
+        n_rows = X0.shape[0]
+        tolerance = self.table_tolerance
+        if tolerance is None and self.table is not None:
+            tolerance = self.table.tolerance
+
+        start = time.time()
+        result = np.nan*np.ones(X0.shape)
+        table_error = np.nan*np.ones(n_rows)
+        rows = self._table_rows(X0, k)
+        if len(rows) > 0:
+            mapping = self.get_species_mapping()
+            X, error = self.table.interpolate(X0[rows][:, [mapping[symbol] for symbol in self.table.inputs]])
+            # rows outside the grid have no error
+            with np.errstate(invalid='ignore'):
+                accepted = error <= tolerance
+            rows = rows[accepted]
+            result[rows] = X[accepted]
+            table_error[rows] = error[accepted]
+        lookup_time = (time.time() - start)/max(len(rows), 1)
+
+        report = model_solvers.ConvergenceReport(np.zeros(n_rows, dtype=bool), np.nan*np.ones(n_rows),
+                                                 np.nan*np.ones(n_rows), np.zeros(n_rows, dtype=int),
+                                                 np.zeros(n_rows))
+        if len(rows) > 0:
+            report.converged[rows] = True
+            report.convergence_time[rows] = np.inf
+            report.residual[rows] = self.relative_residual(result[rows], k[rows] if per_row_k else k)
+            report.solve_time[rows] = lookup_time
+
+        solved = np.setdiff1d(np.arange(n_rows), rows)
+        if len(solved) > 0:
+            guess = None if initial_guess is None else np.atleast_2d(initial_guess)[solved]
+            result[solved] = super(TabulatedEquilibriumSolver, self).ensemble_equilibrium_solution(
+                X0[solved], k[solved] if per_row_k else k, chunk_size, guess, warm_start)
+            solved_report = self._convergence_report
+            report.converged[solved] = solved_report.converged
+            report.convergence_time[solved] = solved_report.convergence_time
+            report.residual[solved] = solved_report.residual
+            report.steps[solved] = solved_report.steps
+            report.solve_time[solved] = solved_report.solve_time
+        self._convergence_report = report
+        self._table_error = table_error
+        return result
+
+
+def create_solver(eqn_file, directory=None):
+    """
+    :param eqn_file: a formatted model file
+
+    :param directory: (optional) the directory of the tables.  Defaults to TABLE_DIRECTORY
+
+    :return: a TabulatedEquilibriumSolver, which interpolates from the table of the model if one has been built and
+    otherwise solves every row
+    """
+    return TabulatedEquilibriumSolver(models.Model(reaction_factories.FileReactionFactory(eqn_file)),
+                                      directory=directory)
+
+
+def main(argv=None):
+    """
+    Builds the tables of model files, see build_table
+
+    :param argv: (optional) the command line arguments.  Defaults to sys.argv[1:]
+
+    :return: the exit status
+    """
+    parser = argparse.ArgumentParser(description='Build the equilibrium lookup tables of models.')
+    parser.add_argument('directory', help='the directory the tables are written to')
+    parser.add_argument('models', nargs='+', help='the model files')
+    parser.add_argument('--range', nargs=3, action='append', default=[], metavar=('SPECIES', 'LOW', 'HIGH'),
+                        help='the concentrations covered for an input (default: %d decades either side of its '
+                             'initial condition)' % DEFAULT_DECADES)
+    parser.add_argument('--tolerance', type=float, default=TABLE_TOLERANCE,
+                        help='the largest error accepted, in the log of the concentrations (default: %(default)s)')
+    parser.add_argument('--max-points', type=int, default=MAX_TABLE_POINTS,
+                        help='the largest number of points in a grid (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    ranges = dict((symbol, (float(low), float(high))) for symbol, low, high in args.range)
+    if not os.path.exists(args.directory):
+        os.makedirs(args.directory)
+    status = 0
+    for eqn_file in args.models:
+        try:
+            # only the ranges of the model's own inputs apply to it
+            inputs = reaction_factories.FileReactionFactory(eqn_file).get_required_initial_conditions()
+            table = build_table(eqn_file, dict((s, r) for s, r in ranges.items() if s in inputs), args.tolerance,
+                                args.max_points)
+        except LookupTableException as ex:
+            logger.error('%s: %s' % (eqn_file, ex))
+            status = 1
+            continue
+        path = os.path.join(args.directory, table.key + TABLE_SUFFIX)
+        table.save(path)
+        logger.info('Wrote the table of %s to %s' % (eqn_file, path))
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -10,9 +10,9 @@ if __name__ == '__main__':
     factory = reaction_factories.FileReactionFactory(eqn_file)
     model = models.Model(factory)
     solver1 = model_solvers.ODESolver(model)
-    sample_to_column_mapping, solution1, t = solver1.equilibrium_solution()
+    sample_to_column_mapping, solution1, t = solver1.equilibrium_solution(output=model_solvers.Solver.OUTPUT_FINAL)
     print solution1[-1,:]
 
     solver2 = model_solvers.ODESolverWJacobian(model)
-    sample_to_column_mapping, solution2, t = solver2.equilibrium_solution()
+    sample_to_column_mapping, solution2, t = solver2.equilibrium_solution(output=model_solvers.Solver.OUTPUT_FINAL)
     print solution2[-1,:]
\ No newline at end of file
@@ -0,0 +1,337 @@
+__author__ = 'brian'
+
+import hashlib
+
+import numpy as np
+
+
+class CompiledModel(object):
+    """
+    Holds the functions generated for one model by compile_model.  Both functions work on a single state or a stack
+    of states: X may be an M-length array or a (N x M) array, and the rate constants k may be a 2J-length array or a
+    (N x 2J) array.
+
+    rhs(X, k) returns the time rate-of-change, with the same shape as X.
+    jacobian(X, k) returns the Jacobian, with shape X.shape + (M,).
+
+    The Jacobian is only generated the first time it is used, since the sparse integration path of large models never
+    calls it.  The source attribute holds the code generated so far.
+    """
+
+    def __init__(self, model_hash, alpha, gamma):
+        self.model_hash = model_hash
+        self._alpha = alpha
+        self._gamma = gamma
+        self._jacobian = None
+        self.source = _generate_rhs_source(alpha, gamma)
+        self.rhs = self._compile(self.source, 'rhs')
+
+    def _compile(self, source, name):
+        """
+        :return: the function of the given name defined by the source
+        """
+        namespace = {'np': np}
+        exec(compile(source, '<compiled model %s>' % self.model_hash, 'exec'), namespace)
+        return namespace[name]
+
+    @property
+    def jacobian(self):
+        if self._jacobian is None:
+            source = _generate_jacobian_source(self._alpha, self._gamma)
+            self._jacobian = self._compile(source, 'jacobian')
+            self.source += '\n\n' + source
+        return self._jacobian
+
+
+# compiled models, keyed by the content hash of the model
+_compiled_models = {}
+
+
+def model_hash(species_mapping, alpha, gamma):
+    """
+    Computes a hash which identifies the structure of a model: the species, their ordering, and the stoichiometric
+    coefficients.  Rate constants are not included, since the compiled functions take them as an argument.
+
+    :param species_mapping: a dict mapping the species symbols to their index in the concentration array
+
+    :param alpha: a (M x J) numPy array of the reactant coefficients
+
+    :param gamma: a (M x J) numPy array of the product coefficients
+
+    :return: a hex string
+    """
+    h = hashlib.sha1()
+    h.update(repr(sorted(species_mapping.items(), key=lambda item: item[1])).encode('utf-8'))
+    for coefficients in [alpha, gamma]:
+        coefficients = np.ascontiguousarray(coefficients, dtype=float)
+        h.update(repr(coefficients.shape).encode('utf-8'))
+        h.update(coefficients.tobytes())
+    return h.hexdigest()
+
+
+def compile_model(species_mapping, alpha, gamma):
+    """
+    Generates and compiles straight-line Python functions for the time rate-of-change and the Jacobian of a
+    mass-action model, with the participating species and their exponents written into the code.  For example, a
+    forward rate becomes k0*x1*x4 rather than a product of powers over all of the species.
+
+    The result is cached by the content hash of the model (see model_hash), so solvers created for the same model
+    share the compiled functions.
+
+    :param species_mapping: a dict mapping the species symbols to their index in the concentration array
+
+    :param alpha: a (M x J) numPy array of the reactant coefficients
+
+    :param gamma: a (M x J) numPy array of the product coefficients
+
+    :return: a CompiledModel instance
+    """
+    key = model_hash(species_mapping, alpha, gamma)
+    if key not in _compiled_models:
+        _compiled_models[key] = CompiledModel(key, np.array(alpha), np.array(gamma))
+    return _compiled_models[key]
+
+
+def _format_number(value):
+    """
+    Formats a coefficient for the generated source, dropping the decimal point from whole numbers
+
+    :param value: a float
+
+    :return: a string
+    """
+    if float(value).is_integer():
+        return '%d' % value
+    return repr(float(value))
+
+
+def _monomial(factors):
+    """
+    Writes the product of powers of species concentrations
+
+    :param factors: a list of (species index, exponent) tuples.  Factors with zero exponent are left out.
+
+    :return: a list of strings, which are the factors of the product
+    """
+    terms = []
+    for idx, exponent in factors:
+        if exponent == 0:
+            continue
+        elif exponent == 1:
+            terms.append('x%d' % idx)
+        else:
+            terms.append('x%d**%s' % (idx, _format_number(exponent)))
+    return terms
+
+
+def _weighted_sum(weighted_terms):
+    """
+    Writes a sum of terms with numeric weights, such as 'c0 - 2*c3'
+
+    :param weighted_terms: a list of (weight, string) tuples
+
+    :return: a string, or None if there are no terms
+    """
+    expression = ''
+    for weight, term in weighted_terms:
+        sign = '-' if weight < 0 else '+'
+        magnitude = abs(weight)
+        term = term if magnitude == 1 else '%s*%s' % (_format_number(magnitude), term)
+        if expression:
+            expression += ' %s %s' % (sign, term)
+        else:
+            expression = term if sign == '+' else '-%s' % term
+    return expression or None
+
+
+def _participants(alpha, gamma):
+    """
+    :param alpha: a (M x J) numPy array of the reactant coefficients
+
+    :param gamma: a (M x J) numPy array of the product coefficients
+
+    :return: a list with an entry for each of the 2J reaction directions, forward rates first, holding a list of the
+    (species index, exponent) tuples of its mass-action product
+    """
+    J = alpha.shape[1]
+    return [[(s, coefficients[s, q]) for s in np.where(coefficients[:, q] > 0)[0]]
+            for coefficients in [alpha, gamma] for q in range(J)]
+
+
+def _unpack_lines(M, J):
+    """
+    :return: the lines which unpack the states and rate constants at the start of a generated function
+    """
+    # unpacking the transposes gives scalars for a single state and (N,) arrays for a stack of states
+    return ['    %s, = X.T' % ', '.join('x%d' % s for s in range(M)),
+            '    %s, = k.T' % ', '.join('k%d' % r for r in range(2*J)),
+            '    shape = max(X.shape[:-1], k.shape[:-1], key=len)']
+
+
+def _generate_rhs_source(alpha, gamma):
+    """
+    Writes the source of the rhs function for a model.
+
+    Following the derivation, the time rate-of-change is Z.c where c[q] = k[q]*theta[q] - k[q+J]*phi[q] is the net
+    rate of reaction q.
+
+    :param alpha: a (M x J) numPy array of the reactant coefficients
+
+    :param gamma: a (M x J) numPy array of the product coefficients
+
+    :return: a string of Python source
+    """
+    M, J = alpha.shape
+    Z = gamma - alpha
+    lines = ['def rhs(X, k):'] + _unpack_lines(M, J) + ['    dX = np.zeros(shape + (%d,))' % M]
+
+    # the rate of each reaction direction; forward rates come first, then the reverse rates
+    for r, factors in enumerate(_participants(alpha, gamma)):
+        lines.append('    r%d = %s' % (r, '*'.join(['k%d' % r] + _monomial(factors))))
+    lines += ['    c%d = r%d - r%d' % (q, q, q + J) for q in range(J)]
+    for i in range(M):
+        expression = _weighted_sum([(Z[i, q], 'c%d' % q) for q in np.where(Z[i, :] != 0)[0]])
+        if expression is not None:
+            lines.append('    dX[..., %d] = %s' % (i, expression))
+    lines.append('    return dX')
+    return '\n'.join(lines) + '\n'
+
+
+def _generate_jacobian_source(alpha, gamma):
+    """
+    Writes the source of the jacobian function for a model.
+
+    The Jacobian is Z.V, where V[q,s] is the derivative of the net rate c[q] with respect to species s.  Only the
+    nonzero entries of V and of the Jacobian are written, and the entries of the Jacobian are found from those of V
+    rather than by visiting every pair of species, so the work grows with the number of nonzero entries.
+
+    :param alpha: a (M x J) numPy array of the reactant coefficients
+
+    :param gamma: a (M x J) numPy array of the product coefficients
+
+    :return: a string of Python source
+    """
+    M, J = alpha.shape
+    Z = gamma - alpha
+    participants = _participants(alpha, gamma)
+
+    # the derivative of the net rate of reaction q with respect to each of its species, and the terms of the
+    # Jacobian entries they contribute to
+    derivative_lines = []
+    entries = {}
+    for q in range(J):
+        species = sorted(set(s for s, exponent in participants[q] + participants[q + J]))
+        changed = np.where(Z[:, q] != 0)[0]
+        for s in species:
+            directional_terms = []
+            for r, sign in [(q, 1), (q + J, -1)]:
+                exponents = dict(participants[r])
+                if s not in exponents:
+                    continue
+                lowered = [(i, exponent - 1 if i == s else exponent) for i, exponent in participants[r]]
+                term = '*'.join(['k%d' % r] + _monomial(lowered))
+                directional_terms.append((sign*exponents[s], term))
+            name = 'v%d_%d' % (q, s)
+            derivative_lines.append('    %s = %s' % (name, _weighted_sum(directional_terms)))
+            for i in changed:
+                entries.setdefault((i, s), []).append((Z[i, q], name))
+
+    lines = ['def jacobian(X, k):'] + _unpack_lines(M, J) + ['    J = np.zeros(shape + (%d, %d))' % (M, M)]
+    lines += derivative_lines
+    for i, s in sorted(entries):
+        lines.append('    J[..., %d, %d] = %s' % (i, s, _weighted_sum(entries[(i, s)])))
+    lines.append('    return J')
+    return '\n'.join(lines) + '\n'
+
+
+class BindingNetwork(object):
+    """
+    Describes a model made only of reversible binding reactions, such as A + B <-> AB, where every complex is formed
+    by exactly one reaction.  The species which are never formed are the components, and every species is a complex
+    of the components:
+
+    composition[s, i] is the number of copies of component i in species s, an (M x d) array.
+    formation[s, q] is the number of times reaction q is used in building species s from its components, an (M x J)
+    array.
+
+    At equilibrium the concentration of each species is then beta[s]*prod_i f[i]**composition[s, i], where f are the
+    free concentrations of the components and log(beta) = formation.(log(kf) - log(kr)).  The components are
+    conserved: composition.T.X is the same as composition.T.X0.
+    """
+
+    def __init__(self, model_hash, components, composition, formation):
+        self.model_hash = model_hash
+        self.components = components
+        self.composition = composition
+        self.formation = formation
+
+
+# binding networks, keyed by the content hash of the model.  Models which are not binding networks are stored as None.
+_binding_networks = {}
+
+
+def binding_network(species_mapping, alpha, gamma):
+    """
+    Detects whether a model is made only of reversible binding reactions.  That is the case when every reaction
+    forms a single product, with coefficient one, from whole numbers of reactant molecules (so A + B <-> AB,
+    2A <-> A2 and A <-> A* qualify), and no species is formed by more than one reaction or, through a chain of
+    reactions, from itself.  The equilibrium of such a model is fixed by the free concentrations of its components
+    alone, see BindingNetwork.
+
+    The result is cached by the content hash of the model (see model_hash).
+
+    :param species_mapping: a dict mapping the species symbols to their index in the concentration array
+
+    :param alpha: a (M x J) numPy array of the reactant coefficients
+
+    :param gamma: a (M x J) numPy array of the product coefficients
+
+    :return: a BindingNetwork instance, or None if the model is not a binding network
+    """
+    key = model_hash(species_mapping, alpha, gamma)
+    if key not in _binding_networks:
+        _binding_networks[key] = _find_binding_network(key, alpha, gamma)
+    return _binding_networks[key]
+
+
+def _find_binding_network(key, alpha, gamma):
+    """
+    Checks the stoichiometry of a model and builds its BindingNetwork, see binding_network
+
+    :return: a BindingNetwork instance, or None
+    """
+    M, J = alpha.shape
+    if J == 0:
+        return None
+    formed_by = {}
+    for q in range(J):
+        products = np.where(gamma[:, q] > 0)[0]
+        reactants = np.where(alpha[:, q] > 0)[0]
+        if len(products) != 1 or gamma[products[0], q] != 1 or products[0] in reactants:
+            return None
+        if len(reactants) == 0 or not np.all(alpha[reactants, q] == np.round(alpha[reactants, q])):
+            return None
+        if products[0] in formed_by:
+            return None
+        formed_by[products[0]] = q
+
+    components = [s for s in range(M) if s not in formed_by]
+    composition = np.zeros((M, len(components)))
+    formation = np.zeros((M, J))
+    composition[components, range(len(components))] = 1
+
+    # each species is built from its reactants once they are built, which fails if the reactions form a cycle
+    built = set(components)
+    remaining = set(formed_by)
+    while remaining:
+        ready = [s for s in remaining if all(r in built for r in np.where(alpha[:, formed_by[s]] > 0)[0])]
+        if not ready:
+            return None
+        for s in ready:
+            q = formed_by[s]
+            composition[s] = np.dot(alpha[:, q], composition)
+            formation[s] = np.dot(alpha[:, q], formation)
+            formation[s, q] += 1
+            built.add(s)
+            remaining.remove(s)
+    return BindingNetwork(key, components, composition, formation)
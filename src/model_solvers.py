@@ -1,7 +1,19 @@
 __author__ = 'brian'
 
+import time
+
 import numpy as np
-from scipy import integrate
+from scipy import integrate, linalg, sparse
+try:
+    from scipy.special import logsumexp
+except ImportError:
+    # scipy before 0.19
+    from scipy.misc import logsumexp
+
+import integrators
+import model_compiler
+import trajectory_store
+from custom_exceptions import *
 
 
 class Solver(object):
@@ -13,6 +25,20 @@ class Solver(object):
     Instantiate a derived class, not this one.
     """
 
+    # The ways equilibrium_solution can report the evolution of the system:
+    # OUTPUT_TRAJECTORY: TRAJECTORY_POINTS evenly spaced time points
+    # OUTPUT_FINAL: only the final state, so memory use does not depend on the length of the simulation
+    # OUTPUT_LOG: LOG_GRID_POINTS time points spaced logarithmically over the last LOG_GRID_DECADES decades
+    # OUTPUT_DENSE: a DenseSolution, which can be evaluated at any time
+    OUTPUT_TRAJECTORY = 'trajectory'
+    OUTPUT_FINAL = 'final'
+    OUTPUT_LOG = 'log'
+    OUTPUT_DENSE = 'dense'
+
+    TRAJECTORY_POINTS = 100000
+    LOG_GRID_POINTS = 200
+    LOG_GRID_DECADES = 6
+
     def __init__(self):
         raise NotImplementedError
 
@@ -50,6 +76,156 @@ class Solver(object):
                 initial_conditions[index] = 0.0
         self.initial_conditions = initial_conditions
 
+    def set_initial_conditions(self, ic):
+        """
+        Sets the initial conditions of the model, and the array of initial conditions of the solver to match
+
+        :param ic: a dictionary mapping the symbols to the initial concentrations, see
+        models.Model.set_initial_conditions
+
+        :return: None
+        """
+        self.model.set_initial_conditions(ic)
+        self._setup_initial_conditions()
+
+    def _get_rate_constants(self):
+        """
+        Extract the rate constants from the model specification and build an array of rate constants.
+        Note the placement of the rate constants to match the derivation--
+        If there are J reactions, then the total array has length 2J.  The forward rate constant of reaction q goes
+        in kvals[q] and the reverse reaction rate constant goes in kvals[q+J]
+
+        :return: None
+        """
+
+        all_reactions = self.model.get_reactions()
+
+        # set the member attribute J- the number of reactions
+        self.J = len(all_reactions)
+
+        self.kvals = np.zeros(2*self.J)
+        for i, rx in enumerate(all_reactions):
+            self.kvals[i] = rx.get_fwd_k()
+            self.kvals[i+self.J] = rx.get_rev_k()
+
+    def get_rate_constant_names(self):
+        """
+        Names the entries of the array of rate constants: kf_q is the forward rate constant of reaction q and kr_q
+        the reverse one, with the reactions numbered in the order of the model.
+
+        :return: a list of 2J strings, ordered as the array of rate constants (see Solver._get_rate_constants)
+        """
+        return ['kf_%d' % q for q in range(self.J)] + ['kr_%d' % q for q in range(self.J)]
+
+    def _create_coefficient_arrays(self):
+        """
+        Creates the alpha and gamma matrices (M x J) given in the derivation of the model system.
+        Also sets the member attribute Z, which is the difference gamma-alpha
+
+        :return: None
+        """
+
+        # The number of species and the number of equations
+        self.M = len(self._species_mapping.keys())
+
+        # alpha and gamma refer to the documentation nomenclature
+        # both (M x J) matrices describing the stoichiometric coefficients
+        self.alpha = np.zeros((self.M, self.J))
+        self.gamma = np.zeros((self.M, self.J))
+
+        for q, rx in enumerate(self.model.get_reactions()):
+            for reactant in rx.get_reactants():
+                self.alpha[self._species_mapping[reactant.symbol], q] = reactant.coefficient
+            for product in rx.get_products():
+                self.gamma[self._species_mapping[product.symbol], q] = product.coefficient
+        # the sum of -alpha and gamma ends up being something we use a lot, so calculate the difference up front:
+        self.Z = self.gamma - self.alpha
+
+    def _compile_model(self):
+        """
+        Generates (or fetches from the cache) the straight-line time rate-of-change and Jacobian functions for the
+        model.  See model_compiler.compile_model
+
+        :return: None
+        """
+        self._compiled_model = model_compiler.compile_model(self._species_mapping, self.alpha, self.gamma)
+
+    def get_model_hash(self):
+        """
+        :return: a hex string which identifies the structure of the model (species and stoichiometry).  See
+        model_compiler.model_hash
+        """
+        return self._compiled_model.model_hash
+
+    @staticmethod
+    def _output_times(tmax, output):
+        """
+        Creates the times at which the integration reports the state, for a given output mode.  For
+        Solver.OUTPUT_DENSE these are the checkpoints stored in the DenseSolution.
+
+        :param tmax: the length of the simulation
+
+        :param output: one of the Solver.OUTPUT_* modes
+
+        :return: a numPy array of times, starting at zero and ending at tmax
+        """
+        if output == Solver.OUTPUT_TRAJECTORY:
+            return np.linspace(0, tmax, Solver.TRAJECTORY_POINTS)
+        elif output == Solver.OUTPUT_FINAL:
+            return np.array([0.0, tmax])
+        elif output in (Solver.OUTPUT_LOG, Solver.OUTPUT_DENSE):
+            log_tmax = np.log10(tmax)
+            return np.concatenate([[0.0], np.logspace(log_tmax - Solver.LOG_GRID_DECADES,
+                                                      log_tmax,
+                                                      Solver.LOG_GRID_POINTS)])
+        else:
+            raise InvalidOutputModeException('Unknown output mode: %s' % output)
+
+    @staticmethod
+    def _format_output(t, X, output, advance):
+        """
+        Packages the integrated states according to the output mode
+
+        :param t: a numPy array of the times returned by Solver._output_times
+
+        :param X: a (len(t) x M) numPy array of the states at those times
+
+        :param output: one of the Solver.OUTPUT_* modes
+
+        :param advance: a callable which integrates from a (M-length) state to the times in the given array, as
+        used by DenseSolution
+
+        :return: a 2-tuple of the states and the times to return from equilibrium_solution
+        """
+        if output == Solver.OUTPUT_FINAL:
+            return X[-1:], t[-1:]
+        elif output == Solver.OUTPUT_DENSE:
+            return DenseSolution(t, X, advance), t
+        return X, t
+
+    @staticmethod
+    def _store_trajectory(path, X_start, t, advance):
+        """
+        Integrates a state into a trajectory_store.TrajectoryStore, one block of times at a time (see
+        trajectory_store.integrate_in_blocks), so only a block of the trajectory is ever held in memory
+
+        :param path: the path of the .npy file to hold the states, which is overwritten
+
+        :param X_start: a M-length numPy array giving the state at time t[0]
+
+        :param t: a numPy array of the times at which the state is reported
+
+        :param advance: a callable which integrates from a state to the times in the given array, as used by
+        DenseSolution
+
+        :return: a (len(t) x M) memory-mapped view of the states, see trajectory_store.TrajectoryStore
+        """
+        store = trajectory_store.TrajectoryStore.create(path, t, X_start.shape)
+        for start, states in trajectory_store.integrate_in_blocks(advance, X_start, t):
+            store.write(start, states)
+        store.flush()
+        return store.states
+
     def equilibrium_solution(self):
         raise NotImplementedError
 
@@ -57,6 +233,94 @@ class Solver(object):
         return self._species_mapping
 
 
+class DenseSolution(object):
+    """
+    A lazily evaluated solution which can be queried at any time in the simulation.
+
+    Only the states at a set of checkpoint times are stored.  The state at any other time is computed on demand by
+    integrating from the closest earlier checkpoint, so the result is as accurate as the integration itself.
+
+    Indexing behaves like the array of checkpoint states, so solution[-1,:] gives the final state as it does for the
+    arrays returned by the other output modes.
+    """
+
+    def __init__(self, t, X, advance):
+        """
+
+        :param t: a numPy array of the checkpoint times, in increasing order
+
+        :param X: a (len(t) x M) numPy array of the states at the checkpoint times
+
+        :param advance: a callable which takes a M-length state and a numPy array of times, where the first time is
+        that of the given state, and returns the (len(times) x M) states at those times
+
+        :return: None
+        """
+        self.t = t
+        self._states = X
+        self._advance = advance
+
+    def __call__(self, t):
+        """
+        Evaluates the solution
+
+        :param t: a float or numPy array of times within the simulation
+
+        :return: a numPy array of the states, with shape (M,) for a single time or (len(t) x M) otherwise
+        """
+        times = np.atleast_1d(np.asarray(t, dtype=float))
+        if np.any(times < self.t[0]) or np.any(times > self.t[-1]):
+            raise ValueError('Requested times must be between %s and %s' % (self.t[0], self.t[-1]))
+
+        result = np.empty((len(times), self._states.shape[1]))
+        checkpoints = np.searchsorted(self.t, times, side='right') - 1
+        for c in np.unique(checkpoints):
+            selected = np.where(checkpoints == c)[0]
+            order = np.argsort(times[selected])
+            segment_times = np.concatenate([[self.t[c]], times[selected][order]])
+            result[selected[order]] = self._advance(self._states[c], segment_times)[1:]
+        return result[0] if np.ndim(t) == 0 else result
+
+    def __getitem__(self, item):
+        return self._states[item]
+
+    def __len__(self):
+        return len(self._states)
+
+    @property
+    def shape(self):
+        return self._states.shape
+
+
+class ConvergenceReport(object):
+    """
+    Describes whether the states returned by a solver have reached equilibrium.  Each attribute is a numPy array
+    with one entry per row of initial conditions (a single entry for equilibrium_solution).
+
+    The residual is the relative norm of the time rate-of-change, |dX/dt|/|X|, at the returned state.  The
+    convergence time is the time at which the residual was found to be below the tolerance; it is NaN for rows which
+    did not converge, and infinite for rows solved directly for the equilibrium.
+
+    Solvers which count their work also report the steps (Newton iterations) taken for each row and an estimate of
+    the wall-clock time spent on it, in seconds.  Otherwise these are None.
+    """
+
+    def __init__(self, converged, convergence_time, residual, steps=None, solve_time=None):
+        self.converged = converged
+        self.convergence_time = convergence_time
+        self.residual = residual
+        self.steps = steps
+        self.solve_time = solve_time
+
+    def unconverged_rows(self):
+        """
+        Get the rows which have not reached equilibrium
+
+        :return: a numPy array of row indices
+        """
+        return np.where(~self.converged)[0]
+
+
 class ODESolver(Solver):
     """
     This solver was the first implementation and did not explicitly calculate a Jacobian
@@ -70,6 +334,9 @@ class ODESolver(Solver):
         self._create_species_mapping()
         self._create_stoichiometry_matrix()
         self.rate_funcs = self._calculate_rate_law_funcs(self.model.get_reactions())
+        self._get_rate_constants()
+        self._create_coefficient_arrays()
+        self._compile_model()
         self._setup_initial_conditions()
 
     def _create_stoichiometry_matrix(self):
@@ -143,19 +410,29 @@ class ODESolver(Solver):
 
         :return: a numPy array giving the current time rate of change of the concentrations.
         """
-        rate_vals = np.array([f(X) for f in self.rate_funcs])
-        return np.dot(self.N, rate_vals)
+        return self._compiled_model.rhs(X, self.kvals)
 
-    def equilibrium_solution(self):
+    def equilibrium_solution(self, output=Solver.OUTPUT_TRAJECTORY, store=None):
         """
         Runs the integration to determine the equilibrium state
 
+        :param output: (optional) one of the Solver.OUTPUT_* modes, which determines how the evolution is reported
+
+        :param store: (optional) the path of a .npy file.  If given, the evolution is written to the file as it is
+        integrated, and returned as a memory-mapped view of it (see Solver._store_trajectory).  Not used for
+        Solver.OUTPUT_FINAL.
+
         :return: a 3-tuple consisting of the species-to-index map, a numPy array giving the evolution of each species \
         in the columns, and an array of the time steps.
         """
         tmax = self.model.get_simulation_time()
-        t = np.linspace(0, tmax, 100000)
-        X = integrate.odeint(self._dX_dt, self.initial_conditions, t)
+        t = self._output_times(tmax, output)
+        advance = lambda x, times: integrate.odeint(self._dX_dt, x, times)
+        if store is not None and output != Solver.OUTPUT_FINAL:
+            X = self._store_trajectory(store, self.initial_conditions, t, advance)
+        else:
+            X = advance(self.initial_conditions, t)
+        X, t = self._format_output(t, X, output, advance)
         return self._species_mapping, X, t
 
 
@@ -165,63 +442,114 @@ class ODESolverWJacobian(Solver):
     in curve-fitting procedures.
     """
 
-    def __init__(self, model):
+    # the default maximum number of rows which are integrated together by ensemble_equilibrium_solution
+    ENSEMBLE_CHUNK_SIZE = 500
+
+    # A state is considered to be at equilibrium once |dX/dt|/|X| falls below STEADY_STATE_TOLERANCE.  When
+    # integrating until steady state, the residual is first checked at STEADY_STATE_FIRST_CHECK times the simulation
+    # time, and the interval between checks doubles until MAX_HORIZON_FACTOR times the simulation time.
+    STEADY_STATE_TOLERANCE = 1e-9
+    STEADY_STATE_FIRST_CHECK = 1.0/64
+    MAX_HORIZON_FACTOR = 1024
+
+    # models with at least this many species are integrated with sparse linear algebra, unless told otherwise
+    SPARSE_SPECIES_THRESHOLD = 200
+
+    def __init__(self, model, reduce_conservation=True, use_sparse=None, integrator=None, tolerance='standard'):
         """
 
         :param model: a models.Model instance
 
+        :param reduce_conservation: (optional) if True, species which are fixed by the conservation laws are
+        eliminated and only the independent species are integrated.  See ODESolverWJacobian._reduced_system
+
+        :param use_sparse: (optional) if True, the stoichiometry and Jacobian are held as sparse matrices and the
+        system is integrated with sparse linear algebra (see ODESolverWJacobian._integrate_states).  By default this
+        is chosen for models with at least SPARSE_SPECIES_THRESHOLD species.
+
+        :param integrator: (optional) the name of a registered integrator (see integrators.available_integrators).
+        By default LSODA is used, except on the sparse path, where one is chosen for each integration from the
+        stiffness of the system, see integrators.select_integrator
+
+        :param tolerance: (optional) the name of one of the integrators.TOLERANCE_PRESETS: 'fast', 'standard' or
+        'reference'
+
         :return: None
         """
 
         self.model = model
+        self.reduce_conservation = reduce_conservation
         self._create_species_mapping()
         self._get_rate_constants()
         self._create_coefficient_arrays()
+        self._compile_model()
+        self._create_jacobian_plan()
+        self._setup_sparse_backend(use_sparse)
+        self._setup_integrator(integrator, tolerance)
         self._setup_initial_conditions()
+        self._conservation_law_cache = {}
+        self._convergence_report = None
 
-    def _get_rate_constants(self):
-        """
-        Extract the rate constants from the model specification and build an array of rate constants.
-        Note the placement of the rate constants to match the derivation--
-        If there are J reactions, then the total array has length 2J.  The forward rate constant of reaction q goes
-        in kvals[q] and the reverse reaction rate constant goes in kvals[q+J]
-
-        :return: None
+    def _create_jacobian_plan(self):
         """
+        Precomputes everything about the Jacobian which depends only on the model, so that evaluating it only
+        involves the nonzero stoichiometric coefficients.
 
-        all_reactions = self.model.get_reactions()
-
-        # set the member attribute J- the number of reactions
-        self.J = len(all_reactions)
+        Following the derivation, the Jacobian is Z.V where V[q,s] is the derivative of the net rate of reaction q
+        with respect to species s.  Each nonzero coefficient alpha[s,q] (or gamma[s,q]) gives one term of V:
+        k[q]*alpha[s,q]*X_s^(alpha[s,q]-1)*prod_(i!=s) X_i^alpha[i,q].  For each such term the plan stores the
+        exponents of the participating species of the reaction as a row of a sparse matrix, with the exponent of
+        species s already lowered by one (see ODESolverWJacobian._monomials).
 
-        self.kvals = np.zeros(2*self.J)
-        for i, rx in enumerate(all_reactions):
-            self.kvals[i] = rx.get_fwd_k()
-            self.kvals[i+self.J] = rx.get_rev_k()
+        Each term of V then contributes Z[i,q] times its value to the Jacobian entry (i,s) for every species i
+        changed by reaction q.  Those targets and weights are stored too, along with the overall sparsity pattern.
 
-    def _create_coefficient_arrays(self):
-        """
-        Creates the alpha and gamma matrices (M x J) given in the derivation of the model system.
-        Also sets the member attribute Z, which is the difference gamma-alpha
+        The exponents of the rates themselves, the rows of [alpha gamma].T, are stored as a sparse matrix as well.
 
         :return: None
         """
-
-        # The number of species and the number of equations
-        self.M = len(self._species_mapping.keys())
-
-        # alpha and gamma refer to the documentation nomenclature
-        # both (M x J) matrices describing the stoichiometric coefficients
-        self.alpha = np.zeros((self.M, self.J))
-        self.gamma = np.zeros((self.M, self.J))
-
-        for q, rx in enumerate(self.model.get_reactions()):
-            for reactant in rx.get_reactants():
-                self.alpha[self._species_mapping[reactant.symbol], q] = reactant.coefficient
-            for product in rx.get_products():
-                self.gamma[self._species_mapping[product.symbol], q] = product.coefficient
-        # the sum of -alpha and gamma ends up being something we use a lot, so calculate the difference up front:
-        self.Z = self.gamma - self.alpha
+        term_rows, term_species, term_exponents = [], [], []
+        rate_index, sign, coefficient, reaction, differentiated = [], [], [], [], []
+        for side, coefficients in enumerate([self.alpha, self.gamma]):
+            for q in range(self.J):
+                participants = np.where(coefficients[:, q] > 0)[0]
+                for s in participants:
+                    lowered_exponents = coefficients[participants, q] - (participants == s)
+                    term_rows.extend([len(rate_index)]*len(participants))
+                    term_species.extend(participants)
+                    term_exponents.extend(lowered_exponents)
+                    rate_index.append(q + side*self.J)
+                    sign.append(1.0 if side == 0 else -1.0)
+                    coefficient.append(coefficients[s, q])
+                    reaction.append(q)
+                    differentiated.append(s)
+
+        n_entries = len(rate_index)
+        self._plan_exponents = sparse.csr_matrix((np.array(term_exponents, dtype=float),
+                                                  (np.array(term_rows, dtype=int), np.array(term_species, dtype=int))),
+                                                 shape=(n_entries, self.M))
+        # species whose exponent was lowered to zero do not enter the product
+        self._plan_exponents.eliminate_zeros()
+        self._rate_exponents = sparse.csr_matrix(np.hstack([self.alpha, self.gamma]).T)
+
+        self._plan_rate_index = np.array(rate_index, dtype=int)
+        self._plan_sign = np.array(sign)
+        self._plan_coefficient = np.array(coefficient, dtype=float)
+
+        contribution_entry, contribution_target, contribution_weight = [], [], []
+        for e in range(n_entries):
+            for i in np.where(self.Z[:, reaction[e]] != 0)[0]:
+                contribution_entry.append(e)
+                contribution_target.append(i*self.M + differentiated[e])
+                contribution_weight.append(self.Z[i, reaction[e]])
+        self._plan_contribution_entry = np.array(contribution_entry, dtype=int)
+        self._plan_contribution_target = np.array(contribution_target, dtype=int)
+        self._plan_contribution_weight = np.array(contribution_weight, dtype=float)
+
+        # the nonzero pattern of the Jacobian, as a sparse matrix so it does not grow with M**2
+        pattern = np.unique(self._plan_contribution_target)
+        self._jacobian_sparsity = sparse.csr_matrix((np.ones(len(pattern), dtype=bool),
+                                                     (pattern // self.M, pattern % self.M)), shape=(self.M, self.M))
 
     def _dX_dt(self, X, t=None, k=None):
         """
@@ -236,17 +564,9 @@ class ODESolverWJacobian(Solver):
 
         :return: a numPy array giving the current time rate of change of the concentrations.
         """
-
-        theta = np.prod(X[np.newaxis,:]**(self.alpha.T), axis=1)
-        phi = np.prod(X[np.newaxis,:]**(self.gamma.T), axis=1)
-
         if k is None:
             k = self.kvals
-
-        # a J-length array
-        c_vector = k[:self.J]*theta - k[self.J:]*phi
-
-        return np.dot(self.Z, c_vector)
+        return self._compiled_model.rhs(X, k)
 
     def _jacobian(self, X, t=None, k=None):
         """
@@ -263,41 +583,12 @@ class ODESolverWJacobian(Solver):
 
         """
 
-        # this section takes care of calculating the (J x M) matrices for the product terms in our Jacobian formula.
-        theta_exponent_array = []
-        phi_exponent_array = []
-
-        # Here, progressively build a list of numPy matrices where a single column is zero'd out.
-        # This helps to gracefully deal with the i=/=s condition in the product terms.
-        for i in range(self.M):
-            alpha_edit = np.copy(self.alpha.T)
-            gamma_edit = np.copy(self.gamma.T)
-            alpha_edit[:, i] = 0
-            gamma_edit[:, i] = 0
-            theta_exponent_array.append(alpha_edit)
-            phi_exponent_array.append(gamma_edit)
-
-        # make the lists into 3-D numPy arrays.  Dimension is (M,J,M)
-        theta_exponent_array = np.array(theta_exponent_array)
-        phi_exponent_array = np.array(phi_exponent_array)
-
-        # Broadcasting the exponent- gives the actual product terms given in the formula.  Results are (J x M) matrices
-        theta = np.prod(X**theta_exponent_array, axis=2).T
-        phi = np.prod(X**phi_exponent_array, axis=2).T
-
-        # Creates (J x M) matrices for the terms created from the differentiation (hence the -1)
-        chi_l = X**(self.alpha.T-1)
-        chi_r = X**(self.gamma.T-1)
-
         if k is None:
             k = self.kvals
+        return self._compiled_model.jacobian(X, np.asarray(k))
 
-        # Perform element-wise multiplication of all the terms
-        V = k[:self.J, np.newaxis] * (self.alpha.T) * chi_l * theta -\
-            k[self.J:, np.newaxis] * (self.gamma.T) * chi_r * phi
-        return np.dot(self.Z, V)
-
-    def equilibrium_solution(self, X0=None, k=None):
+    def equilibrium_solution(self, X0=None, k=None, until_steady=False, output=Solver.OUTPUT_TRAJECTORY,
+                             store=None):
         """
         Runs the integration to determine the equilibrium state.
 
@@ -305,20 +596,1228 @@ class ODESolverWJacobian(Solver):
         model object is one way to check the order of the reactions so that the rate constants can be arranged
         in the proper order.
 
+        Whether the final state reached equilibrium is available afterwards from
+        ODESolverWJacobian.get_convergence_report
+
         :param X0: (optional) A dictionary mapping the symbols to the initial concentrations
 
         :param k: (optional) An array of rate constants.
 
+        :param until_steady: (optional) if True, integrate until the state reaches equilibrium rather than for the
+        simulation time of the model.  The states are then reported only at the times the residual was checked
+        (see ODESolverWJacobian._integrate_until_steady), or just the final state for Solver.OUTPUT_FINAL
+
+        :param output: (optional) one of the Solver.OUTPUT_* modes, which determines how the evolution is reported
+
+        :param store: (optional) the path of a .npy file.  If given, the evolution is written to the file as it is
+        integrated, and returned as a memory-mapped view of it (see Solver._store_trajectory).  Not used for
+        Solver.OUTPUT_FINAL or when integrating until steady state, where only the states at the residual checks are
+        kept.
+
         :return: a 3-tuple consisting of the species-to-index map, a numPy array giving the evolution of each species in the columns, and an array of the time steps.
         """
         if X0 is not None:
             # if another set of initial conditions (different from that specified in the model file)
             # is given, we ensure they're valid by using the method models.Model.set_initial_conditions
             # then we reset our initial conditions in the solver.  This ensures that 1) approriate initial conditions
-            self.model.set_initial_conditions(X0)
-            self._setup_initial_conditions()
+            self.set_initial_conditions(X0)
+
+        if k is None:
+            k = self.kvals
+        k = np.asarray(k, dtype=float)
+
+        if until_steady:
+            t, X, self._convergence_report = self._integrate_until_steady(self.initial_conditions[np.newaxis, :], k)
+            if output == Solver.OUTPUT_FINAL:
+                return self._species_mapping, X[-1:, 0, :], t[-1:]
+            return self._species_mapping, X[:, 0, :], t
 
         tmax = self.model.get_simulation_time()
-        t = np.linspace(0, tmax, 100000)
-        X = integrate.odeint(self._dX_dt, self.initial_conditions, t, args=(k,), Dfun=self._jacobian)
+        t = self._output_times(tmax, output)
+        advance = lambda x, times: self._advance(x, times, k)
+        if store is not None and output != Solver.OUTPUT_FINAL:
+            X = self._store_trajectory(store, self.initial_conditions, t, advance)
+        else:
+            X = advance(self.initial_conditions, t)
+        self._convergence_report = self._fixed_horizon_report(X[-1:], k, tmax)
+        X, t = self._format_output(t, X, output, advance)
         return self._species_mapping, X, t
+
+    def _advance(self, X_start, t, k):
+        """
+        Integrates a single state
+
+        :param X_start: a M-length numPy array giving the state at time t[0]
+
+        :param t: a numPy array of the times at which the state is reported
+
+        :param k: an array of rate constants
+
+        :return: a (len(t) x M) numPy array of the states
+        """
+        return self._integrate_states(X_start[np.newaxis, :], t, k)[:, 0, :]
+
+    def relative_residual(self, X, k):
+        """
+        Computes |dX/dt|/|X| for each row, which measures how far a state is from equilibrium.
+
+        :param X: a (N x M) numPy array of concentration states
+
+        :param k: an array of rate constants, either of length 2J or (N x 2J)
+
+        :return: a N-length numPy array
+        """
+        rate_norm = np.sqrt(np.sum(self._batch_dX_dt(X, k)**2, axis=1))
+        state_norm = np.sqrt(np.sum(X**2, axis=1))
+        return rate_norm/np.maximum(state_norm, np.finfo(float).tiny)
+
+    def _fixed_horizon_report(self, X, k, tmax):
+        """
+        Creates the ConvergenceReport for states reached by integrating for a fixed time.  Since the residual is
+        only checked at the end, converged rows are reported with a convergence time of tmax.
+
+        :param X: a (N x M) numPy array of the final states
+
+        :param k: an array of rate constants, either of length 2J or (N x 2J)
+
+        :param tmax: the length of the integration
+
+        :return: a ConvergenceReport instance
+        """
+        residual = self.relative_residual(X, k)
+        converged = residual < ODESolverWJacobian.STEADY_STATE_TOLERANCE
+        return ConvergenceReport(converged, np.where(converged, tmax, np.nan), residual)
+
+    def _integrate_until_steady(self, X0, k):
+        """
+        Integrates until every row reaches equilibrium.  The integration proceeds in segments whose length doubles,
+        starting from a fraction of the simulation time.  After each segment the rows whose residual is below
+        ODESolverWJacobian.STEADY_STATE_TOLERANCE are dropped, so the integration stops as soon as the last row
+        has converged.  If rows remain, the horizon is extended beyond the simulation time, up to
+        ODESolverWJacobian.MAX_HORIZON_FACTOR times the simulation time.
+
+        :param X0: a (N x M) numPy array of initial conditions, all finite
+
+        :param k: an array of rate constants, either of length 2J or (N x 2J)
+
+        :return: a 3-tuple of a numPy array of the times the residual was checked, a (len(t) x N x M) numPy array
+        of the states at those times, and a ConvergenceReport instance
+        """
+        per_row_k = k.ndim == 2
+        tol = ODESolverWJacobian.STEADY_STATE_TOLERANCE
+        tmax = self.model.get_simulation_time()
+        t_horizon = tmax*ODESolverWJacobian.MAX_HORIZON_FACTOR
+
+        X = np.array(X0, dtype=float)
+        residual = self.relative_residual(X, k)
+        convergence_time = np.where(residual < tol, 0.0, np.nan)
+        active = np.isnan(convergence_time)
+
+        times = [0.0]
+        history = [X.copy()]
+        t_current = 0.0
+        t_next = tmax*ODESolverWJacobian.STEADY_STATE_FIRST_CHECK
+        while np.any(active) and t_current < t_horizon:
+            rows = np.where(active)[0]
+            rows_k = k[rows] if per_row_k else k
+
+            # the conserved totals are unchanged by the integration, so the integration can restart from the
+            # current states of the remaining rows
+            X[rows] = self._integrate_states(X[rows], np.array([t_current, t_next]), rows_k)[-1]
+
+            residual[rows] = self.relative_residual(X[rows], rows_k)
+            newly_converged = rows[residual[rows] < tol]
+            convergence_time[newly_converged] = t_next
+            active[newly_converged] = False
+
+            t_current = t_next
+            t_next = min(2*t_next, t_horizon)
+            times.append(t_current)
+            history.append(X.copy())
+        return np.array(times), np.array(history), ConvergenceReport(~active, convergence_time, residual)
+
+    def get_convergence_report(self):
+        """
+        Get the ConvergenceReport describing the most recent solution
+
+        :return: a ConvergenceReport instance, or None if nothing has been solved yet
+        """
+        return self._convergence_report
+
+
+    def _batch_dX_dt(self, X, k=None):
+        """
+        Vectorized form of ODESolverWJacobian._dX_dt which evaluates the time rate-of-change for many states at once.
+
+        :param X: a (N x M) numPy array, where each row is a concentration state
+
+        :param k: (optional) a numPy array of rate constants.  Either a single 2J-length array shared by all rows, or
+        a (N x 2J) array giving the rate constants for each row.
+
+        :return: a (N x M) numPy array giving the time rate of change of each row
+        """
+        if k is None:
+            k = self.kvals
+        return self._evaluate_compiled(self._compiled_model.rhs, X, k)
+
+    def _batch_jacobian(self, X, k=None):
+        """
+        Vectorized form of ODESolverWJacobian._jacobian which computes the Jacobian for many states at once.
+
+        This evaluates the function generated for the model by model_compiler.compile_model, which only computes
+        the nonzero entries, so the cost scales with the number of nonzero stoichiometric coefficients rather than
+        with the size of the dense matrices.
+
+        :param X: a (N x M) numPy array, where each row is a concentration state
+
+        :param k: (optional) a numPy array of rate constants, either of length 2J or (N x 2J)
+
+        :return: a (N x M x M) numPy array, where entry n is the Jacobian for row n of X
+        """
+        if k is None:
+            k = self.kvals
+        return self._evaluate_compiled(self._compiled_model.jacobian, X, k)
+
+    def _evaluate_compiled(self, func, X, k):
+        """
+        Evaluates one of the compiled model functions for a stack of states.  A single row is evaluated as a single
+        state, since the generated code is much faster on scalars than on length-one arrays.
+
+        :param func: a function of a CompiledModel (see model_compiler.CompiledModel)
+
+        :param X: a (N x M) numPy array, where each row is a concentration state
+
+        :param k: a numPy array of rate constants, either of length 2J or (N x 2J)
+
+        :return: the result of func, with the rows along the first axis
+        """
+        k = np.asarray(k)
+        if X.shape[0] == 1:
+            return func(X[0], k.reshape(-1, 2*self.J)[0])[np.newaxis]
+        return func(X, k)
+
+    @staticmethod
+    def _monomials(X, exponents):
+        """
+        Evaluates products of powers of the concentrations, prod_s X_s^exponents[r,s] for each row r, in the log
+        domain as exp(exponents.log(X)).  Only the nonzero exponents take part in the sparse matrix product, so the
+        cost scales with the number of participating species rather than with the size of the network.
+
+        A zero concentration has a logarithm of -inf, which gives a product of exactly zero when its exponent is
+        positive.  Slightly negative concentrations (as integrators may overshoot to) keep the sign of their
+        integer powers, matching X**exponents.
+
+        :param X: a numPy array of concentrations, either a single M-length state or (N x M) states
+
+        :param exponents: a (R x M) scipy.sparse matrix of exponents
+
+        :return: a numPy array of the R products, (N x R) for a stack of states
+        """
+        with np.errstate(divide='ignore'):
+            log_X = np.log(np.abs(X))
+        products = np.exp(exponents.dot(log_X.T).T)
+        negative = X < 0
+        if np.any(negative):
+            odd = np.mod(exponents.dot(negative.T.astype(float)).T, 2) == 1
+            products[odd] = -products[odd]
+        return products
+
+    def _mass_action_rates(self, X, k=None):
+        """
+        Computes the rate of each reaction direction, k[q]*prod_s X_s^alpha[s,q] for the forward reactions followed
+        by k[J+q]*prod_s X_s^gamma[s,q] for the reverse reactions, see ODESolverWJacobian._monomials.
+
+        :param X: a numPy array of concentrations, either a single M-length state or (N x M) states
+
+        :param k: (optional) a numPy array of rate constants, either of length 2J or (N x 2J)
+
+        :return: a numPy array of the 2J rates, (N x 2J) for a stack of states
+        """
+        if k is None:
+            k = self.kvals
+        return k*self._monomials(X, self._rate_exponents)
+
+    def _plan_contributions(self, X, k=None):
+        """
+        Evaluates the terms of the Jacobian following the plan made by ODESolverWJacobian._create_jacobian_plan.
+
+        :param X: a (N x M) numPy array, where each row is a concentration state
+
+        :param k: (optional) a numPy array of rate constants, either of length 2J or (N x 2J)
+
+        :return: a (N x C) numPy array, where C is the number of contributions in the plan.  Entry (n,c) is added to
+        the Jacobian entry given by ODESolverWJacobian._plan_contribution_target[c] for row n.
+        """
+        if k is None:
+            k = self.kvals
+        k = np.atleast_2d(k)
+
+        # (N x E) derivatives of the rate of each reaction direction with respect to one of its species
+        d_rates = self._plan_sign*k[:, self._plan_rate_index]*self._plan_coefficient * \
+            self._monomials(X, self._plan_exponents)
+        return d_rates[:, self._plan_contribution_entry]*self._plan_contribution_weight
+
+    def _setup_sparse_backend(self, use_sparse):
+        """
+        Decides whether the sparse integration path is used and, if so, creates the sparse stoichiometry matrix
+        and the layout of the sparse Jacobian.
+
+        :param use_sparse: True, False, or None to decide based on the number of species
+
+        :return: None
+        """
+        if use_sparse is None:
+            use_sparse = self.M >= ODESolverWJacobian.SPARSE_SPECIES_THRESHOLD
+        self.use_sparse = use_sparse
+        if not use_sparse:
+            return
+
+        self.Z_sparse = sparse.csr_matrix(self.Z)
+
+        # the position of each plan contribution within the (sorted) nonzero entries of the Jacobian
+        pattern = np.unique(self._plan_contribution_target)
+        self._sparse_jacobian_rows = pattern // self.M
+        self._sparse_jacobian_cols = pattern % self.M
+        self._sparse_contribution_position = np.searchsorted(pattern, self._plan_contribution_target)
+
+    def _sparse_dX_dt(self, X, k=None):
+        """
+        Computes the time rate-of-change for many states from the log-domain rates of the reactions (see
+        ODESolverWJacobian._mass_action_rates) and the sparse stoichiometry matrix.
+
+        :param X: a (N x M) numPy array, where each row is a concentration state
+
+        :param k: (optional) a numPy array of rate constants, either of length 2J or (N x 2J)
+
+        :return: a (N x M) numPy array giving the time rate of change of each row
+        """
+        rates = np.atleast_2d(self._mass_action_rates(X, k))
+        c_matrix = rates[:, :self.J] - rates[:, self.J:]
+        return self.Z_sparse.dot(c_matrix.T).T
+
+    def _sparse_jacobian(self, X, k=None):
+        """
+        Computes the Jacobian for many states as a single sparse matrix.  The states are stacked as in
+        integrators.Integrator, so the matrix is block-diagonal.
+
+        :param X: a (N x M) numPy array, where each row is a concentration state
+
+        :param k: (optional) a numPy array of rate constants, either of length 2J or (N x 2J)
+
+        :return: a (N*M x N*M) scipy.sparse.csc_matrix
+        """
+        N = X.shape[0]
+        n_pattern = len(self._sparse_jacobian_rows)
+        positions = (np.arange(N)[:, np.newaxis]*n_pattern + self._sparse_contribution_position).ravel()
+        data = np.bincount(positions, weights=self._plan_contributions(X, k).ravel(), minlength=N*n_pattern)
+        offsets = np.arange(N)[:, np.newaxis]*self.M
+        rows = (offsets + self._sparse_jacobian_rows).ravel()
+        cols = (offsets + self._sparse_jacobian_cols).ravel()
+        return sparse.csc_matrix((data, (rows, cols)), shape=(N*self.M, N*self.M))
+
+    def _setup_integrator(self, integrator, tolerance):
+        """
+        Checks and stores the choice of integrator and tolerances
+
+        :param integrator: the name of a registered integrator, or None to choose one for each integration
+
+        :param tolerance: the name of one of the integrators.TOLERANCE_PRESETS
+
+        :return: None
+        """
+        if integrator is not None:
+            integrators.get_integrator(integrator)
+        self.integrator = integrator
+        self.tolerance = tolerance
+        self.rtol, self.atol = integrators.get_tolerances(tolerance)
+        self._last_integrator = None
+
+    def get_last_integrator(self):
+        """
+        :return: the name of the integrator used by the most recent integration, or None if nothing has been
+        integrated yet
+        """
+        return self._last_integrator
+
+    def _integrate_states(self, X0, t, k):
+        """
+        Integrates many states at once.  The rows are stacked into a single system, whose Jacobian is block-diagonal
+        since the rows do not interact.
+
+        On the dense path the conserved species are eliminated first (see ODESolverWJacobian._reduced_system), and
+        the integrator receives the stack of Jacobian blocks.  On the sparse path eliminating species would fill in
+        the Jacobian, so the full set of species is integrated with a sparse Jacobian.
+
+        Unless an integrator was given to the constructor, one is chosen by integrators.select_integrator.  Only the
+        sparse path chooses by the stiffness of the system at the starting states; the dense path always uses LSODA,
+        which detects stiffness itself.
+
+        :param X0: a (N x M) numPy array of starting states
+
+        :param t: a numPy array of the times at which the states are reported
+
+        :param k: an array of rate constants, either of length 2J or (N x 2J)
+
+        :return: a (len(t) x N x M) numPy array of the states at each of the times
+        """
+        if self.use_sparse:
+            Y0, expand = X0, lambda Y: Y
+            rhs = lambda Y: self._sparse_dX_dt(Y, k)
+            jac = lambda Y: self._sparse_jacobian(Y, k)
+        else:
+            Y0, reduced_rhs, reduced_jac, expand = self._reduced_system(X0, k)
+            rhs = lambda Y: reduced_rhs(Y, k)
+            jac = lambda Y: reduced_jac(Y, k)
+
+        if self.integrator is None:
+            # the choice only depends on the stiffness on the sparse path, see integrators.select_integrator
+            stiffness = integrators.estimate_stiffness(jac(Y0), t[-1] - t[0], True) if self.use_sparse else None
+            integrator = integrators.select_integrator(stiffness, self.use_sparse)
+        else:
+            integrator = integrators.get_integrator(self.integrator)
+        self._last_integrator = integrator.name
+        return expand(integrator.integrate(rhs, jac, Y0, t, self.rtol, self.atol, self.use_sparse))
+
+    def check_initial_condition_matrix(self, X0):
+        """
+        Ensures that a matrix of initial conditions has one column per species and contains no negative
+        concentrations.  NaN entries are allowed and mark rows which should not be solved.
+
+        :param X0: an array-like of initial conditions, either a single M-length state or an (N x M) matrix
+
+        :return: the initial conditions as a (N x M) numPy array of floats
+        """
+        X0 = np.atleast_2d(np.asarray(X0, dtype=float))
+        if X0.shape[1] != self.M:
+            raise InvalidInitialConditionException('Expected %d columns of initial conditions, but got %d.'
+                                                   % (self.M, X0.shape[1]))
+        if np.any(X0[np.isfinite(X0)] < 0):
+            raise InvalidInitialConditionException('Initial condition error- cannot be < 0')
+        return X0
+
+    def _conservation_laws(self, k=None):
+        """
+        Splits the species space into the subspace spanned by the reactions and its complement, the left null space
+        of the stoichiometry matrix Z.  Any vector l in the left null space satisfies l.Z = 0, so l.X is constant in
+        time; these are the conservation laws (moieties) of the system.
+
+        Reactions whose forward and reverse rate constants are both zero never proceed, so they are left out of Z
+        here.  Otherwise they would hide conservation laws that actually hold.
+
+        :param k: (optional) an array of rate constants, either of length 2J or (N x 2J)
+
+        :return: a 2-tuple.  The first is a (M x r) numPy array whose orthonormal columns span the reaction
+        subspace, where r is the rank of Z.  The second is a ((M-r) x M) numPy array whose orthonormal rows span
+        the left null space.
+        """
+        if k is None:
+            k = self.kvals
+        k_nonzero = np.any(np.atleast_2d(k) != 0, axis=0)
+        active_reactions = k_nonzero[:self.J] | k_nonzero[self.J:]
+
+        key = tuple(active_reactions)
+        if key not in self._conservation_law_cache:
+            Z_active = self.Z[:, active_reactions]
+            u, sigma, vt = np.linalg.svd(Z_active)
+            if sigma.size > 0:
+                tol = max(Z_active.shape)*np.finfo(float).eps*sigma.max()
+                rank = int(np.sum(sigma > tol))
+            else:
+                rank = 0
+            self._conservation_law_cache[key] = (u[:, :rank], u[:, rank:].T)
+        return self._conservation_law_cache[key]
+
+    def _reduced_system(self, X0, k):
+        """
+        Sets up the system which is actually integrated.  Each conservation law l.X = l.X0 fixes one species given
+        the others, so (if ODESolverWJacobian.reduce_conservation is set) those dependent species are eliminated and
+        only the independent species are integrated.  The dependent species are recovered from the conserved totals
+        when the states are expanded, so the conservation laws hold to machine precision.
+
+        The dependent species are chosen by a pivoted QR decomposition of the conservation laws, weighted by the
+        initial concentrations so that abundant species are preferred.
+
+        :param X0: a (N x M) numPy array of initial conditions
+
+        :param k: an array of rate constants, either of length 2J or (N x 2J)
+
+        :return: a 4-tuple.  The first is the (N x m) numPy array of starting states for the m integrated species.
+        The second and third are callables taking a (N x m) state array and the rate constants, giving the (N x m)
+        time rate-of-change and the (N x m x m) stack of Jacobians of the integrated system.  The last is a callable
+        which expands an array of integrated states (with the species along the last axis) to the full set of M
+        species.
+        """
+        U, L = self._conservation_laws(k)
+        if not self.reduce_conservation or L.shape[0] == 0:
+            return X0, self._batch_dX_dt, self._batch_jacobian, lambda Y: Y
+
+        weights = np.mean(X0, axis=0)
+        weights = weights + 1e-3*weights.max() + np.finfo(float).tiny
+        q, r, pivots = linalg.qr(L*weights[np.newaxis, :], pivoting=True)
+        n_dependent = L.shape[0]
+        dependent = np.sort(pivots[:n_dependent])
+        independent = np.sort(pivots[n_dependent:])
+
+        # with X split into the independent (i) and dependent (d) species, L_d.X_d + L_i.X_i = L.X0, so that
+        # X_d = inv(L_d).L.X0 - P.X_i.  The expansion is then the affine map X = offset + Y.E
+        L_d_inv = np.linalg.inv(L[:, dependent])
+        P = np.dot(L_d_inv, L[:, independent])
+        offset = np.zeros(X0.shape)
+        offset[:, dependent] = np.dot(np.dot(X0, L.T), L_d_inv.T)
+        E = np.zeros((len(independent), self.M))
+        E[np.arange(len(independent)), independent] = 1.0
+        E[:, dependent] = -P.T
+
+        def expand(Y):
+            return offset + np.dot(Y, E)
+
+        def rhs(Y, kk):
+            return self._batch_dX_dt(expand(Y), kk)[:, independent]
+
+        def jac(Y, kk):
+            full_jacobian = self._batch_jacobian(expand(Y), kk)[:, independent, :]
+            return full_jacobian[:, :, independent] - np.dot(full_jacobian[:, :, dependent], P)
+
+        return X0[:, independent], rhs, jac, expand
+
+    def ensemble_equilibrium_solution(self, X0, k=None, chunk_size=None, until_steady=False):
+        """
+        Runs the integration for many sets of initial conditions at once.  Rather than looping over the initial
+        conditions, the rows are stacked into a single system and advanced together (see
+        integrators.Integrator).
+
+        Rows containing non-finite initial conditions are not integrated and give NaN in the result.  Whether each
+        row reached equilibrium is available afterwards from ODESolverWJacobian.get_convergence_report
+
+        :param X0: a (N x M) numPy array of initial conditions.  The columns are ordered according to the
+        species-to-index map (see Solver.get_species_mapping)
+
+        :param k: (optional) an array of rate constants.  Either a single 2J-length array used for all the rows, or
+        a (N x 2J) array giving the rate constants for each row.
+
+        :param chunk_size: (optional) the maximum number of rows integrated together in one system.  Defaults to
+        ODESolverWJacobian.ENSEMBLE_CHUNK_SIZE
+
+        :param until_steady: (optional) if True, integrate each row until it reaches equilibrium rather than for the
+        simulation time of the model (see ODESolverWJacobian._integrate_until_steady)
+
+        :return: a (N x M) numPy array giving the equilibrium concentrations for each row
+        """
+        X0 = self.check_initial_condition_matrix(X0)
+
+        if chunk_size is None:
+            chunk_size = ODESolverWJacobian.ENSEMBLE_CHUNK_SIZE
+
+        if k is None:
+            k = self.kvals
+        k = np.asarray(k, dtype=float)
+        per_row_k = k.ndim == 2
+
+        tmax = self.model.get_simulation_time()
+        t = self._output_times(tmax, Solver.OUTPUT_FINAL)
+
+        result = np.empty(X0.shape)
+        result.fill(np.nan)
+        report = ConvergenceReport(np.zeros(X0.shape[0], dtype=bool),
+                                   np.nan*np.ones(X0.shape[0]),
+                                   np.nan*np.ones(X0.shape[0]))
+        valid_rows = np.where(np.all(np.isfinite(X0), axis=1))[0]
+        for start in range(0, len(valid_rows), chunk_size):
+            rows = valid_rows[start:start + chunk_size]
+            chunk_k = k[rows] if per_row_k else k
+            if until_steady:
+                _, X, chunk_report = self._integrate_until_steady(X0[rows], chunk_k)
+                result[rows] = X[-1]
+            else:
+                result[rows] = self._integrate_states(X0[rows], t, chunk_k)[-1]
+                chunk_report = self._fixed_horizon_report(result[rows], chunk_k, tmax)
+            report.converged[rows] = chunk_report.converged
+            report.convergence_time[rows] = chunk_report.convergence_time
+            report.residual[rows] = chunk_report.residual
+        self._convergence_report = report
+        return result
+
+    def ensemble_trajectories(self, X0, k=None, output=Solver.OUTPUT_LOG, chunk_size=None, store=None):
+        """
+        Integrates many sets of initial conditions over the simulation time of the model, reporting the states of
+        every row at the times of an output mode.
+
+        Rows containing non-finite initial conditions are not integrated and give NaN in the result.
+
+        :param X0: a (N x M) numPy array of initial conditions.  The columns are ordered according to the
+        species-to-index map (see Solver.get_species_mapping)
+
+        :param k: (optional) an array of rate constants, either of length 2J or (N x 2J)
+
+        :param output: (optional) one of Solver.OUTPUT_TRAJECTORY, Solver.OUTPUT_FINAL or Solver.OUTPUT_LOG, which
+        determines the times reported.  Defaults to the logarithmic grid.
+
+        :param chunk_size: (optional) the maximum number of rows integrated together in one system.  Defaults to
+        ODESolverWJacobian.ENSEMBLE_CHUNK_SIZE
+
+        :param store: (optional) the path of a .npy file.  If given, each chunk of rows is integrated one block of
+        times at a time and written to the file (see trajectory_store.TrajectoryStore), so the memory used depends on
+        neither the number of rows nor the length of the simulation.  The states are then returned as a
+        memory-mapped view of the file.
+
+        :return: a 2-tuple of a numPy array of the times and a (len(t) x N x M) numPy array of the states
+        """
+        if output == Solver.OUTPUT_DENSE:
+            raise InvalidOutputModeException('Dense output is only available for a single set of initial conditions')
+        X0 = self.check_initial_condition_matrix(X0)
+
+        if chunk_size is None:
+            chunk_size = ODESolverWJacobian.ENSEMBLE_CHUNK_SIZE
+
+        if k is None:
+            k = self.kvals
+        k = np.asarray(k, dtype=float)
+        per_row_k = k.ndim == 2
+
+        t = self._output_times(self.model.get_simulation_time(), output)
+        valid = np.all(np.isfinite(X0), axis=1)
+        valid_rows = np.where(valid)[0]
+        if store is None:
+            X = np.nan*np.ones((len(t),) + X0.shape)
+        else:
+            trajectories = trajectory_store.TrajectoryStore.create(store, t, X0.shape)
+            X = trajectories.states
+            X[:, ~valid] = np.nan
+        for start in range(0, len(valid_rows), chunk_size):
+            rows = valid_rows[start:start + chunk_size]
+            rows_k = k[rows] if per_row_k else k
+            if store is None:
+                X[:, rows] = self._integrate_states(X0[rows], t, rows_k)
+                continue
+            advance = lambda x, times: self._integrate_states(x, times, rows_k)
+            for block_start, states in trajectory_store.integrate_in_blocks(advance, X0[rows], t):
+                X[block_start:block_start + len(states), rows] = states
+        if store is not None:
+            trajectories.flush()
+        return t, X
+
+
+class AlgebraicEquilibriumSolver(ODESolverWJacobian):
+    """
+    This solver finds the equilibrium state directly, without integrating the trajectory.
+
+    At equilibrium the mass-action rates satisfy Z.c(X) = 0.  Only r = rank(Z) of those equations are independent,
+    so they are projected onto the reaction subspace and completed with the conservation laws L.X = L.X0, which fix
+    the equilibrium reached from the initial conditions.  The resulting square system is solved by a damped Newton
+    iteration using the analytic Jacobian of ODESolverWJacobian.  Rows for which the iteration does not converge
+    are integrated in time until they reach steady state (as in ODESolverWJacobian) and then polished with Newton.
+
+    Models made only of reversible binding reactions are first solved for the free concentrations of their
+    components instead, see AlgebraicEquilibriumSolver._binding_equilibrium.
+    """
+
+    # Newton iteration limits.  A row has converged once every component of the Newton step is within
+    # NEWTON_RTOL*|X| + NEWTON_ATOL*max(X0) and |dX/dt|/|X| is below NEWTON_RESIDUAL_TOL.  The absolute part is
+    # scaled by the largest initial concentration since that limits how well the conservation laws resolve the
+    # smallest species.
+    NEWTON_MAX_ITERATIONS = 100
+    NEWTON_RTOL = 1e-10
+    NEWTON_ATOL = 1e-14
+    NEWTON_RESIDUAL_TOL = 1e-12
+
+    # a Newton step may not reduce any concentration below this fraction of its current value, which keeps the
+    # iterates positive
+    NEWTON_FLOOR_FRACTION = 0.01
+
+    # the maximum number of times a Newton step is halved while looking for a decrease in the residual
+    NEWTON_MAX_BACKTRACKS = 8
+
+    # When warm starting, rows are ordered by similarity and every WARM_START_STRIDE-th row is solved from its
+    # initial conditions.  The rows in between are started from the equilibrium of a neighbouring solved row.
+    # Rows are grouped in sets of at most WARM_START_LEAF_SIZE while ordering them.
+    WARM_START_STRIDE = 16
+    WARM_START_LEAF_SIZE = 8
+
+    # Models made only of reversible binding reactions (see model_compiler.binding_network) are solved for the free
+    # concentrations of their components.  These start from BINDING_FIXED_POINT_SWEEPS sweeps of the free-ligand
+    # fixed-point iteration and are then refined by Newton steps on their logarithms, using the limits above.
+    BINDING_FIXED_POINT_SWEEPS = 6
+
+    # the largest change in the logarithm of any free concentration in one Newton step, since from a poor start the
+    # step can run far past the solution
+    BINDING_MAX_LOG_STEP = 4.0
+
+    # the most components a binding network may have to be solved as one.  The Newton steps hold and solve a dense
+    # (d x d) system for each row, so larger networks are solved as other models are.
+    BINDING_MAX_COMPONENTS = 1024
+
+    def _compile_model(self):
+        """
+        Compiles the model as in Solver._compile_model, and detects whether it is a binding network which can be
+        solved by AlgebraicEquilibriumSolver._binding_equilibrium
+
+        :return: None
+        """
+        super(AlgebraicEquilibriumSolver, self)._compile_model()
+        self._binding_network = model_compiler.binding_network(self._species_mapping, self.alpha, self.gamma)
+
+    def is_binding_network(self):
+        """
+        :return: True if the model is made only of reversible binding reactions, so its rows are solved by
+        AlgebraicEquilibriumSolver._binding_equilibrium.  See model_compiler.binding_network
+        """
+        return self._binding_network is not None
+
+    def _equilibrium_residual(self, X, totals, k, U, L):
+        """
+        Evaluates the equilibrium conditions for many states at once
+
+        :param X: a (N x M) numPy array of concentration states
+
+        :param totals: a (N x (M-r)) numPy array of the conserved totals L.X0 for each row
+
+        :param k: an array of rate constants, either of length 2J or (N x 2J)
+
+        :param U: a (M x r) numPy array spanning the reaction subspace (see ODESolverWJacobian._conservation_laws)
+
+        :param L: a ((M-r) x M) numPy array spanning the conservation laws
+
+        :return: a (N x M) numPy array of residuals, which is zero at equilibrium
+        """
+        return np.hstack([np.dot(self._batch_dX_dt(X, k), U), np.dot(X, L.T) - totals])
+
+    def _equilibrium_residual_jacobian(self, X, k, U, L):
+        """
+        The Jacobian of AlgebraicEquilibriumSolver._equilibrium_residual with respect to the concentrations
+
+        :return: a (N x M x M) numPy array
+        """
+        rate_part = np.einsum('mi,nmj->nij', U, self._batch_jacobian(X, k))
+        conservation_part = np.tile(L[np.newaxis, :, :], (X.shape[0], 1, 1))
+        return np.concatenate([rate_part, conservation_part], axis=1)
+
+    @staticmethod
+    def _solve_linear_systems(A, b):
+        """
+        Solves the stack of linear systems A[n].x[n] = b[n].  If any system is singular, each is solved in the
+        least-squares sense instead.
+
+        :param A: a (N x M x M) numPy array
+
+        :param b: a (N x M) numPy array, or a (N x M x P) numPy array to solve for P right-hand sides at once
+
+        :return: a numPy array with the shape of b
+        """
+        B = b if b.ndim == 3 else b[:, :, np.newaxis]
+        try:
+            x = np.linalg.solve(A, B)
+        except np.linalg.LinAlgError:
+            x = np.array([np.linalg.lstsq(A[n], B[n], rcond=-1)[0] for n in range(A.shape[0])])
+        return x if b.ndim == 3 else x[:, :, 0]
+
+    def _newton(self, X_guess, X0, k):
+        """
+        Runs the damped Newton iteration for many rows at once.  Each row is advanced until it converges or the
+        iteration limit is reached.
+
+        :param X_guess: a (N x M) numPy array of starting concentrations
+
+        :param X0: a (N x M) numPy array of initial conditions, which set the conserved totals
+
+        :param k: an array of rate constants, either of length 2J or (N x 2J)
+
+        :return: a 3-tuple of a (N x M) numPy array of the final iterates, a boolean array marking the rows which
+        converged and an integer array of the iterations taken by each row
+        """
+        U, L = self._conservation_laws(k)
+        per_row_k = k.ndim == 2
+        totals = np.dot(X0, L.T)
+
+        X = np.array(X_guess, dtype=float)
+        converged = np.zeros(X.shape[0], dtype=bool)
+        iterations = np.zeros(X.shape[0], dtype=int)
+        atol = AlgebraicEquilibriumSolver.NEWTON_ATOL*np.max(X0, axis=1)
+        rank = U.shape[1]
+        for iteration in range(AlgebraicEquilibriumSolver.NEWTON_MAX_ITERATIONS):
+            rows = np.where(~converged)[0]
+            if len(rows) == 0:
+                break
+            iterations[rows] += 1
+            Xr = X[rows]
+            kr = k[rows] if per_row_k else k
+            F = self._equilibrium_residual(Xr, totals[rows], kr, U, L)
+            F_norm = np.sqrt(np.sum(F**2, axis=1))
+            delta = -self._solve_linear_systems(self._equilibrium_residual_jacobian(Xr, kr, U, L), F)
+
+            # backtrack until the residual decreases, never letting a concentration fall below a fraction of
+            # its current value
+            step = np.ones(len(rows))
+            X_new = np.maximum(Xr + delta, AlgebraicEquilibriumSolver.NEWTON_FLOOR_FRACTION*Xr)
+            for backtrack in range(AlgebraicEquilibriumSolver.NEWTON_MAX_BACKTRACKS + 1):
+                F_new = self._equilibrium_residual(X_new, totals[rows], kr, U, L)
+                worse = ~(np.sqrt(np.sum(F_new**2, axis=1)) < F_norm)
+                if not np.any(worse) or backtrack == AlgebraicEquilibriumSolver.NEWTON_MAX_BACKTRACKS:
+                    break
+                step[worse] *= 0.5
+                X_new[worse] = np.maximum(Xr[worse] + step[worse, np.newaxis]*delta[worse],
+                                          AlgebraicEquilibriumSolver.NEWTON_FLOOR_FRACTION*Xr[worse])
+
+            # the step is measured before the floor is applied, so a concentration held back by the floor keeps
+            # the row iterating
+            tolerance = AlgebraicEquilibriumSolver.NEWTON_RTOL*np.abs(X_new) + atol[rows, np.newaxis]
+            change = np.max(np.abs(step[:, np.newaxis]*delta)/tolerance, axis=1)
+
+            # since dX/dt lies in the reaction subspace, the norm of the projected rates is the norm of dX/dt
+            residual = np.sqrt(np.sum(F_new[:, :rank]**2, axis=1)) / \
+                np.maximum(np.sqrt(np.sum(X_new**2, axis=1)), np.finfo(float).tiny)
+            X[rows] = X_new
+            converged[rows] = (change <= 1) & \
+                (residual < AlgebraicEquilibriumSolver.NEWTON_RESIDUAL_TOL) & \
+                np.all(np.isfinite(X_new), axis=1)
+        return X, converged, iterations
+
+    def _binding_rows(self, k, n_rows):
+        """
+        :param k: an array of rate constants, either of length 2J or (N x 2J)
+
+        :param n_rows: the number of rows, N
+
+        :return: the indexes of the rows which can be solved by AlgebraicEquilibriumSolver._binding_equilibrium.
+        These are all the rows if the model is a binding network of at most BINDING_MAX_COMPONENTS components,
+        except those with a rate constant which is not positive.
+        """
+        if self._binding_network is None or \
+                self._binding_network.composition.shape[1] > AlgebraicEquilibriumSolver.BINDING_MAX_COMPONENTS:
+            return np.array([], dtype=int)
+        positive = np.all(k > 0, axis=-1)
+        if k.ndim == 2:
+            return np.where(positive)[0]
+        return np.arange(n_rows) if positive else np.array([], dtype=int)
+
+    def _binding_equilibrium(self, X0, k, X_guess=None):
+        """
+        Finds the equilibrium of many rows of a binding network (see model_compiler.BindingNetwork) at once.  With
+        u = log(f) for the free concentrations f of the components, the concentrations are
+        X = exp(log(beta) + composition.u), and the conserved totals T = composition.T.X0 are met where the convex
+        potential sum(X) - T.u is smallest.  The free concentrations start from the free-ligand fixed-point
+        iteration, which scales each component in turn so that its own total is met, and are then refined by
+        Newton steps on u, backtracking until the potential decreases.  Components with a total of zero are absent,
+        along with every species containing them.
+
+        :param X0: a (N x M) numPy array of initial conditions, all finite
+
+        :param k: an array of rate constants, either of length 2J or (N x 2J), all positive
+
+        :param X_guess: (optional) a (N x M) numPy array whose component concentrations are used as the starting free
+        concentrations.  Defaults to the totals of the components.
+
+        :return: a 3-tuple of a (N x M) numPy array of the equilibrium concentrations, a boolean array marking the
+        rows which converged and an integer array of the Newton iterations taken by each row
+        """
+        network = self._binding_network
+        C = network.composition
+        n_rows, d = X0.shape[0], C.shape[1]
+        J = self.alpha.shape[1]
+        log_beta = np.dot(np.log(k[..., :J]) - np.log(k[..., J:]), network.formation.T)*np.ones((n_rows, 1))
+        totals = np.dot(X0, C)
+        present = totals > 0
+        log_beta[np.dot(~present, (C > 0).T)] = -np.inf
+        log_totals = np.log(np.where(present, totals, 1.0))
+
+        u = np.array(log_totals)
+        if X_guess is not None:
+            free = X_guess[:, network.components]
+            with np.errstate(divide='ignore'):
+                u = np.where(present & (free > 0) & np.isfinite(free), np.log(free), u)
+
+        log_X = lambda u, rows: log_beta[rows] + np.dot(u, C.T)
+        all_rows = np.arange(n_rows)
+        for sweep in range(AlgebraicEquilibriumSolver.BINDING_FIXED_POINT_SWEEPS):
+            for i in range(d):
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    log_bound = logsumexp(log_X(u, all_rows), b=C[:, i], axis=1)
+                u[:, i] = np.where(present[:, i], u[:, i] + log_totals[:, i] - log_bound, 0)
+
+        converged = np.zeros(n_rows, dtype=bool)
+        iterations = np.zeros(n_rows, dtype=int)
+        absent = (~present).astype(float)
+        # the Hessian of the potential is sum_s X[s]*outer(C[s], C[s]).  Each species contains few of the components,
+        # so the flattened outer products are kept as a sparse (M x d*d) matrix.
+        outer_species, outer_entries = [], []
+        for species in range(C.shape[0]):
+            parts = np.nonzero(C[species])[0]
+            outer_species.append(np.repeat(species, len(parts)**2))
+            outer_entries.append((parts[:, np.newaxis]*d + parts).ravel())
+        outer_species, outer_entries = np.concatenate(outer_species), np.concatenate(outer_entries)
+        outer_products = sparse.csr_matrix((C[outer_species, outer_entries // d]*C[outer_species, outer_entries % d],
+                                            (outer_species, outer_entries)), shape=(C.shape[0], d*d))
+        for iteration in range(AlgebraicEquilibriumSolver.NEWTON_MAX_ITERATIONS):
+            rows = np.where(~converged)[0]
+            if len(rows) == 0:
+                break
+            iterations[rows] += 1
+            ur = u[rows]
+            X = np.exp(log_X(ur, rows))
+            gradient = np.dot(X, C) - totals[rows]
+            hessian = outer_products.T.dot(X.T).T.reshape(len(rows), d, d) + absent[rows, :, np.newaxis]*np.eye(d)
+            delta = -self._solve_linear_systems(hessian, gradient)
+            longest = np.maximum(np.max(np.abs(delta), axis=1), AlgebraicEquilibriumSolver.BINDING_MAX_LOG_STEP)
+            delta *= (AlgebraicEquilibriumSolver.BINDING_MAX_LOG_STEP/longest)[:, np.newaxis]
+            potential = np.sum(X, axis=1) - np.sum(totals[rows]*ur, axis=1)
+            # the decrease asked for allows for the rounding error of the potential
+            slack = 1e-14*(np.sum(X, axis=1) + np.sum(np.abs(totals[rows]*ur), axis=1))
+            slope = np.sum(gradient*delta, axis=1)
+
+            step = np.ones(len(rows))
+            for backtrack in range(AlgebraicEquilibriumSolver.NEWTON_MAX_BACKTRACKS + 1):
+                u_new = ur + step[:, np.newaxis]*delta
+                with np.errstate(over='ignore'):
+                    X_new = np.exp(log_X(u_new, rows))
+                new_potential = np.sum(X_new, axis=1) - np.sum(totals[rows]*u_new, axis=1)
+                worse = ~(new_potential <= potential + 1e-4*step*slope + slack)
+                if not np.any(worse) or backtrack == AlgebraicEquilibriumSolver.NEWTON_MAX_BACKTRACKS:
+                    break
+                step[worse] *= 0.5
+
+            u[rows] = u_new
+            change = np.max(np.abs(step[:, np.newaxis]*delta), axis=1)
+            converged[rows] = (change <= AlgebraicEquilibriumSolver.NEWTON_RTOL) & np.all(np.isfinite(u_new), axis=1)
+        return np.exp(log_X(u, all_rows)), converged, iterations
+
+    def _sensitivities(self, X, k, columns=None, initial_conditions=True):
+        """
+        Computes the derivatives of equilibrium states with respect to the rate constants and initial conditions.
+        The equilibrium satisfies F(X, k, X0) = 0 (see AlgebraicEquilibriumSolver._equilibrium_residual), so by the
+        implicit function theorem dX/dp = -inv(dF/dX).dF/dp for any parameter p.  The net rate c_q of reaction q
+        depends on k_q and k_(q+J) through the forward and reverse mass-action products, and the initial conditions
+        only enter through the conserved totals L.X0.  All the derivatives come from one linear solve per row, with
+        a right-hand side for each parameter.
+
+        :param X: a (N x M) numPy array of equilibrium states
+
+        :param k: an array of rate constants, either of length 2J or (N x 2J)
+
+        :param columns: (optional) the indexes of the rate constants to differentiate with respect to.  Defaults to
+        all 2J of them.
+
+        :param initial_conditions: (optional) whether to also differentiate with respect to the initial conditions
+
+        :return: a 2-tuple.  The first is a (N x M x len(columns)) numPy array of dX/dk.  The second is a (N x M x M)
+        numPy array whose entry [n, i, j] is the derivative of species i with respect to the initial concentration
+        of species j, or None if initial_conditions is False.
+        """
+        if columns is None:
+            columns = np.arange(2*self.J)
+        columns = np.asarray(columns, dtype=int)
+        U, L = self._conservation_laws(k)
+        rank = U.shape[1]
+        n_columns = len(columns)
+
+        # the derivatives of the net rates with respect to each rate constant, which only affects its own reaction.
+        # Those are the mass-action products of the reactants (forward) and products (reverse) of each reaction.
+        products = np.ones((X.shape[0], 2*self.J))
+        for offset, coefficients in [(0, self.alpha), (self.J, self.gamma)]:
+            for i, q in zip(*np.nonzero(coefficients)):
+                products[:, offset + q] *= X[:, i]**coefficients[i, q]
+        dc_dk = np.hstack([products[:, :self.J], -products[:, self.J:]])[:, columns]
+        reactions = columns % self.J
+
+        dF = np.zeros((X.shape[0], self.M, n_columns + (self.M if initial_conditions else 0)))
+        dF[:, :rank, :n_columns] = np.dot(U.T, self.Z[:, reactions])[np.newaxis, :, :]*dc_dk[:, np.newaxis, :]
+        if initial_conditions:
+            dF[:, rank:, n_columns:] = -L[np.newaxis, :, :]
+        dX = -self._solve_linear_systems(self._equilibrium_residual_jacobian(X, k, U, L), dF)
+        return dX[:, :, :n_columns], (dX[:, :, n_columns:] if initial_conditions else None)
+
+    def equilibrium_sensitivities(self, X0, k=None, X=None, columns=None, initial_conditions=True):
+        """
+        Determines how the equilibrium responds to small changes in the rate constants and the initial conditions,
+        for many sets of initial conditions at once.  See AlgebraicEquilibriumSolver._sensitivities
+
+        Rows containing non-finite initial conditions give NaN.  The derivatives are only meaningful for rows which
+        reached equilibrium (see ODESolverWJacobian.get_convergence_report).
+
+        :param X0: a (N x M) numPy array of initial conditions.  The columns are ordered according to the
+        species-to-index map (see Solver.get_species_mapping)
+
+        :param k: (optional) an array of rate constants.  Either a single 2J-length array used for all the rows, or
+        a (N x 2J) array giving the rate constants for each row.
+
+        :param X: (optional) a (N x M) numPy array of the equilibrium states, if they are already known.  Otherwise
+        they are found with AlgebraicEquilibriumSolver.ensemble_equilibrium_solution
+
+        :param columns: (optional) the indexes of the rate constants to differentiate with respect to.  Defaults to
+        all 2J of them.
+
+        :param initial_conditions: (optional) whether to also differentiate with respect to the initial conditions
+
+        :return: a 3-tuple.  The first is the (N x M) numPy array of equilibrium states.  The second is a
+        (N x M x len(columns)) numPy array whose entry [n, i, j] is the derivative of species i with respect to rate
+        constant columns[j] (ordered as in Solver._get_rate_constants).  The third is a (N x M x M) numPy array whose
+        entry [n, i, j] is the derivative of species i with respect to the initial concentration of species j, or
+        None if initial_conditions is False.
+        """
+        X0 = self.check_initial_condition_matrix(X0)
+        if k is None:
+            k = self.kvals
+        k = np.asarray(k, dtype=float)
+        per_row_k = k.ndim == 2
+        if X is None:
+            X = self.ensemble_equilibrium_solution(X0, k, warm_start=True)
+        X = np.atleast_2d(np.asarray(X, dtype=float))
+
+        if columns is None:
+            columns = np.arange(2*self.J)
+        dX_dk = np.nan*np.ones((X0.shape[0], self.M, len(columns)))
+        dX_dX0 = np.nan*np.ones((X0.shape[0], self.M, self.M)) if initial_conditions else None
+        valid_rows = np.where(np.all(np.isfinite(X0), axis=1) & np.all(np.isfinite(X), axis=1))[0]
+        if len(valid_rows) > 0:
+            valid_k = k[valid_rows] if per_row_k else k
+            dX_dk[valid_rows], valid_dX_dX0 = self._sensitivities(X[valid_rows], valid_k, columns, initial_conditions)
+            if initial_conditions:
+                dX_dX0[valid_rows] = valid_dX_dX0
+        return X, dX_dk, dX_dX0
+
+    def equilibrium_solution(self, X0=None, k=None):
+        """
+        Determines the equilibrium state.
+
+        Note that it's important that the array of rate constants is ordered in our convention.  Printing the
+        model object is one way to check the order of the reactions so that the rate constants can be arranged
+        in the proper order.
+
+        :param X0: (optional) A dictionary mapping the symbols to the initial concentrations
+
+        :param k: (optional) An array of rate constants.
+
+        :return: a 3-tuple consisting of the species-to-index map, a (1 x M) numPy array giving the equilibrium
+        concentrations, and a 1-length array with the time of that state (infinity, since it is the equilibrium)
+        """
+        if X0 is not None:
+            self.set_initial_conditions(X0)
+
+        X = self.ensemble_equilibrium_solution(self.initial_conditions, k)
+        return self._species_mapping, X, np.array([np.inf])
+
+    def _similarity_features(self, X0, k):
+        """
+        Creates the coordinates used to judge how similar two rows are.  Concentrations (and rate constants, if
+        they vary by row) matter in relative terms, so their logarithms are used, scaled to unit variance.  Zero
+        concentrations are replaced by a small fraction of the largest value in the column, which places rows
+        lacking a species far from those which have it.
+
+        :param X0: a (N x M) numPy array of initial conditions, all finite
+
+        :param k: an array of rate constants, either of length 2J or (N x 2J)
+
+        :return: a (N x F) numPy array of coordinates
+        """
+        columns = [X0]
+        if k.ndim == 2:
+            columns.append(k)
+        values = np.hstack(columns)
+        floor = 1e-6*np.max(values, axis=0) + np.finfo(float).tiny
+        features = np.log(np.maximum(values, floor))
+        spread = np.std(features, axis=0)
+        varying = spread > 0
+        return features[:, varying]/spread[varying]
+
+    def similarity_order(self, X0, k):
+        """
+        Orders rows of initial conditions so that similar rows are next to each other, as used for warm starts.  See
+        AlgebraicEquilibriumSolver._similarity_features and AlgebraicEquilibriumSolver._similarity_order
+
+        :param X0: a (N x M) numPy array of initial conditions, all finite
+
+        :param k: an array of rate constants, either of length 2J or (N x 2J)
+
+        :return: a N-length numPy array of row indices
+        """
+        return self._similarity_order(self._similarity_features(X0, k))
+
+    def _similarity_order(self, features):
+        """
+        Orders the rows so that consecutive rows are close together.  The rows are split recursively at the median
+        of the coordinate with the widest range (as when building a k-d tree) until the groups have at most
+        WARM_START_LEAF_SIZE rows, and the groups are visited in order.  All groups of one level are split at once.
+
+        :param features: a (N x F) numPy array of coordinates, see AlgebraicEquilibriumSolver._similarity_features
+
+        :return: a N-length numPy array of row indices
+        """
+        n_rows = features.shape[0]
+        order = np.arange(n_rows)
+        if n_rows == 0 or features.shape[1] == 0:
+            return order
+
+        # the positions in the ordering where each group starts
+        starts = np.array([0])
+        while True:
+            sizes = np.diff(np.append(starts, n_rows))
+            if sizes.max() <= AlgebraicEquilibriumSolver.WARM_START_LEAF_SIZE:
+                break
+            ordered_features = features[order]
+            ranges = np.maximum.reduceat(ordered_features, starts) - np.minimum.reduceat(ordered_features, starts)
+            group = np.repeat(np.arange(len(starts)), sizes)
+            key = ordered_features[np.arange(n_rows), np.argmax(ranges, axis=1)[group]]
+            order = order[np.lexsort((key, group))]
+
+            large = sizes > AlgebraicEquilibriumSolver.WARM_START_LEAF_SIZE
+            starts = np.sort(np.concatenate([starts, starts[large] + sizes[large]//2]))
+        return order
+
+    def _warm_started_newton(self, X0, k):
+        """
+        Runs the Newton iteration with warm starts from similar rows.  The rows are ordered by
+        AlgebraicEquilibriumSolver._similarity_order and every WARM_START_STRIDE-th row is solved from its initial
+        conditions.  The remaining rows are then solved in rounds, each halving the gap between solved rows: a row
+        starts from the equilibrium of whichever of the solved rows on either side of it in the ordering is closer.
+        Since a Newton step from a neighbouring equilibrium already accounts for the change in the conserved totals
+        to first order, those rows need only a few iterations.
+
+        :param X0: a (N x M) numPy array of initial conditions, all finite
+
+        :param k: an array of rate constants, either of length 2J or (N x 2J)
+
+        :return: a 3-tuple of a (N x M) numPy array of the final iterates, a boolean array marking the rows which
+        converged and an integer array of the iterations taken by each row, all in the original order of the rows
+        """
+        per_row_k = k.ndim == 2
+        features = self._similarity_features(X0, k)
+        order = self._similarity_order(features)
+        X0_ordered = X0[order]
+        k_ordered = k[order] if per_row_k else k
+        features = features[order]
+
+        n_rows = X0.shape[0]
+        stride = AlgebraicEquilibriumSolver.WARM_START_STRIDE
+        X = np.array(X0_ordered)
+        converged = np.zeros(n_rows, dtype=bool)
+        iterations = np.zeros(n_rows, dtype=int)
+
+        positions = np.arange(0, n_rows, stride)
+        gap = stride
+        guess = X0_ordered[positions]
+        while len(positions) > 0 or gap > 1:
+            if len(positions) > 0:
+                position_k = k_ordered[positions] if per_row_k else k_ordered
+                X[positions], converged[positions], iterations[positions] = self._newton(guess,
+                                                                                         X0_ordered[positions],
+                                                                                         position_k)
+            if gap == 1:
+                break
+            gap //= 2
+            positions = np.arange(gap, n_rows, 2*gap)
+
+            # the rows gap positions to the left and right have been solved already
+            left = positions - gap
+            right = np.minimum(positions + gap, n_rows - 1)
+            left_distance = np.where(converged[left],
+                                     np.sum((features[positions] - features[left])**2, axis=1), np.inf)
+            right_distance = np.where(converged[right] & (positions + gap < n_rows),
+                                      np.sum((features[positions] - features[right])**2, axis=1), np.inf)
+            neighbour = np.where(left_distance <= right_distance, left, right)
+            guess = np.where(np.isfinite(np.minimum(left_distance, right_distance))[:, np.newaxis],
+                             X[neighbour], X0_ordered[positions])
+
+        result = np.empty(X.shape)
+        result[order] = X
+        result_converged = np.empty(n_rows, dtype=bool)
+        result_converged[order] = converged
+        result_iterations = np.empty(n_rows, dtype=int)
+        result_iterations[order] = iterations
+        return result, result_converged, result_iterations
+
+    def ensemble_equilibrium_solution(self, X0, k=None, chunk_size=None, initial_guess=None, warm_start=False):
+        """
+        Determines the equilibrium state for many sets of initial conditions at once.
+
+        Rows containing non-finite initial conditions are not solved and give NaN in the result.
+
+        :param X0: a (N x M) numPy array of initial conditions.  The columns are ordered according to the
+        species-to-index map (see Solver.get_species_mapping)
+
+        :param k: (optional) an array of rate constants.  Either a single 2J-length array used for all the rows, or
+        a (N x 2J) array giving the rate constants for each row.
+
+        :param chunk_size: (optional) the maximum number of rows integrated together for rows where the Newton
+        iteration does not converge.  Defaults to ODESolverWJacobian.ENSEMBLE_CHUNK_SIZE
+
+        :param initial_guess: (optional) a (N x M) numPy array used to start the Newton iteration.  Defaults to the
+        initial conditions.
+
+        :param warm_start: (optional) if True (and no initial_guess is given), most rows start the Newton iteration
+        from the equilibrium of a similar row, which saves iterations when many rows have similar initial
+        conditions.  See AlgebraicEquilibriumSolver._warm_started_newton
+
+        The ConvergenceReport also gives the Newton iterations taken by each row and the time spent on it.  Since
+        the rows are solved together, the time of the Newton iteration is shared among the rows by their
+        iterations, and the time of any integration (see below) equally among the rows integrated.
+
+        :return: a (N x M) numPy array giving the equilibrium concentrations for each row
+        """
+        X0 = self.check_initial_condition_matrix(X0)
+        if k is None:
+            k = self.kvals
+        k = np.asarray(k, dtype=float)
+        per_row_k = k.ndim == 2
+        guess = X0 if initial_guess is None else np.atleast_2d(np.asarray(initial_guess, dtype=float))
+
+        result = np.empty(X0.shape)
+        result.fill(np.nan)
+        valid_rows = np.where(np.all(np.isfinite(X0), axis=1))[0]
+
+        valid_k = k[valid_rows] if per_row_k else k
+        X = np.empty((len(valid_rows), X0.shape[1]))
+        converged = np.zeros(len(valid_rows), dtype=bool)
+        steps = np.zeros(len(valid_rows), dtype=int)
+        solve_time = np.zeros(len(valid_rows))
+
+        # binding networks are solved for the free concentrations of their components first
+        binding = self._binding_rows(valid_k, len(valid_rows))
+        if len(binding) > 0:
+            start = time.time()
+            X[binding], converged[binding], steps[binding] = self._binding_equilibrium(
+                X0[valid_rows[binding]], valid_k[binding] if per_row_k else valid_k,
+                None if initial_guess is None else guess[valid_rows[binding]])
+            solve_time[binding] = (time.time() - start)*steps[binding]/float(max(np.sum(steps[binding]), 1))
+
+        general = np.where(~converged)[0]
+        if len(general) > 0:
+            start = time.time()
+            general_rows = valid_rows[general]
+            general_k = valid_k[general] if per_row_k else valid_k
+            if warm_start and initial_guess is None:
+                X[general], converged[general], general_steps = self._warm_started_newton(X0[general_rows],
+                                                                                          general_k)
+            else:
+                X[general], converged[general], general_steps = self._newton(guess[general_rows], X0[general_rows],
+                                                                             general_k)
+            steps[general] += general_steps
+            solve_time[general] += (time.time() - start)*general_steps/float(max(np.sum(general_steps), 1))
+        result[valid_rows] = X
+        convergence_time = np.where(converged, np.inf, np.nan)
+
+        failed = np.where(~converged)[0]
+        if len(failed) > 0:
+            start = time.time()
+            failed_rows = valid_rows[failed]
+            failed_k = k[failed_rows] if per_row_k else k
+            X_integrated = super(AlgebraicEquilibriumSolver, self).ensemble_equilibrium_solution(X0[failed_rows],
+                                                                                               failed_k,
+                                                                                               chunk_size,
+                                                                                               until_steady=True)
+            convergence_time[failed] = self._convergence_report.convergence_time
+            X_polished, polished, polish_steps = self._newton(X_integrated, X0[failed_rows], failed_k)
+            result[failed_rows] = np.where(polished[:, np.newaxis], X_polished, X_integrated)
+            steps[failed] += polish_steps
+            solve_time[failed] += (time.time() - start)/len(failed)
+
+        residual = np.nan*np.ones(X0.shape[0])
+        residual[valid_rows] = self.relative_residual(result[valid_rows], valid_k)
+        full_convergence_time = np.nan*np.ones(X0.shape[0])
+        full_convergence_time[valid_rows] = convergence_time
+        full_converged = np.zeros(X0.shape[0], dtype=bool)
+        full_converged[valid_rows] = residual[valid_rows] < ODESolverWJacobian.STEADY_STATE_TOLERANCE
+        full_steps = np.zeros(X0.shape[0], dtype=int)
+        full_steps[valid_rows] = steps
+        full_solve_time = np.zeros(X0.shape[0])
+        full_solve_time[valid_rows] = solve_time
+        self._convergence_report = ConvergenceReport(full_converged, full_convergence_time, residual, full_steps,
+                                                     full_solve_time)
+        return result
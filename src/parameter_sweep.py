@@ -0,0 +1,170 @@
+__author__ = 'brian'
+
+import itertools
+import logging
+import re
+
+import numpy as np
+import pandas as pd
+
+from custom_exceptions import *
+
+logger = logging.getLogger(__name__)
+
+# the column names which give the rate constants of one row, e.g. kf_0 or kr_3 (see Solver.get_rate_constant_names)
+RATE_CONSTANT_COLUMN = re.compile(r'^k[fr]_\d+$')
+
+# the maximum number of (rate constants, initial conditions) combinations solved together
+SWEEP_CHUNK_SIZE = 20000
+
+
+def _rate_constant_index(solver, key):
+    """
+    Locates a rate constant in the array of rate constants
+
+    :param solver: a model_solvers.Solver instance
+
+    :param key: either a name such as kf_0 (see Solver.get_rate_constant_names) or an integer index into the array
+
+    :return: the integer index
+    """
+    names = solver.get_rate_constant_names()
+    if key in names:
+        return names.index(key)
+    if isinstance(key, (int, long, np.integer)) and 0 <= key < len(names):
+        return int(key)
+    raise InvalidRateConstantException('Unknown rate constant: %s.  Expected one of %s, or an index below %d.'
+                                       % (key, ', '.join(names), len(names)))
+
+
+def check_rate_constant_matrix(solver, rate_constants):
+    """
+    Ensures that rate constants have one column per entry of the solver's array of rate constants, and are finite
+    and non-negative
+
+    :param solver: a model_solvers.Solver instance
+
+    :param rate_constants: an array-like of rate constants, either a single 2J-length array or a (P x 2J) matrix,
+    ordered as in Solver._get_rate_constants
+
+    :return: the rate constants as a (P x 2J) numPy array of floats
+    """
+    rate_constants = np.atleast_2d(np.asarray(rate_constants, dtype=float))
+    if rate_constants.shape[1] != 2*solver.J:
+        raise InvalidRateConstantException('Expected %d rate constants per set (forward then reverse for each of '
+                                           'the %d reactions), but got %d.'
+                                           % (2*solver.J, solver.J, rate_constants.shape[1]))
+    if not np.all(np.isfinite(rate_constants)) or np.any(rate_constants < 0):
+        raise InvalidRateConstantException('Rate constants must be finite and cannot be < 0')
+    return rate_constants
+
+
+def rate_constant_grid(solver, grid):
+    """
+    Creates every combination of the given values of some rate constants.  The remaining rate constants keep the
+    values given in the model.
+
+    :param solver: a model_solvers.Solver instance
+
+    :param grid: a dictionary mapping rate constants (names such as kf_0, or indexes into the array of rate
+    constants) to a list of values
+
+    :return: a (P x 2J) numPy array with one set of rate constants per row, where P is the product of the number of
+    values given for each rate constant.  The combinations are ordered with the rate constant placed first in the
+    array of rate constants varying slowest.
+    """
+    indexes = [_rate_constant_index(solver, key) for key in grid.keys()]
+    values = [np.atleast_1d(np.asarray(v, dtype=float)) for v in grid.values()]
+
+    # sort the keys so the layout does not depend on the ordering of the dictionary
+    ordering = np.argsort(indexes)
+    indexes = [indexes[i] for i in ordering]
+    values = [values[i] for i in ordering]
+
+    combinations = np.array(list(itertools.product(*values)), dtype=float).reshape(-1, len(indexes))
+    rate_constants = np.tile(solver.kvals, (combinations.shape[0], 1))
+    rate_constants[:, indexes] = combinations
+    return check_rate_constant_matrix(solver, rate_constants)
+
+
+def rate_constants_from_dataframe(solver, df):
+    """
+    Builds the rate constants for each row of a dataframe which may have rate constant columns such as kf_0 or kr_3
+    (see Solver.get_rate_constant_names).  Rate constants without a column, and empty cells, take the values given
+    in the model.
+
+    :param solver: a model_solvers.Solver instance
+
+    :param df: a Pandas DataFrame
+
+    :return: a (N x 2J) numPy array, or None if the dataframe has no rate constant columns
+    """
+    rate_columns = [c for c in df.columns if RATE_CONSTANT_COLUMN.match(str(c))]
+    if len(rate_columns) == 0:
+        return None
+
+    rate_constants = np.tile(solver.kvals, (df.shape[0], 1))
+    for column in rate_columns:
+        values = pd.to_numeric(df[column], errors='coerce').values.astype(float)
+        given = np.isfinite(values)
+        rate_constants[given, _rate_constant_index(solver, column)] = values[given]
+    return check_rate_constant_matrix(solver, rate_constants)
+
+
+def sweep(solver, rate_constants, X0=None, chunk_size=None):
+    """
+    Finds the equilibrium for every combination of a set of rate constants and a set of initial conditions.
+
+    All the combinations are stacked and solved together as one ensemble (see
+    AlgebraicEquilibriumSolver.ensemble_equilibrium_solution), so the model is set up and compiled once and
+    combinations with similar parameters start from each other's equilibria.
+
+    :param solver: a model_solvers.AlgebraicEquilibriumSolver instance
+
+    :param rate_constants: a (P x 2J) array-like of rate constants, ordered as in Solver._get_rate_constants.  See
+    also rate_constant_grid
+
+    :param X0: (optional) a (N x M) array-like of initial conditions, with columns ordered according to the
+    species-to-index map.  Defaults to the initial conditions of the model.
+
+    :param chunk_size: (optional) the maximum number of combinations solved together.  Defaults to SWEEP_CHUNK_SIZE
+
+    :return: a tidy Pandas DataFrame with one row per combination, ordered by parameter set and then initial
+    condition.  The parameter_set and initial_condition columns give the row of each input, followed by a column
+    for each rate constant, the equilibrium concentration of each species and whether the row converged.
+    """
+    rate_constants = check_rate_constant_matrix(solver, rate_constants)
+    if X0 is None:
+        X0 = solver.initial_conditions
+    X0 = solver.check_initial_condition_matrix(X0)
+    if chunk_size is None:
+        chunk_size = SWEEP_CHUNK_SIZE
+
+    n_sets = rate_constants.shape[0]
+    n_states = X0.shape[0]
+    parameter_set = np.repeat(np.arange(n_sets), n_states)
+    initial_condition = np.tile(np.arange(n_states), n_sets)
+
+    n_rows = n_sets*n_states
+    equilibria = np.empty((n_rows, solver.M))
+    converged = np.zeros(n_rows, dtype=bool)
+    for start in range(0, n_rows, chunk_size):
+        rows = slice(start, start + chunk_size)
+        equilibria[rows] = solver.ensemble_equilibrium_solution(X0[initial_condition[rows]],
+                                                                rate_constants[parameter_set[rows]],
+                                                                warm_start=True)
+        converged[rows] = solver.get_convergence_report().converged
+    if not np.all(converged):
+        logger.warning('%d of %d combinations did not reach equilibrium.' % (np.sum(~converged), n_rows))
+
+    species = [''] * solver.M
+    for symbol, index in solver.get_species_mapping().items():
+        species[index] = symbol
+    table = pd.DataFrame({'parameter_set': parameter_set, 'initial_condition': initial_condition},
+                         columns=['parameter_set', 'initial_condition'])
+    table = pd.concat([table,
+                       pd.DataFrame(rate_constants[parameter_set], columns=solver.get_rate_constant_names()),
+                       pd.DataFrame(equilibria, columns=species)], axis=1)
+    table['converged'] = converged
+    return table
+
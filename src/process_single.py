@@ -1,20 +1,53 @@
+import lookup_tables
 import reaction_factories
 import model_solvers
 import models
+import result_cache
 
 import os
 import pandas as pd
 
 def process_single(ic, eqn_file):
 
-    factory = reaction_factories.FileReactionFactory(eqn_file)
-    model = models.Model(factory)
-    solver = model_solvers.ODESolverWJacobian(model)
+    # standard models are interpolated from their lookup table, if one has been built
+    solver = lookup_tables.create_solver(eqn_file)
+    solver.set_initial_conditions(ic)
 
-    sample_to_column_mapping, solution, t = solver.equilibrium_solution(X0=ic)
+    # repeated requests for the same model and initial conditions are answered from the cache
+    solution, report = result_cache.cached_ensemble_equilibrium_solution(solver, solver.initial_conditions)
+    sample_to_column_mapping = solver.get_species_mapping()
 
     final_vals = solution[-1,:]
     index = ['']*len(final_vals)
     for sample, col_idx in sample_to_column_mapping.items():
         index[col_idx] = sample
     return pd.Series(final_vals, index=index, name="final_concentrations")
+
+
+def process_single_sensitivities(ic, eqn_file):
+    """
+    Computes how the equilibrium concentrations respond to small changes in the rate constants and the initial
+    conditions (see AlgebraicEquilibriumSolver.equilibrium_sensitivities), e.g. how much free T moves per unit
+    change of SHBG.
+
+    :param ic: a dictionary mapping the symbols to the initial concentrations, as for process_single
+
+    :param eqn_file: a formatted model file
+
+    :return: a 2-tuple of Pandas DataFrames indexed by species.  The first has a column for each rate constant
+    (kf_q and kr_q for reaction q, numbered in the order of the model file) and the second a column for the initial
+    concentration of each species.
+    """
+    factory = reaction_factories.FileReactionFactory(eqn_file)
+    model = models.Model(factory)
+    solver = model_solvers.AlgebraicEquilibriumSolver(model)
+
+    sample_to_column_mapping, solution, t = solver.equilibrium_solution(X0=ic)
+    X, dX_dk, dX_dX0 = solver.equilibrium_sensitivities(solver.initial_conditions, X=solution[-1:])
+
+    index = ['']*solver.M
+    for sample, col_idx in sample_to_column_mapping.items():
+        index[col_idx] = sample
+    rate_sensitivities = pd.DataFrame(dX_dk[0], index=index, columns=solver.get_rate_constant_names())
+    initial_condition_sensitivities = pd.DataFrame(dX_dX0[0], index=index, columns=index)
+    return rate_sensitivities, initial_condition_sensitivities
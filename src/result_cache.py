@@ -0,0 +1,334 @@
+__author__ = 'brian'
+
+import collections
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+import model_solvers
+
+logger = logging.getLogger(__name__)
+
+# Initial conditions and rate constants are rounded to this many significant digits when forming the cache keys, so
+# values which differ only by floating-point noise share an entry
+QUANTIZATION_DIGITS = 10
+
+# the default capacities of the in-process and on-disk tiers, in entries
+MEMORY_CACHE_ENTRIES = 10000
+DISK_CACHE_ENTRIES = 1000000
+
+# the maximum number of keys looked up in one SQLite query, below SQLite's limit on query parameters
+DISK_QUERY_KEYS = 500
+
+# the on-disk tier is counted, and trimmed to its capacity, after each process writes this many entries to it, so it
+# may briefly hold up to this many more than its capacity for each process
+DISK_EVICTION_INTERVAL = 1000
+
+_default_cache = None
+
+
+def quantize(values, digits=QUANTIZATION_DIGITS):
+    """
+    Rounds values to a number of significant digits, giving an exact integer representation
+
+    :param values: a numPy array of floats
+
+    :param digits: (optional) the number of significant digits
+
+    :return: a numPy array of int64 with a trailing axis of length 2, holding the mantissa and the power of ten
+    """
+    values = np.asarray(values, dtype=float)
+    magnitude = np.abs(values)
+    finite = np.isfinite(magnitude)
+    nonzero = finite & (np.where(finite, magnitude, 0) > 0)
+    exponent = np.zeros(values.shape, dtype=np.int64)
+    exponent[nonzero] = np.floor(np.log10(magnitude[nonzero])).astype(np.int64) - (digits - 1)
+    mantissa = np.where(np.isfinite(values), np.round(values/np.power(10.0, exponent)), 0).astype(np.int64)
+    return np.stack([mantissa, exponent], axis=-1)
+
+
+class EquilibriumCache(object):
+    """
+    A two-tier cache of equilibrium states.
+
+    The first tier is a least-recently-used dictionary held in the process.  The second (optional) tier is a SQLite
+    file which can be shared by several processes, such as the workers of a web server.  States found only in the
+    second tier are copied into the first.  Each tier evicts its least recently used entries once it holds more
+    than its capacity, which the second tier checks every DISK_EVICTION_INTERVAL entries written.
+
+    Errors from the SQLite file are logged and otherwise ignored, so a broken second tier only costs hits.
+    """
+
+    def __init__(self, path=None, memory_entries=MEMORY_CACHE_ENTRIES, disk_entries=DISK_CACHE_ENTRIES):
+        """
+
+        :param path: (optional) the SQLite file of the second tier.  If None, only the in-process tier is used.
+
+        :param memory_entries: (optional) the capacity of the in-process tier
+
+        :param disk_entries: (optional) the capacity of the on-disk tier
+
+        :return: None
+        """
+        self.path = path
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self._memory = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._connection = None
+        self._connection_pid = None
+        self._written_since_eviction = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def keys(solver, X0, k):
+        """
+        Creates the cache keys for many rows at once.  A key combines the structure of the model (see
+        Solver.get_model_hash), the type of solver, its simulation time and, for solvers which integrate, the
+        integrator and tolerance preset chosen, with the quantized initial conditions and rate constants of the row.
+
+        :param solver: a model_solvers.Solver instance
+
+        :param X0: a (N x M) numPy array of initial conditions
+
+        :param k: an array of rate constants, either of length 2J or (N x 2J)
+
+        :return: a list of N strings
+        """
+        prefix = '%s|%s|%r|%s|%s|' % (solver.get_model_hash(), type(solver).__name__,
+                                      solver.model.get_simulation_time(), getattr(solver, 'integrator', None),
+                                      getattr(solver, 'tolerance', None))
+        rows = np.hstack([X0, np.broadcast_to(k, (X0.shape[0], np.shape(k)[-1]))])
+        quantized = quantize(rows).reshape(rows.shape[0], -1)
+        return [hashlib.sha1(prefix + row.tobytes()).hexdigest() for row in quantized]
+
+    def _get_connection(self):
+        """
+        Opens the SQLite file, once per process since connections cannot be shared after forking
+
+        :return: a sqlite3.Connection, or None if there is no on-disk tier
+        """
+        if self.path is None:
+            return None
+        if self._connection is None or self._connection_pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS equilibria '
+                               '(key TEXT PRIMARY KEY, state BLOB, accessed REAL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS equilibria_accessed ON equilibria (accessed)')
+            connection.commit()
+            self._connection = connection
+            self._connection_pid = os.getpid()
+        return self._connection
+
+    def _remember(self, key, state):
+        """
+        Adds a state to the in-process tier, evicting the least recently used entries beyond its capacity
+        """
+        self._memory.pop(key, None)
+        self._memory[key] = state
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get_many(self, keys):
+        """
+        Looks up many states at once
+
+        :param keys: a list of keys, see EquilibriumCache.keys
+
+        :return: a dictionary mapping the keys which were found to their states (numPy arrays)
+        """
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._memory:
+                    state = self._memory.pop(key)
+                    self._memory[key] = state
+                    found[key] = state
+            self.memory_hits += sum(1 for key in keys if key in found)
+
+            remaining = [key for key in set(keys) if key not in found]
+            if len(remaining) > 0 and self.path is not None:
+                try:
+                    connection = self._get_connection()
+                    disk_found = {}
+                    for start in range(0, len(remaining), DISK_QUERY_KEYS):
+                        batch = remaining[start:start + DISK_QUERY_KEYS]
+                        query = 'SELECT key, state FROM equilibria WHERE key IN (%s)' % ','.join('?'*len(batch))
+                        for key, state in connection.execute(query, batch):
+                            disk_found[str(key)] = np.frombuffer(bytes(state), dtype=float).copy()
+                    connection.executemany('UPDATE equilibria SET accessed = ? WHERE key = ?',
+                                           [(time.time(), key) for key in disk_found])
+                    connection.commit()
+                except sqlite3.Error as ex:
+                    logger.warning('Could not read the equilibrium cache %s: %s' % (self.path, ex))
+                    disk_found = {}
+                for key, state in disk_found.items():
+                    self._remember(key, state)
+                found.update(disk_found)
+                self.disk_hits += sum(1 for key in keys if key in disk_found)
+            self.misses += sum(1 for key in keys if key not in found)
+        return found
+
+    def put_many(self, items):
+        """
+        Stores many states at once
+
+        :param items: a list of (key, state) pairs, where each state is a numPy array
+
+        :return: None
+        """
+        if len(items) == 0:
+            return
+        with self._lock:
+            for key, state in items:
+                self._remember(key, np.array(state, dtype=float))
+            if self.path is None:
+                return
+            try:
+                connection = self._get_connection()
+                now = time.time()
+                connection.executemany('INSERT OR REPLACE INTO equilibria (key, state, accessed) VALUES (?, ?, ?)',
+                                       [(key, sqlite3.Binary(np.asarray(state, dtype=float).tobytes()), now)
+                                        for key, state in items])
+                self._written_since_eviction += len(items)
+                if self._written_since_eviction >= DISK_EVICTION_INTERVAL:
+                    self._written_since_eviction = 0
+                    excess = connection.execute('SELECT COUNT(*) FROM equilibria').fetchone()[0] - self.disk_entries
+                    if excess > 0:
+                        connection.execute('DELETE FROM equilibria WHERE key IN '
+                                           '(SELECT key FROM equilibria ORDER BY accessed, rowid LIMIT ?)', (excess,))
+                connection.commit()
+            except sqlite3.Error as ex:
+                logger.warning('Could not write to the equilibrium cache %s: %s' % (self.path, ex))
+
+    def stats(self):
+        """
+        :return: a dictionary with the hit and miss counters of this process, the fraction of lookups which hit,
+        and the number of entries in the in-process tier
+        """
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': (self.memory_hits + self.disk_hits)/float(lookups) if lookups > 0 else 0.0,
+                'memory_entries': len(self._memory)}
+
+    def clear(self):
+        """
+        Removes all the entries from both tiers and resets the counters
+
+        :return: None
+        """
+        with self._lock:
+            self._memory.clear()
+            self.memory_hits = self.disk_hits = self.misses = 0
+            if self.path is not None:
+                try:
+                    connection = self._get_connection()
+                    connection.execute('DELETE FROM equilibria')
+                    connection.commit()
+                except sqlite3.Error as ex:
+                    logger.warning('Could not clear the equilibrium cache %s: %s' % (self.path, ex))
+
+
+def get_default_cache():
+    """
+    :return: the EquilibriumCache used when none is given.  Unless configured (see configure_default_cache), it only
+    has the in-process tier.
+    """
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = EquilibriumCache()
+    return _default_cache
+
+
+def configure_default_cache(path=None, memory_entries=MEMORY_CACHE_ENTRIES, disk_entries=DISK_CACHE_ENTRIES):
+    """
+    Sets up the default cache.  Calling this again with the same file keeps the existing cache.
+
+    :param path: (optional) the SQLite file of the on-disk tier, see EquilibriumCache
+
+    :return: the default EquilibriumCache
+    """
+    global _default_cache
+    if _default_cache is None or _default_cache.path != path:
+        _default_cache = EquilibriumCache(path, memory_entries, disk_entries)
+    _default_cache.memory_entries = memory_entries
+    _default_cache.disk_entries = disk_entries
+    return _default_cache
+
+
+def cached_ensemble_equilibrium_solution(solver, X0, k=None, cache=None, solve=None, **options):
+    """
+    Determines the equilibrium state for many sets of initial conditions, reusing any stored in the cache.  Only the
+    rows which are not found are solved, and those which reach equilibrium are added to the cache.
+
+    :param solver: a model_solvers.ODESolverWJacobian (or derived) instance
+
+    :param X0: a (N x M) numPy array of initial conditions.  The columns are ordered according to the
+    species-to-index map (see Solver.get_species_mapping)
+
+    :param k: (optional) an array of rate constants.  Either a single 2J-length array used for all the rows, or
+    a (N x 2J) array giving the rate constants for each row.
+
+    :param cache: (optional) an EquilibriumCache.  Defaults to get_default_cache()
+
+    :param solve: (optional) a callable which takes the initial conditions and rate constants of the rows which were
+    not found, and returns their equilibrium concentrations and a model_solvers.ConvergenceReport.  Defaults to the
+    solver's ensemble_equilibrium_solution.
+
+    :param options: further keyword arguments for ensemble_equilibrium_solution, if solve is not given
+
+    :return: a 2-tuple of the (N x M) numPy array giving the equilibrium concentrations for each row, and a
+    model_solvers.ConvergenceReport covering all the rows (rows found in the cache have converged, taking no steps
+    or time)
+    """
+    if cache is None:
+        cache = get_default_cache()
+    X0 = solver.check_initial_condition_matrix(X0)
+    if k is None:
+        k = solver.kvals
+    k = np.asarray(k, dtype=float)
+    per_row_k = k.ndim == 2
+    n_rows = X0.shape[0]
+
+    result = np.nan*np.ones(X0.shape)
+    report = model_solvers.ConvergenceReport(np.zeros(n_rows, dtype=bool), np.nan*np.ones(n_rows),
+                                             np.nan*np.ones(n_rows), np.zeros(n_rows, dtype=int), np.zeros(n_rows))
+    valid_rows = np.where(np.all(np.isfinite(X0), axis=1))[0]
+    keys = cache.keys(solver, X0[valid_rows], k[valid_rows] if per_row_k else k)
+    found = cache.get_many(keys)
+
+    hits = np.array([key in found for key in keys], dtype=bool)
+    if np.any(hits):
+        rows = valid_rows[hits]
+        result[rows] = np.array([found[key] for key, hit in zip(keys, hits) if hit])
+        report.converged[rows] = True
+        report.convergence_time[rows] = np.inf
+        report.residual[rows] = solver.relative_residual(result[rows], k[rows] if per_row_k else k)
+
+    if not np.all(hits):
+        rows = valid_rows[~hits]
+        if solve is None:
+            result[rows] = solver.ensemble_equilibrium_solution(X0[rows], k[rows] if per_row_k else k, **options)
+            solved_report = solver.get_convergence_report()
+        else:
+            result[rows], solved_report = solve(X0[rows], k[rows] if per_row_k else k)
+        report.converged[rows] = solved_report.converged
+        report.convergence_time[rows] = solved_report.convergence_time
+        report.residual[rows] = solved_report.residual
+        if solved_report.steps is not None:
+            report.steps[rows] = solved_report.steps
+            report.solve_time[rows] = solved_report.solve_time
+        missed_keys = [key for key, hit in zip(keys, hits) if not hit]
+        cache.put_many([(key, result[row]) for key, row, converged in zip(missed_keys, rows, solved_report.converged)
+                        if converged])
+    return result, report
@@ -0,0 +1,464 @@
+__author__ = 'brian'
+
+import os
+
+import numpy as np
+import pandas as pd
+
+# pyarrow provides the Parquet and Arrow formats, and PyTables the HDF5 format.  Neither is needed for CSV.
+try:
+    import pyarrow
+    from pyarrow import parquet
+except ImportError:
+    pyarrow = None
+
+try:
+    import tables
+except ImportError:
+    tables = None
+
+from custom_exceptions import *
+
+# the keys of the results and the trajectories within HDF5 files
+HDF_RESULTS_KEY = 'results'
+HDF_TRAJECTORIES_KEY = 'trajectories'
+
+# text columns of HDF5 tables reserve at least this many characters, since later chunks may hold longer values
+HDF_MIN_STRING_LENGTH = 64
+
+# trajectories are appended to HDF5 files this many rows at a time, so trajectories held in a
+# trajectory_store.TrajectoryStore are only read a few rows at a time
+HDF_TRAJECTORY_ROWS = 100
+
+
+def _unique_columns(columns):
+    """
+    Renames repeated column names as pandas.read_csv does, so the second T becomes T.1.  Batch results repeat the
+    species given as inputs, which columnar formats do not allow.
+
+    :param columns: a list of column names
+
+    :return: a list of unique strings
+    """
+    counts = {}
+    unique = []
+    for column in columns:
+        column = str(column)
+        if column in counts:
+            counts[column] += 1
+            unique.append('%s.%d' % (column, counts[column]))
+        else:
+            counts[column] = 0
+            unique.append(column)
+    return unique
+
+
+class ResultWriter(object):
+    """
+    A base class for the writers which store a table of results, one chunk of rows at a time (see
+    batch_process.process_batch_file).
+
+    Derived classes set a name, under which they are registered (see register_writer), the file extensions they are
+    chosen for and the package they need, if any.  They implement _write_chunk, close and read.  Writers of the
+    columnar formats store the numeric columns as float64 and give repeated column names a suffix (see
+    _unique_columns).
+    """
+
+    name = None
+    extensions = ()
+    requires = None
+
+    # whether the numeric columns are stored as float64 with unique column names
+    columnar = True
+
+    # whether write_trajectories is supported
+    stores_trajectories = False
+
+    def __init__(self, path):
+        """
+
+        :param path: the path of the output file, which is overwritten
+
+        :return: None
+        """
+        self.path = path
+        self._columns = None
+
+    @staticmethod
+    def is_available():
+        """
+        :return: True if the packages needed for the format are installed
+        """
+        return True
+
+    def _prepare(self, df):
+        """
+        Applies the typing of the format to a chunk, and ensures each chunk has the columns of the first
+
+        :param df: a Pandas DataFrame
+
+        :return: a Pandas DataFrame
+        """
+        if not self.columnar:
+            return df
+        columns = _unique_columns(df.columns)
+        if self._columns is None:
+            self._columns = columns
+        elif columns != self._columns:
+            raise OutputFormatException('Each chunk of results must have the same columns')
+        df = df.copy()
+        df.columns = columns
+        for column in columns:
+            if np.issubdtype(df[column].dtype, np.number):
+                df[column] = df[column].astype(np.float64)
+        return df
+
+    def write(self, df):
+        """
+        Appends a chunk of rows to the file
+
+        :param df: a Pandas DataFrame
+
+        :return: None
+        """
+        self._write_chunk(self._prepare(df))
+
+    def write_trajectories(self, rows, t, X, species):
+        """
+        Appends the trajectories of a chunk of rows to the file
+
+        :param rows: a N-length numPy array giving the row of the results for each trajectory
+
+        :param t: a numPy array of the times
+
+        :param X: a (len(t) x N x M) numPy array of the states, or a memory-mapped view of them, see
+        ODESolverWJacobian.ensemble_trajectories
+
+        :param species: a list of the M species, ordered according to the species-to-index map
+
+        :return: None
+        """
+        raise OutputFormatException('The %s format cannot store trajectories' % self.name)
+
+    def _write_chunk(self, df):
+        raise NotImplementedError
+
+    def close(self):
+        """
+        Completes the file
+
+        :return: None
+        """
+        raise NotImplementedError
+
+    @classmethod
+    def read(cls, path, nrows=None):
+        """
+        Reads a file of results
+
+        :param path: the path of the file
+
+        :param nrows: (optional) the number of rows read from the start of the file.  Defaults to all of them
+
+        :return: a Pandas DataFrame
+        """
+        raise NotImplementedError
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class CSVWriter(ResultWriter):
+    """
+    Writes delimited text, as batches always have.  The columns are kept as given.
+    """
+
+    name = 'csv'
+    extensions = ('.csv', '.txt', '.tsv')
+    columnar = False
+
+    def __init__(self, path, sep=','):
+        """
+
+        :param path: the path of the output file, which is overwritten
+
+        :param sep: (optional) the delimiter
+
+        :return: None
+        """
+        super(CSVWriter, self).__init__(path)
+        self.sep = sep
+        self._file = open(path, 'w')
+        self._header = True
+
+    def _write_chunk(self, df):
+        df.to_csv(self._file, sep=self.sep, index=False, header=self._header)
+        self._header = False
+
+    def close(self):
+        self._file.close()
+
+    @classmethod
+    def read(cls, path, nrows=None, sep=','):
+        # the default parser of pandas is fast but may be off in the last digit
+        return pd.read_csv(path, sep=sep, nrows=nrows, float_precision='round_trip')
+
+
+class ParquetWriter(ResultWriter):
+    """
+    Writes an Apache Parquet file, with one row group per chunk
+    """
+
+    name = 'parquet'
+    extensions = ('.parquet', '.pq')
+    requires = 'pyarrow'
+
+    def __init__(self, path):
+        super(ParquetWriter, self).__init__(path)
+        self._writer = None
+        self._schema = None
+
+    @staticmethod
+    def is_available():
+        return pyarrow is not None
+
+    def _write_chunk(self, df):
+        if self._writer is None:
+            table = pyarrow.Table.from_pandas(df, preserve_index=False)
+            self._schema = table.schema
+            self._writer = parquet.ParquetWriter(self.path, self._schema)
+        else:
+            table = pyarrow.Table.from_pandas(df, schema=self._schema, preserve_index=False)
+        self._writer.write_table(table)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+    @classmethod
+    def read(cls, path, nrows=None):
+        source = parquet.ParquetFile(path)
+        if nrows is None or source.num_row_groups == 0:
+            return source.read().to_pandas()
+        groups = []
+        n_read = 0
+        for group in range(source.num_row_groups):
+            groups.append(source.read_row_group(group).to_pandas())
+            n_read += groups[-1].shape[0]
+            if n_read >= nrows:
+                break
+        return pd.concat(groups, ignore_index=True).iloc[:nrows]
+
+
+class ArrowWriter(ResultWriter):
+    """
+    Writes an Apache Arrow IPC file, with one record batch per chunk.  The file can be memory mapped by the reader,
+    so columns are loaded without parsing.
+    """
+
+    name = 'arrow'
+    extensions = ('.arrow', '.ipc')
+    requires = 'pyarrow'
+
+    def __init__(self, path):
+        super(ArrowWriter, self).__init__(path)
+        self._sink = None
+        self._writer = None
+        self._schema = None
+
+    @staticmethod
+    def is_available():
+        return pyarrow is not None
+
+    def _write_chunk(self, df):
+        if self._writer is None:
+            table = pyarrow.Table.from_pandas(df, preserve_index=False)
+            self._schema = table.schema
+            self._sink = pyarrow.OSFile(self.path, 'wb')
+            self._writer = pyarrow.RecordBatchFileWriter(self._sink, self._schema)
+        else:
+            table = pyarrow.Table.from_pandas(df, schema=self._schema, preserve_index=False)
+        self._writer.write_table(table)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._sink.close()
+
+    @classmethod
+    def read(cls, path, nrows=None):
+        reader = pyarrow.RecordBatchFileReader(pyarrow.memory_map(path, 'r'))
+        if nrows is None:
+            return reader.read_all().to_pandas()
+        batches = []
+        n_read = 0
+        for batch in range(reader.num_record_batches):
+            batches.append(reader.get_batch(batch))
+            n_read += batches[-1].num_rows
+            if n_read >= nrows:
+                break
+        return pyarrow.Table.from_batches(batches, schema=reader.schema).to_pandas().iloc[:nrows]
+
+
+class HDF5Writer(ResultWriter):
+    """
+    Writes an HDF5 file through pandas.HDFStore.  The results are stored as a table under HDF_RESULTS_KEY.
+    Trajectories may be stored too, as a table under HDF_TRAJECTORIES_KEY with a row for each time of each row of
+    the results: the row, the time and the concentration of each species.
+    """
+
+    name = 'hdf5'
+    extensions = ('.h5', '.hdf5', '.hdf')
+    requires = 'PyTables'
+    stores_trajectories = True
+
+    def __init__(self, path):
+        super(HDF5Writer, self).__init__(path)
+        self._store = pd.HDFStore(path, mode='w')
+
+    @staticmethod
+    def is_available():
+        return tables is not None
+
+    def _write_chunk(self, df):
+        text_columns = [column for column in df.columns if df[column].dtype == object]
+        self._store.append(HDF_RESULTS_KEY, df, format='table', index=False,
+                           min_itemsize=dict((column, HDF_MIN_STRING_LENGTH) for column in text_columns))
+
+    def write_trajectories(self, rows, t, X, species):
+        n_times, n_rows, n_species = X.shape
+        rows = np.asarray(rows, dtype=np.int64)
+        for start in range(0, n_rows, HDF_TRAJECTORY_ROWS):
+            block = np.asarray(X[:, start:start + HDF_TRAJECTORY_ROWS])
+            block_rows = block.shape[1]
+            trajectories = pd.DataFrame(block.transpose(1, 0, 2).reshape(block_rows*n_times, n_species),
+                                        columns=_unique_columns(species))
+            trajectories.insert(0, 'time', np.tile(t, block_rows))
+            trajectories.insert(0, 'row', np.repeat(rows[start:start + block_rows], n_times))
+            self._store.append(HDF_TRAJECTORIES_KEY, trajectories, format='table', index=False)
+
+    def close(self):
+        self._store.close()
+
+    @classmethod
+    def read(cls, path, nrows=None):
+        return pd.read_hdf(path, HDF_RESULTS_KEY, stop=nrows)
+
+
+# the available writers, keyed by format name
+_writers = {}
+
+
+def register_writer(writer_class):
+    """
+    Makes an output format available by its name, replacing any writer registered under the same name
+
+    :param writer_class: a class derived from ResultWriter
+
+    :return: None
+    """
+    _writers[writer_class.name] = writer_class
+
+
+def available_formats():
+    """
+    :return: a sorted list of the names of the registered output formats, including those whose packages are not
+    installed
+    """
+    return sorted(_writers.keys())
+
+
+def installed_formats():
+    """
+    :return: a sorted list of the names of the registered output formats whose packages are installed
+    """
+    return [name for name in available_formats() if _writers[name].is_available()]
+
+
+def format_from_path(path):
+    """
+    Chooses an output format from the extension of a file
+
+    :param path: the path of a file
+
+    :return: the name of the format, or 'csv' if the extension is not recognized
+    """
+    extension = os.path.splitext(path)[1].lower()
+    for name in available_formats():
+        if extension in _writers[name].extensions:
+            return name
+    return CSVWriter.name
+
+
+def _get_writer_class(output_format):
+    """
+    :param output_format: the name of a registered output format
+
+    :return: the writer class
+    """
+    if output_format not in _writers:
+        raise UnknownOutputFormatException('Unknown output format: %s.  Expected one of: %s'
+                                           % (output_format, ', '.join(available_formats())))
+    writer_class = _writers[output_format]
+    if not writer_class.is_available():
+        raise OutputFormatException('The %s format needs %s, which is not installed.'
+                                    % (output_format, writer_class.requires))
+    return writer_class
+
+
+def get_writer(path, output_format=None, **options):
+    """
+    Opens a writer for a file of results
+
+    :param path: the path of the output file, which is overwritten
+
+    :param output_format: (optional) the name of a registered output format.  Defaults to the format given by the
+    extension of the path (see format_from_path)
+
+    :param options: further keyword arguments for the writer, such as sep for CSV
+
+    :return: a ResultWriter, which should be closed (or used as a context manager)
+    """
+    if output_format is None:
+        output_format = format_from_path(path)
+    return _get_writer_class(output_format)(path, **options)
+
+
+def write_results(df, path, output_format=None, **options):
+    """
+    Writes a whole table of results, such as that returned by batch_process.process_batch
+
+    :param df: a Pandas DataFrame
+
+    :param path: the path of the output file, which is overwritten
+
+    :param output_format: (optional) the name of a registered output format, see get_writer
+
+    :return: None
+    """
+    with get_writer(path, output_format, **options) as writer:
+        writer.write(df)
+
+
+def read_results(path, output_format=None, nrows=None):
+    """
+    Reads a file of results written by one of the writers
+
+    :param path: the path of the file
+
+    :param output_format: (optional) the name of a registered output format, see get_writer
+
+    :param nrows: (optional) the number of rows read from the start of the file.  Defaults to all of them
+
+    :return: a Pandas DataFrame
+    """
+    if output_format is None:
+        output_format = format_from_path(path)
+    return _get_writer_class(output_format).read(path, nrows=nrows)
+
+
+for _writer_class in [CSVWriter, ParquetWriter, ArrowWriter, HDF5Writer]:
+    register_writer(_writer_class)
@@ -0,0 +1,134 @@
+__author__ = 'brian'
+
+# Holds trajectories in memory-mapped .npy files rather than in memory, for simulations whose trajectories do not
+# fit in RAM.  The solvers integrate into a store one block of times at a time (see integrate_in_blocks), so the memory
+# used does not depend on the length of the simulation, and return a view of the file which is sliced like the arrays
+# they return otherwise.
+
+import os
+
+import numpy as np
+
+# the number of times integrated and written together
+BLOCK_POINTS = 5000
+
+# the times of a store are kept next to its states, in a file named by replacing the .npy extension with this suffix
+TIMES_SUFFIX = '_times.npy'
+
+
+def times_path(path):
+    """
+    :param path: the path of the states of a store
+
+    :return: the path of the times of the store
+    """
+    return os.path.splitext(path)[0] + TIMES_SUFFIX
+
+
+class TrajectoryStore(object):
+    """
+    A trajectory held in a memory-mapped .npy file.  The states are stored species-major, so the evolution of one
+    species (of one row, for an ensemble) is contiguous in the file.  They are presented through the states attribute,
+    a view of the file indexed like the arrays returned by the solvers: (len(t) x M) for a single trajectory, or
+    (len(t) x N x M) for an ensemble.  Slicing the view reads only the parts of the file needed, so
+    store.states[:, column] reads the evolution of one species.
+    """
+
+    def __init__(self, path, t, data):
+        """
+        Use TrajectoryStore.create or TrajectoryStore.open rather than this
+
+        :param path: the path of the states
+
+        :param t: a numPy array of the times
+
+        :param data: the memory-mapped states, with shape (M x len(t)) or (M x N x len(t))
+        """
+        self.path = path
+        self.t = t
+        self._data = data
+        self.states = data.T
+
+    @classmethod
+    def create(cls, path, t, state_shape):
+        """
+        Creates a store, overwriting any at the same path.  The states start at zero.
+
+        :param path: the path of the .npy file holding the states
+
+        :param t: a numPy array of the times at which the states are stored
+
+        :param state_shape: the shape of the state at one time: (M,) for a single trajectory or (N, M) for an ensemble
+
+        :return: a TrajectoryStore instance
+        """
+        t = np.asarray(t, dtype=float)
+        np.save(times_path(path), t)
+        data = np.lib.format.open_memmap(path, mode='w+', dtype=float,
+                                         shape=tuple(reversed(tuple(state_shape))) + (len(t),))
+        return cls(path, t, data)
+
+    @classmethod
+    def open(cls, path, mode='r'):
+        """
+        Opens an existing store
+
+        :param path: the path of the .npy file holding the states
+
+        :param mode: (optional) the mode of the memory map, 'r' for reading only or 'r+' for reading and writing
+
+        :return: a TrajectoryStore instance
+        """
+        return cls(path, np.load(times_path(path)), np.load(path, mmap_mode=mode))
+
+    def write(self, start, states):
+        """
+        Writes a block of consecutive states
+
+        :param start: the index of the time of the first state
+
+        :param states: a numPy array of the states at the times t[start:start+len(states)]
+
+        :return: None
+        """
+        self.states[start:start + len(states)] = states
+
+    def flush(self):
+        """
+        Writes any changes to the file
+
+        :return: None
+        """
+        self._data.flush()
+
+
+def integrate_in_blocks(advance, X_start, t, block_points=None):
+    """
+    Integrates from a state, or a stack of states, over a long array of times a block at a time
+
+    :param advance: a callable which takes a state (or stack of states) and a numPy array of times, where the first time
+    is that of the given state, and returns a numPy array of the states at those times
+
+    :param X_start: the state at t[0], either a M-length numPy array or a (N x M) numPy array
+
+    :param t: a numPy array of times, in increasing order
+
+    :param block_points: (optional) the number of times in each block.  Defaults to BLOCK_POINTS
+
+    :return: a generator of 2-tuples of the index of the first time of a block and the states at the times of the
+    block, in order
+    """
+    if block_points is None:
+        block_points = BLOCK_POINTS
+    block_points = max(block_points, 2)
+    start = 0
+    while start < len(t):
+        stop = min(start + block_points, len(t))
+        if start == 0:
+            states = advance(X_start, t[:stop]) if stop > 1 else X_start[np.newaxis]
+        else:
+            # each block starts from the last state of the one before
+            states = advance(X_start, t[start - 1:stop])[1:]
+        yield start, states
+        X_start = states[-1]
+        start = stop
@@ -0,0 +1,152 @@
+__author__ = 'brian'
+
+import sys
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import numpy.testing as npt
+import pandas as pd
+
+sys.path.append( os.path.dirname( os.path.dirname( os.path.abspath(__file__) ) ) )
+
+from src import batch_monitor, batch_process, result_cache
+
+this_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+class TestBatchProcess(unittest.TestCase):
+
+    def setUp(self):
+        self.eqn_file = os.path.join(os.path.dirname(this_dir), 'models', 'Testosterone.model')
+        self.parallel_min_rows = batch_process.PARALLEL_MIN_ROWS
+        self.progress_rows = batch_process.PROGRESS_ROWS
+        self.directory = tempfile.mkdtemp()
+        result_cache.get_default_cache().clear()
+
+    def tearDown(self):
+        batch_process.PARALLEL_MIN_ROWS = self.parallel_min_rows
+        batch_process.PROGRESS_ROWS = self.progress_rows
+        shutil.rmtree(self.directory)
+        result_cache.get_default_cache().clear()
+
+    def test_parallel_matches_serial(self):
+        rng = np.random.RandomState(4)
+        n = 60
+        df = pd.DataFrame({'T': 10**rng.uniform(0, 2, n), 'SHBG': 10**rng.uniform(0, 2, n),
+                           'Alb': 661538.46*rng.uniform(0.5, 1.5, n), 'kf_2': 10**rng.uniform(-1, 1, n)},
+                          columns=['T', 'SHBG', 'Alb', 'kf_2'])
+        serial = batch_process.process_batch(df, self.eqn_file, workers=1)
+
+        # force the pool even for a small batch, and with the cache cleared so every row is solved again
+        result_cache.get_default_cache().clear()
+        batch_process.PARALLEL_MIN_ROWS = 1
+        calls = []
+        parallel = batch_process.process_batch(df, self.eqn_file, workers=2, progress=lambda *args: calls.append(args))
+        # progress is reported as each shard finishes
+        self.assertGreater(len(calls), 2)
+        self.assertEqual(calls[-1][:2], (n, n))
+
+        self.assertEqual(parallel.columns.tolist(), serial.columns.tolist())
+        npt.assert_allclose(parallel.iloc[:, df.shape[1]:].values.astype(float),
+                            serial.iloc[:, df.shape[1]:].values.astype(float), rtol=1e-8)
+
+    def test_summary_and_progress(self):
+        rng = np.random.RandomState(5)
+        n = 40
+        df = pd.DataFrame({'T': 10**rng.uniform(0, 2, n), 'SHBG': 10**rng.uniform(0, 2, n),
+                           'Alb': [661538.46]*n}, columns=['T', 'SHBG', 'Alb'])
+        df.loc[3, 'T'] = np.nan
+        calls = []
+        result, summary = batch_process.process_batch(df, self.eqn_file, workers=1, summary=True,
+                                                      progress=lambda *args: calls.append(args))
+        self.assertEqual(result.shape[0], n)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(calls[0][:2], (n, n))
+
+        # larger sets of rows report their progress as they are solved
+        result_cache.get_default_cache().clear()
+        batch_process.PROGRESS_ROWS = 10
+        calls = []
+        batch_process.process_batch(df, self.eqn_file, workers=1, progress=lambda *args: calls.append(args))
+        self.assertGreater(len(calls), 3)
+        self.assertTrue(np.all(np.diff([call[0] for call in calls]) >= 0))
+        self.assertEqual(calls[-1][:2], (n, n))
+
+        self.assertEqual(summary.rows, n)
+        self.assertEqual(summary.converged, n - 1)
+        self.assertEqual(summary.cached, 0)
+        self.assertGreaterEqual(summary.steps, n - 1)
+        self.assertGreater(summary.rows_per_second, 0)
+        self.assertEqual(summary.slowest.shape[0], batch_monitor.SLOWEST_ROWS)
+        self.assertTrue(np.all(np.diff(summary.slowest['solve_time'].values) <= 0))
+        self.assertNotIn(3, summary.slowest['row'].tolist())
+        self.assertIn('Slowest rows', str(summary))
+
+        # the same rows again are all found in the cache
+        _, summary = batch_process.process_batch(df, self.eqn_file, workers=1, summary=True)
+        self.assertEqual(summary.cached, n - 1)
+        self.assertEqual(summary.steps, 0)
+
+    def test_repeated_rows_solved_once(self):
+        rng = np.random.RandomState(6)
+        n = 8
+        distinct = pd.DataFrame({'T': 10**rng.uniform(0, 2, n), 'SHBG': 10**rng.uniform(0, 2, n),
+                                 'Alb': [661538.46]*n}, columns=['T', 'SHBG', 'Alb'])
+        df = distinct.iloc[rng.randint(0, n, 30)].reset_index(drop=True)
+        # rows differing only by floating-point noise are the same row
+        df.loc[0, 'T'] *= 1 + 1e-14
+        df.loc[[1, 2], 'T'] = np.nan
+        n_distinct = len(set(map(tuple, df.fillna(-1).round(8).values)))
+
+        result, summary = batch_process.process_batch(df, self.eqn_file, workers=1, summary=True)
+        self.assertEqual(summary.rows, df.shape[0])
+        self.assertEqual(summary.unique_rows, n_distinct)
+        self.assertAlmostEqual(summary.dedup_ratio, df.shape[0]/float(n_distinct))
+        self.assertEqual(summary.converged, df.shape[0] - 2)
+        self.assertEqual(summary.slowest['count'].sum(), df.shape[0])
+        self.assertIn('distinct rows', str(summary))
+        self.assertTrue(np.all(np.isnan(result.iloc[[1, 2], df.shape[1]:].values.astype(float))))
+
+        # the same as solving each row
+        result_cache.get_default_cache().clear()
+        for row in [0, 5, 17, 29]:
+            expected = batch_process.process_batch(df.iloc[[row]], self.eqn_file, workers=1)
+            npt.assert_allclose(result.iloc[row, df.shape[1]:].values.astype(float),
+                                expected.iloc[0, df.shape[1]:].values.astype(float), rtol=1e-6)
+
+    def test_streamed_file_matches_dataframe(self):
+        rng = np.random.RandomState(7)
+        n = 25
+        df = pd.DataFrame({'sample': ['s%d' % i for i in range(n)], 'T': 10**rng.uniform(0, 2, n),
+                           'notes': ['x']*n, 'SHBG': 10**rng.uniform(0, 2, n), 'Alb': [661538.46]*n,
+                           'kf_2': 10**rng.uniform(-1, 1, n)},
+                          columns=['sample', 'T', 'notes', 'SHBG', 'Alb', 'kf_2'])
+        input_path = os.path.join(self.directory, 'input.txt')
+        output_path = os.path.join(self.directory, 'output.csv')
+        df.to_csv(input_path, sep='\t', index=False)
+        expected = batch_process.process_batch(df, self.eqn_file)
+
+        # the chunks do not divide the rows evenly
+        summary = batch_process.process_batch_file(input_path, output_path, self.eqn_file, chunk_size=7)
+        self.assertEqual(summary.rows, n)
+        result = pd.read_csv(output_path)
+        self.assertEqual(result.shape, expected.shape)
+        self.assertEqual(result['sample'].tolist(), df['sample'].tolist())
+        npt.assert_allclose(result.iloc[:, df.shape[1]:].values, expected.iloc[:, df.shape[1]:].values.astype(float))
+
+        # only the columns needed, and those asked for, are read
+        batch_process.process_batch_file(input_path, output_path, self.eqn_file, passthrough=['sample'], chunk_size=7)
+        result = pd.read_csv(output_path)
+        self.assertEqual(result.columns.tolist()[:4], ['sample', 'T', 'SHBG', 'Alb'])
+        self.assertNotIn('notes', result.columns)
+        npt.assert_allclose(result.iloc[:, 5:].values, expected.iloc[:, df.shape[1]:].values.astype(float))
+
+        with self.assertRaises(batch_process.BatchCalculationException):
+            batch_process.process_batch_file(input_path, output_path, self.eqn_file, passthrough=['label'])
+
+
+if __name__ == '__main__':
+    unittest.main()
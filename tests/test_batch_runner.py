@@ -0,0 +1,92 @@
+__author__ = 'brian'
+
+import sys
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+
+sys.path.append( os.path.dirname( os.path.dirname( os.path.abspath(__file__) ) ) )
+
+from src import batch_process, batch_runner, result_cache
+
+this_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+class Interrupted(Exception):
+    pass
+
+
+class TestBatchRunner(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.eqn_file = os.path.join(os.path.dirname(this_dir), 'models', 'Testosterone.model')
+        rng = np.random.RandomState(11)
+        n = 10
+        df = pd.DataFrame({'sample': ['s%d' % i for i in range(n)], 'T': 10**rng.uniform(0, 2, n),
+                           'SHBG': 10**rng.uniform(0, 2, n), 'Alb': [661538.46]*n},
+                          columns=['sample', 'T', 'SHBG', 'Alb'])
+        self.input_path = os.path.join(self.directory, 'input.txt')
+        df.to_csv(self.input_path, sep='\t', index=False)
+        self.solve_dataframe = batch_process.solve_dataframe
+        result_cache.get_default_cache().clear()
+
+    def tearDown(self):
+        batch_process.solve_dataframe = self.solve_dataframe
+        shutil.rmtree(self.directory)
+
+    def test_resume_after_interruption(self):
+        expected_path = os.path.join(self.directory, 'expected.csv')
+        batch_process.process_batch_file(self.input_path, expected_path, self.eqn_file, chunk_size=4)
+        output_path = os.path.join(self.directory, 'output.csv')
+
+        # the run stops while solving the third chunk
+        solved = []
+        def solve_dataframe(solver, eqn_file, df, n_workers, monitor=None):
+            if len(solved) == 2:
+                raise Interrupted()
+            solved.append(df.index[0])
+            return self.solve_dataframe(solver, eqn_file, df, n_workers, monitor)
+        batch_process.solve_dataframe = solve_dataframe
+        with self.assertRaises(Interrupted):
+            batch_runner.run_batch(self.eqn_file, self.input_path, output_path, chunk_size=4)
+        self.assertFalse(os.path.exists(output_path))
+        with open(os.path.join(output_path + batch_runner.CHUNK_DIRECTORY_SUFFIX, batch_runner.MANIFEST_FILE)) as f:
+            self.assertEqual(json.load(f)['completed'], {'0': 4, '1': 4})
+
+        # resuming only solves the last chunk
+        del solved[:]
+        def solve_dataframe(solver, eqn_file, df, n_workers, monitor=None):
+            solved.append(df.index[0])
+            return self.solve_dataframe(solver, eqn_file, df, n_workers, monitor)
+        batch_process.solve_dataframe = solve_dataframe
+        self.assertEqual(batch_runner.run_batch(self.eqn_file, self.input_path, output_path, chunk_size=4), 10)
+        self.assertEqual(solved, [8])
+        with open(output_path) as result, open(expected_path) as expected:
+            self.assertEqual(result.read(), expected.read())
+        self.assertFalse(os.path.exists(output_path + batch_runner.CHUNK_DIRECTORY_SUFFIX))
+
+    def test_read_chunks_skips_rows(self):
+        columns = ['sample', 'T', 'SHBG', 'Alb']
+        expected = pd.read_csv(self.input_path, sep='\t').iloc[6:]
+        chunks = list(batch_process.read_chunks(self.input_path, columns, 3, '\t', skip_rows=6))
+        self.assertEqual([chunk.shape[0] for chunk in chunks], [3, 1])
+        pd.testing.assert_frame_equal(pd.concat(chunks), expected)
+
+    def test_changed_options_are_not_resumed(self):
+        output_path = os.path.join(self.directory, 'output.csv')
+        batch_runner.run_batch(self.eqn_file, self.input_path, output_path, chunk_size=4, keep_chunks=True)
+        with self.assertRaises(batch_process.BatchCalculationException):
+            batch_runner.run_batch(self.eqn_file, self.input_path, output_path, chunk_size=3)
+        self.assertEqual(batch_runner.main([self.eqn_file, self.input_path, output_path, '--chunk-size', '3',
+                                            '--restart', '--workers', '1']), 0)
+        self.assertEqual(pd.read_csv(output_path).shape[0], 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
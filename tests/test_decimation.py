@@ -0,0 +1,44 @@
+__author__ = 'brian'
+
+import sys
+
+import os
+import unittest
+import numpy as np
+import numpy.testing as npt
+
+sys.path.append( os.path.dirname( os.path.dirname( os.path.abspath(__file__) ) ) )
+
+from src import decimation
+
+
+class TestDecimation(unittest.TestCase):
+
+    def test_lttb(self):
+        t = np.linspace(0.0, 10.0, 10001)
+        y = np.sin(t)
+        kept = decimation.lttb(t, y, 100)
+        self.assertEqual(len(kept), 100)
+        self.assertEqual(kept[0], 0)
+        self.assertEqual(kept[-1], len(t) - 1)
+        self.assertTrue(np.all(np.diff(kept) > 0))
+
+    def test_lttb_keeps_spike(self):
+        t = np.arange(10000, dtype=float)
+        y = np.zeros(10000)
+        y[6543] = 5.0
+        self.assertIn(6543, decimation.lttb(t, y, 50))
+
+    def test_lttb_few_points(self):
+        t = np.arange(100, dtype=float)
+        npt.assert_array_equal(decimation.lttb(t, np.sin(t), 2), [0, 99])
+        npt.assert_array_equal(decimation.lttb(t, np.sin(t), 1), [0])
+
+    def test_lttb_short_trajectory(self):
+        t = np.arange(20, dtype=float)
+        npt.assert_array_equal(decimation.lttb(t, t**2, 20), np.arange(20))
+        npt.assert_array_equal(decimation.lttb(t, t**2, 50), np.arange(20))
+
+
+if __name__ == '__main__':
+    unittest.main()
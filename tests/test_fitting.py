@@ -0,0 +1,78 @@
+__author__ = 'brian'
+
+import sys
+
+import os
+import unittest
+import numpy as np
+import numpy.testing as npt
+import pandas as pd
+
+sys.path.append( os.path.dirname( os.path.dirname( os.path.abspath(__file__) ) ) )
+
+from src import custom_exceptions, fitting, model_solvers, models, reaction_factories
+
+this_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+class TestFitting(unittest.TestCase):
+
+    def setUp(self):
+        self.eqn_file = os.path.join(os.path.dirname(this_dir), 'models', 'Testosterone.model')
+
+    def _measurements(self, k):
+        # equilibria of the testosterone model for the given rate constants, from a spread of initial conditions
+        solver = model_solvers.AlgebraicEquilibriumSolver(models.Model(
+            reaction_factories.FileReactionFactory(self.eqn_file)))
+        mapping = solver.get_species_mapping()
+        df = pd.DataFrame({'T': [5.0, 15.0, 30.0, 12.0, 50.0],
+                           'SHBG': [60.0, 40.0, 20.0, 10.0, 35.0],
+                           'Alb': [6e5, 6.5e5, 5.5e5, 7e5, 6e5]})
+        X0 = np.zeros((df.shape[0], solver.M))
+        for s in df.columns:
+            X0[:, mapping[s]] = df[s].values
+        X = solver.ensemble_equilibrium_solution(X0, k)
+        for s in ['T', 'Tf', 'SHBGT', 'AlbT']:
+            df[s + fitting.MEASURED_SUFFIX] = X[:, mapping[s]]
+        return solver, df
+
+    def test_fit_recovers_equilibrium_constants(self):
+        solver = model_solvers.AlgebraicEquilibriumSolver(models.Model(
+            reaction_factories.FileReactionFactory(self.eqn_file)))
+        k = solver.kvals.copy()
+        k[0] *= 3.0
+        k[2] *= 0.2
+        solver, df = self._measurements(k)
+
+        result = fitting.fit_rate_constants(self.eqn_file, df, ['K_0', 'K_2'], n_starts=3, random_state=0)
+        self.assertTrue(result.converged)
+        self.assertEqual(result.starts.shape[0], 3)
+        npt.assert_allclose(result.parameters['K_0'], k[0]/k[solver.J], rtol=1e-6)
+        npt.assert_allclose(result.parameters['K_2'], k[2]/k[2 + solver.J], rtol=1e-6)
+        npt.assert_allclose(result.rate_constants[[0, 2]], k[[0, 2]], rtol=1e-6)
+        npt.assert_allclose(result.predicted['SHBGT'].values, df['SHBGT_eq'].values, rtol=1e-6)
+
+    def test_fit_rate_constant(self):
+        solver = model_solvers.AlgebraicEquilibriumSolver(models.Model(
+            reaction_factories.FileReactionFactory(self.eqn_file)))
+        k = solver.kvals.copy()
+        k[solver.J] *= 4.0
+        solver, df = self._measurements(k)
+
+        # a single measured species is enough, and empty cells are skipped
+        df = df[['T', 'SHBG', 'Alb', 'AlbT_eq']].copy()
+        df.loc[1, 'AlbT_eq'] = np.nan
+        result = fitting.fit_rate_constants(self.eqn_file, df, ['kr_0'])
+        npt.assert_allclose(result.parameters['kr_0'], k[solver.J], rtol=1e-6)
+
+    def test_invalid_parameters_and_observations(self):
+        solver, df = self._measurements(None)
+        for parameters in [['K_20'], ['kd_0'], ['K_0', 'kr_0'], ['kf_1', 'kf_1'], ['K_5']]:
+            with self.assertRaises(custom_exceptions.InvalidFitParameterException):
+                fitting.fit_rate_constants(self.eqn_file, df, parameters)
+        with self.assertRaises(custom_exceptions.MissingObservationsException):
+            fitting.fit_rate_constants(self.eqn_file, df[['T', 'SHBG', 'Alb']], ['K_0'])
+
+
+if __name__ == '__main__':
+    unittest.main()
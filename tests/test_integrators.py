@@ -0,0 +1,78 @@
+__author__ = 'brian'
+
+import sys
+
+import os
+import unittest
+import numpy as np
+import numpy.testing as npt
+
+sys.path.append( os.path.dirname( os.path.dirname( os.path.abspath(__file__) ) ) )
+
+from src import custom_exceptions, integrators
+
+
+class TestIntegrators(unittest.TestCase):
+
+    def _linear_system(self):
+        # two independent rows of the stiff system dy0/dt = -1000*(y0 - y1), dy1/dt = -y1, whose solution is
+        # y1 = y1(0)*exp(-t) and, after a fast transient, y0 follows y1
+        A = np.array([[-1000.0, 1000.0],
+                      [0.0, -1.0]])
+        Y0 = np.array([[0.0, 1.0],
+                       [2.0, 3.0]])
+        rhs = lambda Y: np.dot(Y, A.T)
+        jac = lambda Y: np.tile(A, (Y.shape[0], 1, 1))
+        return A, Y0, rhs, jac
+
+    def _exact_solution(self, A, Y0, t):
+        w, v = np.linalg.eig(A)
+        coefficients = np.linalg.solve(v, Y0.T)
+        return np.einsum('ij,tj,jn->tni', v, np.exp(np.outer(t, w)), coefficients)
+
+    def test_integrators_match_exact_solution(self):
+        A, Y0, rhs, jac = self._linear_system()
+        sparse_jac = lambda Y: integrators.sparse_block_diagonal(jac(Y))
+        t = np.array([0.0, 0.1, 0.5, 1.0, 3.0])
+        expected = self._exact_solution(A, Y0, t)
+        rtol, atol = integrators.get_tolerances('standard')
+        for name in integrators.available_integrators():
+            integrator = integrators.get_integrator(name)
+            npt.assert_allclose(integrator.integrate(rhs, jac, Y0, t, rtol, atol), expected, rtol=1e-4, atol=1e-6)
+            npt.assert_allclose(integrator.integrate(rhs, sparse_jac, Y0, t, rtol, atol, sparse_jacobian=True),
+                                expected, rtol=1e-4, atol=1e-6)
+
+    def test_block_diagonal_storage(self):
+        blocks = np.arange(8, dtype=float).reshape(2, 2, 2) + 1
+        expected = np.zeros((4, 4))
+        expected[:2, :2] = blocks[0]
+        expected[2:, 2:] = blocks[1]
+        npt.assert_allclose(integrators.sparse_block_diagonal(blocks).toarray(), expected)
+
+        # odeint's banded storage keeps entry (i,j) at [i - j + mu, j]
+        band = integrators.banded_block_diagonal(blocks)
+        for i in range(4):
+            for j in range(4):
+                if abs(i - j) <= 1:
+                    self.assertEqual(band[i - j + 1, j], expected[i, j])
+        npt.assert_allclose(integrators.banded_sparse(integrators.sparse_block_diagonal(blocks), 1, 1), band)
+
+    def test_unknown_names_raise_exception(self):
+        with self.assertRaises(custom_exceptions.UnknownIntegratorException):
+            integrators.get_integrator('euler')
+        with self.assertRaises(custom_exceptions.UnknownTolerancePresetException):
+            integrators.get_tolerances('sloppy')
+
+    def test_stiffness_estimate_and_selection(self):
+        A, Y0, rhs, jac = self._linear_system()
+        stiffness = integrators.estimate_stiffness(jac(Y0), 3.0)
+        self.assertAlmostEqual(stiffness, 3000.0)
+        sparse_stiffness = integrators.estimate_stiffness(integrators.sparse_block_diagonal(jac(Y0)), 3.0, True)
+        self.assertGreaterEqual(sparse_stiffness, stiffness)
+
+        self.assertEqual(integrators.select_integrator(stiffness).name, 'lsoda')
+        self.assertEqual(integrators.select_integrator(None).name, 'lsoda')
+        expected = 'rosenbrock' if integrators.solve_ivp is None else 'rk45'
+        self.assertEqual(integrators.select_integrator(1.0, sparse_jacobian=True).name, expected)
+        expected = 'rosenbrock' if integrators.solve_ivp is None else 'bdf'
+        self.assertEqual(integrators.select_integrator(stiffness, sparse_jacobian=True).name, expected)
@@ -0,0 +1,102 @@
+__author__ = 'brian'
+
+import sys
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import numpy.testing as npt
+
+sys.path.append( os.path.dirname( os.path.dirname( os.path.abspath(__file__) ) ) )
+
+from src import lookup_tables, model_solvers, models, reaction_factories
+from src.custom_exceptions import *
+
+this_dir = os.path.dirname(os.path.abspath(__file__))
+models_dir = os.path.join(os.path.dirname(this_dir), 'models')
+
+
+class TestLookupTables(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.eqn_file = os.path.join(models_dir, 'Testosterone.model')
+        self.ranges = {'T': (5.0, 50.0), 'SHBG': (10.0, 100.0), 'Alb': (4e5, 9e5)}
+        self.solver = model_solvers.AlgebraicEquilibriumSolver(models.Model(
+            reaction_factories.FileReactionFactory(self.eqn_file)))
+        self.mapping = self.solver.get_species_mapping()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _initial_conditions(self, n, seed=0):
+        rng = np.random.RandomState(seed)
+        X0 = np.zeros((n, self.solver.M))
+        for symbol, (low, high) in self.ranges.items():
+            X0[:, self.mapping[symbol]] = np.exp(rng.uniform(np.log(low), np.log(high), n))
+        return X0
+
+    def test_spline_coefficients(self):
+        # cubic surfaces are reproduced exactly, up to the edges of the grid
+        shape = (7, 9)
+        grid = np.meshgrid(np.arange(shape[0], dtype=float), np.arange(shape[1], dtype=float), indexing='ij')
+        surface = lambda x, y: 1 + 2*x - y + 0.5*x*y + 0.1*x**3 - 0.05*y**3
+        table = lookup_tables.EquilibriumTable('', ['x', 'y'], ['f'], [], [0, 0], [shape[0] - 1, shape[1] - 1],
+                                               lookup_tables._spline_coefficients(surface(*grid)[..., np.newaxis]),
+                                               np.zeros((shape[0] - 1, shape[1] - 1)), 1e-3)
+        points = np.array([[0, 0], [6, 8], [0.3, 7.9], [5.5, 0.2], [3.1, 4.4]])
+        X, error = table.interpolate(np.exp(points))
+        npt.assert_allclose(np.log(X[:, 0]), surface(points[:, 0], points[:, 1]), atol=1e-10)
+        npt.assert_array_equal(error, 0)
+
+    def test_tabulated_solver(self):
+        table = lookup_tables.build_table(self.eqn_file, self.ranges, max_points=5000)
+        self.assertEqual(table.inputs, ['Alb', 'SHBG', 'T'])
+        self.assertLessEqual(np.prod(table.shape), 5000)
+        table.save(lookup_tables.table_path(self.solver, self.directory))
+
+        solver = lookup_tables.create_solver(self.eqn_file, self.directory)
+        self.assertIsInstance(solver, lookup_tables.TabulatedEquilibriumSolver)
+        # the table is read from disk once
+        self.assertIs(lookup_tables.create_solver(self.eqn_file, self.directory).table, solver.table)
+        X0 = self._initial_conditions(200)
+        X = solver.ensemble_equilibrium_solution(X0)
+        expected = self.solver.ensemble_equilibrium_solution(X0)
+        interpolated = np.isfinite(solver.get_table_error())
+        self.assertGreater(np.mean(interpolated), 0.5)
+        self.assertTrue(np.all(solver.get_convergence_report().converged))
+        self.assertTrue(np.all(solver.get_convergence_report().steps[interpolated] == 0))
+        npt.assert_array_less(np.abs(np.log(X[interpolated]/expected[interpolated])), table.tolerance)
+        npt.assert_allclose(X[~interpolated], expected[~interpolated], rtol=1e-8)
+
+        # rows outside the grid, with other species present or with other rate constants are solved
+        X0[0, self.mapping['T']] = 500.0
+        X0[1, self.mapping['AlbT']] = 1.0
+        k = np.tile(solver.kvals, (X0.shape[0], 1))
+        k[2, 0] *= 2
+        X = solver.ensemble_equilibrium_solution(X0, k)
+        self.assertTrue(np.all(np.isnan(solver.get_table_error()[:3])))
+        npt.assert_allclose(X[:3], self.solver.ensemble_equilibrium_solution(X0[:3], k[:3]), rtol=1e-8)
+
+        # a tighter tolerance interpolates fewer rows
+        solver.table_tolerance = np.percentile(table.cell_error, 10)
+        solver.ensemble_equilibrium_solution(X0)
+        self.assertLess(np.sum(np.isfinite(solver.get_table_error())), np.sum(interpolated))
+
+    def test_no_table(self):
+        solver = lookup_tables.create_solver(self.eqn_file, self.directory)
+        self.assertIsNone(solver.table)
+        # without a directory the tables are not used
+        self.assertIsNone(lookup_tables.create_solver(self.eqn_file).table)
+
+    def test_required_ranges(self):
+        eqn_file = os.path.join(models_dir, 'Estradiol.model')
+        self.assertRaises(LookupTableException, lookup_tables.build_table, eqn_file)
+        self.assertRaises(LookupTableException, lookup_tables.build_table, self.eqn_file, {'AlbT': (1.0, 2.0)})
+        self.assertRaises(LookupTableException, lookup_tables.build_table, self.eqn_file, {'T': (5.0, 1.0)})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+__author__ = 'brian'
+
+import sys
+
+import os
+import unittest
+import numpy as np
+import numpy.testing as npt
+
+sys.path.append( os.path.dirname( os.path.dirname( os.path.abspath(__file__) ) ) )
+
+from src import model_compiler
+
+
+class TestModelCompiler(unittest.TestCase):
+
+    def _coefficients(self):
+        # species A, B, C, D, E
+        # equation1: A + 2*B <-> C
+        # equation2: C + D <-> E
+        species_mapping = {'A':0, 'B':1, 'C':2, 'D':3, 'E':4}
+        alpha = np.array([[1, 0],
+                          [2, 0],
+                          [0, 1],
+                          [0, 1],
+                          [0, 0]], dtype=float)
+        gamma = np.array([[0, 0],
+                          [0, 0],
+                          [1, 0],
+                          [0, 0],
+                          [0, 1]], dtype=float)
+        return species_mapping, alpha, gamma
+
+    def test_rhs_and_jacobian_values(self):
+        species_mapping, alpha, gamma = self._coefficients()
+        compiled = model_compiler.compile_model(species_mapping, alpha, gamma)
+
+        X0 = np.array([1.2, 2.5, 0.2, 5.2, 1.3])
+        k = np.array([0.2, 5, 0.5, 2.3])
+
+        expected_dxdt = np.empty(5)
+        expected_dxdt[0] = -k[0]*X0[0]*X0[1]**2 + k[2]*X0[2]
+        expected_dxdt[1] = -2*k[0]*X0[0]*X0[1]**2 + 2*k[2]*X0[2]
+        expected_dxdt[2] = k[0]*X0[0]*X0[1]**2 - k[1]*X0[2]*X0[3] - k[2]*X0[2] + k[3]*X0[4]
+        expected_dxdt[3] = -k[1]*X0[2]*X0[3] + k[3]*X0[4]
+        expected_dxdt[4] = k[1]*X0[2]*X0[3] - k[3]*X0[4]
+
+        expected_jacobian = np.empty((5,5))
+        expected_jacobian[0,:] = np.array([-k[0]*X0[1]**2, -2*k[0]*X0[0]*X0[1], k[2], 0, 0])
+        expected_jacobian[1,:] = np.array([-2*k[0]*X0[1]**2, -4*k[0]*X0[0]*X0[1], 2*k[2], 0,0])
+        expected_jacobian[2,:] = np.array([k[0]*X0[1]**2, 2*k[0]*X0[0]*X0[1], -k[1]*X0[3]-k[2], -k[1]*X0[2], k[3]])
+        expected_jacobian[3,:] = np.array([0, 0, -k[1]*X0[3], -k[1]*X0[2], k[3]])
+        expected_jacobian[4,:] = np.array([0, 0, k[1]*X0[3], k[1]*X0[2], -k[3]])
+
+        npt.assert_allclose(compiled.rhs(X0, k), expected_dxdt)
+        npt.assert_allclose(compiled.jacobian(X0, k), expected_jacobian)
+
+    def test_stacked_states_and_rate_constants(self):
+        species_mapping, alpha, gamma = self._coefficients()
+        compiled = model_compiler.compile_model(species_mapping, alpha, gamma)
+
+        X = np.array([[1.2, 2.5, 0.2, 5.2, 1.3],
+                      [0.0, 0.3, 4.0, 0.0, 0.7]])
+        k = np.array([[0.2, 5, 0.5, 2.3],
+                      [1.0, 2, 3.0, 4.0]])
+
+        # a shared array of rate constants, and one array per row
+        for kk in [k[0], k]:
+            rhs = compiled.rhs(X, kk)
+            jacobian = compiled.jacobian(X, kk)
+            self.assertEqual(rhs.shape, (2, 5))
+            self.assertEqual(jacobian.shape, (2, 5, 5))
+            self.assertTrue(np.all(np.isfinite(jacobian)))
+            for n in range(X.shape[0]):
+                row_k = kk if kk.ndim == 1 else kk[n]
+                npt.assert_allclose(rhs[n], compiled.rhs(X[n], row_k))
+                npt.assert_allclose(jacobian[n], compiled.jacobian(X[n], row_k))
+
+    def test_compiled_model_is_cached_by_content(self):
+        species_mapping, alpha, gamma = self._coefficients()
+        compiled = model_compiler.compile_model(species_mapping, alpha, gamma)
+        self.assertIs(model_compiler.compile_model(dict(species_mapping), alpha.copy(), gamma.copy()), compiled)
+
+        # changing a stoichiometric coefficient gives a different model
+        alpha[1, 0] = 1
+        self.assertNotEqual(model_compiler.model_hash(species_mapping, alpha, gamma), compiled.model_hash)
+        self.assertIsNot(model_compiler.compile_model(species_mapping, alpha, gamma), compiled)
+
+    def test_binding_network_detection(self):
+        species_mapping, alpha, gamma = self._coefficients()
+        network = model_compiler.binding_network(species_mapping, alpha, gamma)
+        # C is A.B2 and E is C.D = A.B2.D, built from the components A, B and D
+        self.assertEqual(network.components, [0, 1, 3])
+        npt.assert_array_equal(network.composition, [[1, 0, 0], [0, 1, 0], [1, 2, 0], [0, 0, 1], [1, 2, 1]])
+        npt.assert_array_equal(network.formation, [[0, 0], [0, 0], [1, 0], [0, 0], [1, 1]])
+        self.assertIs(model_compiler.binding_network(dict(species_mapping), alpha.copy(), gamma.copy()), network)
+
+        # E formed by a second reaction
+        self.assertIsNone(model_compiler.binding_network(species_mapping, np.hstack([alpha, [[1], [0], [0], [0], [0]]]),
+                                                         np.hstack([gamma, [[0], [0], [0], [0], [1]]])))
+        # two products
+        changed = gamma.copy()
+        changed[3, 0] = 1
+        self.assertIsNone(model_compiler.binding_network(species_mapping, alpha, changed))
+        # A is formed from C, which is formed from A
+        self.assertIsNone(model_compiler.binding_network(species_mapping, np.hstack([alpha, [[0], [0], [1], [0], [0]]]),
+                                                         np.hstack([gamma, [[1], [0], [0], [0], [0]]])))
+
+
+if __name__ == '__main__':
+    unittest.main()
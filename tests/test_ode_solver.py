@@ -183,6 +183,8 @@ class TestODESolver(unittest.TestCase):
         expected_result[:,3] = np.array([0,0,3,1,-1])
 
         npt.assert_allclose(result_mtx, expected_result)
+        # the compiled model uses the stoichiometry of the forward reactions
+        npt.assert_allclose(solver.Z, expected_result[:, :2])
 
     def test_initial_conditions_init_to_zero_if_none_specified(self):
         # equation1: 2*A + B <-> C
@@ -378,3 +380,493 @@ class TestODESolverWJacobian(unittest.TestCase):
 
         npt.assert_allclose(calculated_dxdt, expected_dxdt)
 
+
+    def test_batch_jacobian_matches_single_jacobian(self):
+        # equation1: A + 2*B <-> C
+        rx1 = Reaction(
+            [Reactant('A',1), Reactant('B',2)],
+            [Product('C',1)],
+            0.2,
+            0.5
+        )
+        # equation2: C + D <-> E
+        rx2 = Reaction(
+            [Reactant('C', 1), Reactant('D',1)],
+            [Product('E', 1)],
+            5,
+            2.3
+        )
+        m = MockedModel()
+        m.add_reactions([rx1, rx2])
+        solver = model_solvers.ODESolverWJacobian(m)
+
+        X = np.array([[1.2, 2.5, 0.2, 5.2, 1.3],
+                      [0.1, 0.3, 4.0, 1.1, 0.7]])
+        batch_jacobian = solver._batch_jacobian(X)
+        batch_dxdt = solver._batch_dX_dt(X)
+        for n in range(X.shape[0]):
+            npt.assert_allclose(batch_jacobian[n], solver._jacobian(X[n]))
+            npt.assert_allclose(batch_dxdt[n], solver._dX_dt(X[n]))
+
+    def test_batch_jacobian_finite_with_zero_concentrations(self):
+        # equation1: A + B <-> C
+        rx1 = Reaction(
+            [Reactant('A',1), Reactant('B',1)],
+            [Product('C',1)],
+            0.2,
+            0.5
+        )
+        m = MockedModel()
+        m.add_reactions([rx1])
+        solver = model_solvers.ODESolverWJacobian(m)
+
+        X = np.array([[1.2, 2.5, 0.0]])
+        k = solver.kvals
+        expected_jacobian = np.array([[-k[0]*X[0,1], -k[0]*X[0,0], k[1]],
+                                      [-k[0]*X[0,1], -k[0]*X[0,0], k[1]],
+                                      [k[0]*X[0,1], k[0]*X[0,0], -k[1]]])
+        npt.assert_allclose(solver._batch_jacobian(X)[0], expected_jacobian)
+        npt.assert_allclose(solver._jacobian(X[0]), expected_jacobian)
+        npt.assert_array_equal(solver._jacobian_sparsity.toarray(), expected_jacobian != 0)
+
+    def test_ensemble_solution_matches_individual_solutions(self):
+        # equation1: A + B <-> C
+        rx1 = Reaction(
+            [Reactant('A',1), Reactant('B',1)],
+            [Product('C',1)],
+            2.0,
+            0.5
+        )
+        # equation2: C + D <-> E
+        rx2 = Reaction(
+            [Reactant('C', 1), Reactant('D',1)],
+            [Product('E', 1)],
+            5,
+            2.3
+        )
+        reaction_factory = MockedReactionFactory()
+        reaction_factory.set_reaction([rx1, rx2])
+        reaction_factory.set_initial_conditions({'A':1.0, 'B':1.0, 'D':1.0})
+        model = models.Model(reaction_factory)
+        solver = model_solvers.ODESolverWJacobian(model)
+
+        X0 = np.array([[1.0, 2.0, 0.0, 0.5, 0.0],
+                       [3.0, 0.2, 0.1, 1.5, 0.0],
+                       [0.4, 0.4, 0.0, 0.0, 2.0]])
+        ensemble_result = solver.ensemble_equilibrium_solution(X0)
+
+        mapping = solver.get_species_mapping()
+        for n in range(X0.shape[0]):
+            ic = dict([(s, X0[n, idx]) for s, idx in mapping.items()])
+            _, solution, _ = solver.equilibrium_solution(X0=ic)
+            npt.assert_allclose(ensemble_result[n], solution[-1,:], rtol=1e-6, atol=1e-9)
+
+    def test_conservation_reduction_matches_full_system(self):
+        # equation1: A + B <-> C
+        rx1 = Reaction(
+            [Reactant('A',1), Reactant('B',1)],
+            [Product('C',1)],
+            2.0,
+            0.5
+        )
+        # equation2: C + D <-> E
+        rx2 = Reaction(
+            [Reactant('C', 1), Reactant('D',1)],
+            [Product('E', 1)],
+            5,
+            2.3
+        )
+        reaction_factory = MockedReactionFactory()
+        reaction_factory.set_reaction([rx1, rx2])
+        reaction_factory.set_initial_conditions({'A':1.0, 'B':2.0, 'D':0.5})
+        model = models.Model(reaction_factory)
+
+        full_solver = model_solvers.ODESolverWJacobian(model, reduce_conservation=False)
+        reduced_solver = model_solvers.ODESolverWJacobian(model)
+
+        # three conservation laws (the A, B, and D moieties) leave two independent species
+        Y0, rhs, jac, expand = reduced_solver._reduced_system(reduced_solver.initial_conditions[np.newaxis,:],
+                                                              reduced_solver.kvals)
+        self.assertEqual(Y0.shape, (1, 2))
+
+        _, full_solution, _ = full_solver.equilibrium_solution()
+        _, reduced_solution, _ = reduced_solver.equilibrium_solution()
+        npt.assert_allclose(reduced_solution[-1,:], full_solution[-1,:], rtol=1e-6, atol=1e-9)
+
+        # the totals are held exactly along the whole trajectory
+        A, B, C, D, E = [reduced_solution[:, idx] for idx in range(5)]
+        npt.assert_allclose(A + C + E, 1.0, rtol=1e-14)
+        npt.assert_allclose(B + C + E, 2.0, rtol=1e-14)
+        npt.assert_allclose(D + E, 0.5, rtol=1e-14)
+
+    def test_integration_until_steady_state(self):
+        # equation1: A + B <-> C
+        rx1 = Reaction(
+            [Reactant('A',1), Reactant('B',1)],
+            [Product('C',1)],
+            2.0,
+            0.5
+        )
+        reaction_factory = MockedReactionFactory()
+        reaction_factory.set_reaction([rx1])
+        reaction_factory.set_initial_conditions({'A':1.0, 'B':2.0})
+        model = models.Model(reaction_factory)
+        solver = model_solvers.ODESolverWJacobian(model)
+
+        # a 1 second simulation is too short to reach equilibrium
+        mapping, X, t = solver.equilibrium_solution()
+        report = solver.get_convergence_report()
+        self.assertFalse(report.converged[0])
+
+        # the horizon is extended until it converges, and the equilibrium constant is satisfied
+        mapping, X, t = solver.equilibrium_solution(until_steady=True)
+        report = solver.get_convergence_report()
+        self.assertTrue(report.converged[0])
+        self.assertTrue(report.convergence_time[0] > 1.0)
+        self.assertEqual(report.convergence_time[0], t[-1])
+        self.assertTrue(report.residual[0] < model_solvers.ODESolverWJacobian.STEADY_STATE_TOLERANCE)
+        A, B, C = X[-1,:]
+        npt.assert_allclose(2.0*A*B, 0.5*C, rtol=1e-6)
+
+        # with a long simulation time, the integration stops well before the end
+        model.set_simulation_time(1000.0)
+        mapping, X, t = solver.equilibrium_solution(until_steady=True)
+        self.assertTrue(solver.get_convergence_report().convergence_time[0] < 1000.0)
+
+    def test_output_modes(self):
+        # equation1: A + B <-> C
+        rx1 = Reaction(
+            [Reactant('A',1), Reactant('B',1)],
+            [Product('C',1)],
+            2.0,
+            0.5
+        )
+        reaction_factory = MockedReactionFactory()
+        reaction_factory.set_reaction([rx1])
+        reaction_factory.set_initial_conditions({'A':1.0, 'B':2.0})
+        model = models.Model(reaction_factory)
+        solver = model_solvers.ODESolverWJacobian(model)
+
+        mapping, trajectory, t_trajectory = solver.equilibrium_solution()
+        self.assertEqual(trajectory.shape, (model_solvers.Solver.TRAJECTORY_POINTS, 3))
+
+        mapping, final, t_final = solver.equilibrium_solution(output=model_solvers.Solver.OUTPUT_FINAL)
+        self.assertEqual(final.shape, (1, 3))
+        npt.assert_allclose(t_final, [1.0])
+        npt.assert_allclose(final[-1,:], trajectory[-1,:], rtol=1e-6)
+
+        mapping, log_grid, t_log = solver.equilibrium_solution(output=model_solvers.Solver.OUTPUT_LOG)
+        self.assertEqual(len(t_log), model_solvers.Solver.LOG_GRID_POINTS + 1)
+        self.assertEqual(t_log[0], 0.0)
+        npt.assert_allclose(t_log[-1], 1.0)
+        npt.assert_allclose(log_grid[-1,:], trajectory[-1,:], rtol=1e-6)
+
+        mapping, dense, t_dense = solver.equilibrium_solution(output=model_solvers.Solver.OUTPUT_DENSE)
+        npt.assert_allclose(dense[-1,:], trajectory[-1,:], rtol=1e-6)
+        query_idx = [1234, 50000, 77777]
+        npt.assert_allclose(dense(t_trajectory[query_idx]), trajectory[query_idx], rtol=1e-6)
+        npt.assert_allclose(dense(t_trajectory[50000]), trajectory[50000], rtol=1e-6)
+
+        with self.assertRaises(custom_exceptions.InvalidOutputModeException):
+            solver.equilibrium_solution(output='everything')
+
+    def test_ensemble_solution_negative_initial_condition_raises_exception(self):
+        rx1 = Reaction(
+            [Reactant('A',1), Reactant('B',1)],
+            [Product('C',1)],
+            2.0,
+            0.5
+        )
+        m = MockedModel()
+        m.add_reactions([rx1])
+        solver = model_solvers.ODESolverWJacobian(m)
+        with self.assertRaises(custom_exceptions.InvalidInitialConditionException):
+            solver.ensemble_equilibrium_solution(np.array([[1.0, -1.0, 0.0]]))
+
+    def test_sparse_backend_matches_dense(self):
+        # equation1: A + B <-> C
+        rx1 = Reaction(
+            [Reactant('A',1), Reactant('B',1)],
+            [Product('C',1)],
+            2.0,
+            0.5
+        )
+        # equation2: C + D <-> E
+        rx2 = Reaction(
+            [Reactant('C', 1), Reactant('D',1)],
+            [Product('E', 1)],
+            5,
+            2.3
+        )
+        reaction_factory = MockedReactionFactory()
+        reaction_factory.set_reaction([rx1, rx2])
+        reaction_factory.set_initial_conditions({'A':1.0, 'B':1.0, 'D':1.0})
+        model = models.Model(reaction_factory)
+        dense_solver = model_solvers.ODESolverWJacobian(model, use_sparse=False)
+        sparse_solver = model_solvers.ODESolverWJacobian(model, use_sparse=True)
+        self.assertFalse(dense_solver.use_sparse)
+        self.assertTrue(sparse_solver.use_sparse)
+
+        X = np.array([[1.2, 2.5, 0.2, 5.2, 1.3],
+                      [0.1, 0.3, 4.0, 1.1, 0.7]])
+        M = X.shape[1]
+        sparse_jacobian = sparse_solver._sparse_jacobian(X).toarray()
+        batch_jacobian = dense_solver._batch_jacobian(X)
+        for n in range(X.shape[0]):
+            npt.assert_allclose(sparse_jacobian[n*M:(n+1)*M, n*M:(n+1)*M], batch_jacobian[n])
+        npt.assert_array_equal(sparse_jacobian[:M, M:], 0)
+        npt.assert_allclose(sparse_solver._sparse_dX_dt(X), dense_solver._batch_dX_dt(X))
+
+        X0 = np.array([[1.0, 1.0, 0.0, 1.0, 0.0],
+                       [2.0, 0.5, 0.0, 3.0, 0.0]])
+        dense_final = dense_solver.ensemble_equilibrium_solution(X0)
+        sparse_final = sparse_solver.ensemble_equilibrium_solution(X0)
+        npt.assert_allclose(sparse_final, dense_final, rtol=1e-5, atol=1e-8)
+
+    def test_log_domain_mass_action_rates(self):
+        # equation1: 2A + B <-> C
+        rx1 = Reaction(
+            [Reactant('A',2), Reactant('B',1)],
+            [Product('C',1)],
+            2.0,
+            0.5
+        )
+        # equation2: C + D <-> E
+        rx2 = Reaction(
+            [Reactant('C', 1), Reactant('D',1)],
+            [Product('E', 1)],
+            5,
+            2.3
+        )
+        reaction_factory = MockedReactionFactory()
+        reaction_factory.set_reaction([rx1, rx2])
+        reaction_factory.set_initial_conditions({'A':1.0, 'B':1.0, 'D':1.0})
+        solver = model_solvers.ODESolverWJacobian(models.Model(reaction_factory))
+
+        # zero and slightly negative concentrations are handled as by direct powers
+        X = np.array([[1.2, 2.5, 0.2, 5.2, 1.3],
+                      [0.0, 0.3, 4.0, 0.0, 0.7],
+                      [-1e-9, 0.3, -2e-10, 1.1, 0.7]])
+        powers = np.hstack([np.prod(X[:, :, np.newaxis]**solver.alpha, axis=1),
+                            np.prod(X[:, :, np.newaxis]**solver.gamma, axis=1)])
+        expected = solver.kvals*powers
+        npt.assert_allclose(solver._mass_action_rates(X), expected, rtol=1e-12)
+        npt.assert_allclose(solver._mass_action_rates(X[1]), expected[1], rtol=1e-12)
+        self.assertEqual(solver._mass_action_rates(X)[1, 0], 0)
+
+        k = np.array([[1.0, 2.0, 3.0, 4.0]]*3)
+        npt.assert_allclose(solver._mass_action_rates(X, k), k*powers, rtol=1e-12)
+
+        # the log-domain Jacobian terms agree with the compiled Jacobian
+        sparse_solver = model_solvers.ODESolverWJacobian(models.Model(reaction_factory), use_sparse=True)
+        M = X.shape[1]
+        sparse_jacobian = sparse_solver._sparse_jacobian(X).toarray()
+        batch_jacobian = solver._batch_jacobian(X)
+        for n in range(X.shape[0]):
+            npt.assert_allclose(sparse_jacobian[n*M:(n+1)*M, n*M:(n+1)*M], batch_jacobian[n], atol=1e-14)
+        npt.assert_allclose(sparse_solver._sparse_dX_dt(X), solver._batch_dX_dt(X), atol=1e-14)
+
+    def test_named_integrators_and_tolerance_presets(self):
+        # equation1: A + B <-> C
+        rx1 = Reaction(
+            [Reactant('A',1), Reactant('B',1)],
+            [Product('C',1)],
+            2.0,
+            0.5
+        )
+        reaction_factory = MockedReactionFactory()
+        reaction_factory.set_reaction([rx1])
+        reaction_factory.set_initial_conditions({'A':1.0, 'B':2.0})
+        model = models.Model(reaction_factory)
+
+        X0 = np.array([[1.0, 2.0, 0.0],
+                       [0.5, 0.1, 1.0]])
+        auto_solver = model_solvers.ODESolverWJacobian(model)
+        expected = auto_solver.ensemble_equilibrium_solution(X0)
+        self.assertEqual(auto_solver.get_last_integrator(), 'lsoda')
+        for name in model_solvers.integrators.available_integrators():
+            for tolerance in ['fast', 'reference']:
+                solver = model_solvers.ODESolverWJacobian(model, integrator=name, tolerance=tolerance)
+                result = solver.ensemble_equilibrium_solution(X0)
+                self.assertEqual(solver.get_last_integrator(), name)
+                npt.assert_allclose(result, expected, rtol=1e-3)
+
+        with self.assertRaises(custom_exceptions.UnknownIntegratorException):
+            model_solvers.ODESolverWJacobian(model, integrator='euler')
+        with self.assertRaises(custom_exceptions.UnknownTolerancePresetException):
+            model_solvers.ODESolverWJacobian(model, tolerance='sloppy')
+
+
+class TestAlgebraicEquilibriumSolver(unittest.TestCase):
+
+    def _create_model(self):
+        # equation1: A + B <-> C
+        rx1 = Reaction(
+            [Reactant('A',1), Reactant('B',1)],
+            [Product('C',1)],
+            2.0,
+            0.5
+        )
+        # equation2: C + D <-> E
+        rx2 = Reaction(
+            [Reactant('C', 1), Reactant('D',1)],
+            [Product('E', 1)],
+            5,
+            2.3
+        )
+        # equation3: this reaction never proceeds, so it should not affect the conservation laws
+        rx3 = Reaction(
+            [Reactant('A', 1)],
+            [Product('D', 1)],
+            0.0,
+            0.0
+        )
+        reaction_factory = MockedReactionFactory()
+        reaction_factory.set_reaction([rx1, rx2, rx3])
+        reaction_factory.set_initial_conditions({'A':1.0, 'B':2.0, 'D':0.5})
+        return models.Model(reaction_factory)
+
+    def test_equilibrium_satisfies_steady_state_and_conservation(self):
+        solver = model_solvers.AlgebraicEquilibriumSolver(self._create_model())
+        mapping, X, t = solver.equilibrium_solution()
+        X_eq = X[-1,:]
+        k = solver.kvals
+        A, B, C, D, E = [X_eq[mapping[s]] for s in 'ABCDE']
+
+        # each reversible reaction is at equilibrium:
+        npt.assert_allclose(k[0]*A*B, k[3]*C, rtol=1e-8)
+        npt.assert_allclose(k[1]*C*D, k[4]*E, rtol=1e-8)
+
+        # totals of the A, B and D moieties are conserved:
+        npt.assert_allclose(A + C + E, 1.0, rtol=1e-10)
+        npt.assert_allclose(B + C + E, 2.0, rtol=1e-10)
+        npt.assert_allclose(D + E, 0.5, rtol=1e-10)
+
+    def test_ensemble_matches_integration(self):
+        model = self._create_model()
+        model.set_simulation_time(200.0)
+        integrating_solver = model_solvers.ODESolverWJacobian(model)
+        solver = model_solvers.AlgebraicEquilibriumSolver(model)
+
+        X0 = np.array([[1.0, 2.0, 0.0, 0.5, 0.0],
+                       [3.0, 0.2, 0.1, 1.5, 0.0],
+                       [0.4, 0.4, 0.0, 0.0, 2.0]])
+        npt.assert_allclose(solver.ensemble_equilibrium_solution(X0),
+                            integrating_solver.ensemble_equilibrium_solution(X0),
+                            rtol=1e-6, atol=1e-9)
+
+    def test_rows_with_missing_values_are_not_solved(self):
+        solver = model_solvers.AlgebraicEquilibriumSolver(self._create_model())
+        X0 = np.array([[1.0, 2.0, 0.0, 0.5, 0.0],
+                       [np.nan, 0.2, 0.1, 1.5, 0.0]])
+        result = solver.ensemble_equilibrium_solution(X0)
+        self.assertTrue(np.all(np.isfinite(result[0])))
+        self.assertTrue(np.all(np.isnan(result[1])))
+
+    def test_rows_not_converged_by_newton_are_integrated(self):
+        model = self._create_model()
+        model.set_simulation_time(200.0)
+        solver = model_solvers.AlgebraicEquilibriumSolver(model)
+        X0 = np.array([[1.0, 2.0, 0.0, 0.5, 0.0],
+                       [3.0, 0.2, 0.1, 1.5, 0.0],
+                       [0.4, 0.4, 0.0, 0.0, 2.0]])
+        expected = solver.ensemble_equilibrium_solution(X0)
+
+        # only the first row starts at its equilibrium, so the others need the integration
+        guess = X0.copy()
+        guess[0] = expected[0]
+        max_iterations = model_solvers.AlgebraicEquilibriumSolver.NEWTON_MAX_ITERATIONS
+        model_solvers.AlgebraicEquilibriumSolver.NEWTON_MAX_ITERATIONS = 1
+        try:
+            result = solver.ensemble_equilibrium_solution(X0, initial_guess=guess)
+        finally:
+            model_solvers.AlgebraicEquilibriumSolver.NEWTON_MAX_ITERATIONS = max_iterations
+        report = solver.get_convergence_report()
+        npt.assert_allclose(result, expected, rtol=1e-6, atol=1e-9)
+        self.assertEqual(report.convergence_time[0], np.inf)
+        self.assertTrue(np.all(np.isfinite(report.convergence_time[1:])))
+
+    def test_binding_network_matches_general_solver(self):
+        # D is an isomer of A, so the components are A and B.  Rows where the isomerization does not proceed are
+        # left to the general solver.
+        model = self._create_model()
+        solver = model_solvers.AlgebraicEquilibriumSolver(model)
+        self.assertTrue(solver.is_binding_network())
+        general_solver = model_solvers.AlgebraicEquilibriumSolver(model)
+        general_solver._binding_network = None
+        shared_k = solver.kvals.copy()
+        shared_k[[2, 5]] = [0.7, 0.1]
+
+        np.random.seed(4)
+        X0 = np.random.lognormal(0.0, 2.0, (50, 5))
+        X0[:20, 2:] = 0
+        X0[0, 1] = 0
+        X0[1, 0] = np.nan
+        k = np.tile(shared_k, (50, 1))*np.random.lognormal(0.0, 1.0, (50, 6))
+        k[2, 5] = 0
+        for kk in [shared_k, k]:
+            X = solver.ensemble_equilibrium_solution(X0, kk)
+            report = solver.get_convergence_report()
+            npt.assert_allclose(X, general_solver.ensemble_equilibrium_solution(X0, kk), rtol=1e-8, atol=1e-12)
+            self.assertTrue(np.all(report.converged[np.arange(50) != 1]))
+            self.assertTrue(np.all(X[0, [1, 2, 4]] == 0))
+
+    def test_large_binding_network_uses_general_solver(self):
+        solver = model_solvers.AlgebraicEquilibriumSolver(self._create_model())
+        self.assertEqual(len(solver._binding_rows(np.ones_like(solver.kvals), 1)), 1)
+        max_components = model_solvers.AlgebraicEquilibriumSolver.BINDING_MAX_COMPONENTS
+        model_solvers.AlgebraicEquilibriumSolver.BINDING_MAX_COMPONENTS = 1
+        try:
+            self.assertEqual(len(solver._binding_rows(np.ones_like(solver.kvals), 1)), 0)
+        finally:
+            model_solvers.AlgebraicEquilibriumSolver.BINDING_MAX_COMPONENTS = max_components
+
+    def test_warm_start_matches_cold_start(self):
+        solver = model_solvers.AlgebraicEquilibriumSolver(self._create_model())
+        np.random.seed(3)
+        X0 = np.zeros((200, 5))
+        X0[:, 0] = np.random.lognormal(0.0, 0.5, 200)
+        X0[:, 1] = np.random.lognormal(0.5, 0.5, 200)
+        X0[:, 3] = np.random.lognormal(-0.5, 0.5, 200)
+        X0[7] = np.nan
+
+        order = solver._similarity_order(solver._similarity_features(X0[:7], solver.kvals))
+        npt.assert_array_equal(np.sort(order), np.arange(7))
+
+        cold = solver.ensemble_equilibrium_solution(X0)
+        warm = solver.ensemble_equilibrium_solution(X0, warm_start=True)
+        self.assertTrue(np.all(np.isnan(warm[7])))
+        npt.assert_allclose(warm, cold, rtol=1e-9, atol=1e-12)
+        self.assertTrue(np.all(solver.get_convergence_report().converged[np.arange(200) != 7]))
+
+    def test_sensitivities_match_finite_differences(self):
+        solver = model_solvers.AlgebraicEquilibriumSolver(self._create_model())
+        X0 = np.array([[1.0, 2.0, 0.0, 0.5, 0.0],
+                       [3.0, 0.2, 0.1, 1.5, 0.0],
+                       [np.nan, 0.2, 0.1, 1.5, 0.0]])
+        k = solver.kvals
+        X, dX_dk, dX_dX0 = solver.equilibrium_sensitivities(X0)
+        self.assertEqual(dX_dk.shape, (3, 5, 6))
+        self.assertEqual(dX_dX0.shape, (3, 5, 5))
+        self.assertTrue(np.all(np.isnan(dX_dk[2])) and np.all(np.isnan(dX_dX0[2])))
+
+        for c in [0, 1, 3, 4]:
+            h = 1e-4*k[c]
+            k_plus = k.copy()
+            k_plus[c] += h
+            k_minus = k.copy()
+            k_minus[c] -= h
+            finite_difference = (solver.ensemble_equilibrium_solution(X0[:2], k_plus) -
+                                 solver.ensemble_equilibrium_solution(X0[:2], k_minus))/(2*h)
+            npt.assert_allclose(dX_dk[:2, :, c], finite_difference, rtol=1e-5, atol=1e-8)
+
+        for j in range(5):
+            h = 1e-4
+            X0_plus = X0[:2].copy()
+            X0_plus[:, j] += h
+            X0_minus = X0[:2].copy()
+            X0_minus[:, j] = np.maximum(X0_minus[:, j] - h, 0)
+            step = (X0_plus[:, j] - X0_minus[:, j])[:, np.newaxis]
+            finite_difference = (solver.ensemble_equilibrium_solution(X0_plus) -
+                                 solver.ensemble_equilibrium_solution(X0_minus))/step
+            npt.assert_allclose(dX_dX0[:2, :, j], finite_difference, rtol=1e-4, atol=1e-7)
@@ -0,0 +1,135 @@
+__author__ = 'brian'
+
+import sys
+
+import os
+import unittest
+import numpy as np
+import numpy.testing as npt
+import pandas as pd
+
+sys.path.append( os.path.dirname( os.path.dirname( os.path.abspath(__file__) ) ) )
+
+from src import batch_process, custom_exceptions, model_solvers, models, parameter_sweep, reaction_factories
+from src.reaction_components import Reaction, Reactant, Product
+
+this_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+class MockedReactionFactory(object):
+
+    def __init__(self):
+        pass
+
+    def set_reaction(self, rx):
+        self.reactions = rx
+
+    def set_initial_conditions(self, ic):
+        self.initial_conditions = ic
+
+    def get_reactions(self):
+        return self.reactions
+
+    def get_initial_conditions(self):
+        return self.initial_conditions
+
+    def get_simulation_time(self):
+        return 1.0
+
+
+class TestParameterSweep(unittest.TestCase):
+
+    def _create_solver(self):
+        # equation1: A + B <-> C
+        rx1 = Reaction(
+            [Reactant('A',1), Reactant('B',1)],
+            [Product('C',1)],
+            2.0,
+            0.5
+        )
+        # equation2: C + D <-> E
+        rx2 = Reaction(
+            [Reactant('C', 1), Reactant('D',1)],
+            [Product('E', 1)],
+            5,
+            2.3
+        )
+        reaction_factory = MockedReactionFactory()
+        reaction_factory.set_reaction([rx1, rx2])
+        reaction_factory.set_initial_conditions({'A':1.0, 'B':2.0, 'D':0.5})
+        return model_solvers.AlgebraicEquilibriumSolver(models.Model(reaction_factory))
+
+    def test_rate_constant_grid(self):
+        solver = self._create_solver()
+        self.assertEqual(solver.get_rate_constant_names(), ['kf_0', 'kf_1', 'kr_0', 'kr_1'])
+
+        k = parameter_sweep.rate_constant_grid(solver, {'kr_1': [1.0, 2.0, 3.0], 0: [0.1, 0.2]})
+        expected = np.array([[0.1, 5, 0.5, 1.0],
+                             [0.1, 5, 0.5, 2.0],
+                             [0.1, 5, 0.5, 3.0],
+                             [0.2, 5, 0.5, 1.0],
+                             [0.2, 5, 0.5, 2.0],
+                             [0.2, 5, 0.5, 3.0]])
+        npt.assert_allclose(k, expected)
+
+        with self.assertRaises(custom_exceptions.InvalidRateConstantException):
+            parameter_sweep.rate_constant_grid(solver, {'kf_2': [1.0]})
+        with self.assertRaises(custom_exceptions.InvalidRateConstantException):
+            parameter_sweep.rate_constant_grid(solver, {'kf_0': [-1.0]})
+
+    def test_sweep_matches_individual_solutions(self):
+        solver = self._create_solver()
+        k = parameter_sweep.rate_constant_grid(solver, {'kf_0': [0.5, 2.0, 8.0], 'kr_1': [0.1, 2.3]})
+        X0 = np.array([[1.0, 2.0, 0.0, 0.5, 0.0],
+                       [3.0, 0.2, 0.1, 1.5, 0.0]])
+        table = parameter_sweep.sweep(solver, k, X0)
+
+        self.assertEqual(table.shape[0], 12)
+        self.assertEqual(table.columns.tolist(), ['parameter_set', 'initial_condition', 'kf_0', 'kf_1', 'kr_0',
+                                                  'kr_1', 'A', 'B', 'C', 'D', 'E', 'converged'])
+        self.assertTrue(table['converged'].all())
+        for _, row in table.iterrows():
+            p = int(row['parameter_set'])
+            n = int(row['initial_condition'])
+            npt.assert_allclose(row[['kf_0', 'kf_1', 'kr_0', 'kr_1']].values.astype(float), k[p])
+            expected = solver.ensemble_equilibrium_solution(X0[n], k[p])[0]
+            npt.assert_allclose(row[['A', 'B', 'C', 'D', 'E']].values.astype(float), expected, rtol=1e-8)
+
+    def test_rate_constants_from_dataframe(self):
+        solver = self._create_solver()
+        df = pd.DataFrame({'A': [1.0, 2.0], 'kf_1': [7.0, np.nan], 'kr_0': [0.1, 0.2]})
+        expected = np.array([[2.0, 7.0, 0.1, 2.3],
+                             [2.0, 5.0, 0.2, 2.3]])
+        npt.assert_allclose(parameter_sweep.rate_constants_from_dataframe(solver, df), expected)
+        self.assertIsNone(parameter_sweep.rate_constants_from_dataframe(solver, df[['A']]))
+
+        df['kr_5'] = 1.0
+        with self.assertRaises(custom_exceptions.InvalidRateConstantException):
+            parameter_sweep.rate_constants_from_dataframe(solver, df)
+
+    def test_batch_with_rate_constant_columns(self):
+        eqn_file = os.path.join(os.path.dirname(this_dir), 'models', 'Testosterone.model')
+        df = pd.DataFrame({'T': [15.0, 15.0, 22.0], 'SHBG': [40.0, 40.0, 25.0], 'Alb': [661538.46]*3,
+                           'kf_2': [1.0, 3.0, np.nan]})
+        result = batch_process.process_batch(df, eqn_file)
+
+        solver = model_solvers.AlgebraicEquilibriumSolver(models.Model(
+            reaction_factories.FileReactionFactory(eqn_file)))
+        mapping = solver.get_species_mapping()
+        # the equilibrium concentrations follow the input columns
+        equilibria = result.iloc[:, df.shape[1]:]
+        for n in range(3):
+            X0 = np.zeros(solver.M)
+            for s in ['T', 'SHBG', 'Alb']:
+                X0[mapping[s]] = df[s].values[n]
+            # the empty cell in the last row takes the rate constant from the model file
+            k = solver.kvals.copy()
+            if np.isfinite(df['kf_2'].values[n]):
+                k[2] = df['kf_2'].values[n]
+            expected = solver.ensemble_equilibrium_solution(X0, k)[0]
+            for s, index in mapping.items():
+                npt.assert_allclose(equilibria[s].values[n], expected[index], rtol=1e-8)
+
+
+if __name__ == '__main__':
+    unittest.main()
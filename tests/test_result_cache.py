@@ -0,0 +1,100 @@
+__author__ = 'brian'
+
+import sys
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import numpy.testing as npt
+
+sys.path.append( os.path.dirname( os.path.dirname( os.path.abspath(__file__) ) ) )
+
+from src import model_solvers, models, reaction_factories, result_cache
+
+this_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+class TestResultCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        eqn_file = os.path.join(os.path.dirname(this_dir), 'models', 'Testosterone.model')
+        self.solver = model_solvers.AlgebraicEquilibriumSolver(models.Model(
+            reaction_factories.FileReactionFactory(eqn_file)))
+        mapping = self.solver.get_species_mapping()
+        self.X0 = np.zeros((4, self.solver.M))
+        self.X0[:, mapping['T']] = [15.0, 5.0, 30.0, 15.0]
+        self.X0[:, mapping['SHBG']] = [40.0, 60.0, 20.0, 40.0]
+        self.X0[:, mapping['Alb']] = 6e5
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_quantize(self):
+        q = result_cache.quantize(np.array([1.0, 1.0 + 1e-13, 1.0 + 1e-8, 0.0, 2.5e-7]))
+        npt.assert_array_equal(q[0], q[1])
+        self.assertFalse(np.array_equal(q[0], q[2]))
+        npt.assert_array_equal(q[3], [0, 0])
+        npt.assert_array_equal(q[4], [2500000000, -16])
+
+    def test_keys_depend_on_initial_conditions_and_rate_constants(self):
+        keys = result_cache.EquilibriumCache.keys(self.solver, self.X0, self.solver.kvals)
+        self.assertEqual(keys[0], keys[3])
+        self.assertEqual(len(set(keys)), 3)
+        k = np.tile(self.solver.kvals, (4, 1))
+        k[3, 0] *= 2
+        per_row_keys = result_cache.EquilibriumCache.keys(self.solver, self.X0, k)
+        self.assertEqual(per_row_keys[:3], keys[:3])
+        self.assertNotEqual(per_row_keys[3], keys[3])
+
+        # results of different accuracy are kept apart
+        model = self.solver.model
+        for options in [{'tolerance': 'fast'}, {'integrator': 'bdf'}]:
+            solver = model_solvers.AlgebraicEquilibriumSolver(model, **options)
+            self.assertNotEqual(result_cache.EquilibriumCache.keys(solver, self.X0, self.solver.kvals)[0], keys[0])
+
+    def test_cached_solution_matches_solver(self):
+        cache = result_cache.EquilibriumCache()
+        expected = self.solver.ensemble_equilibrium_solution(self.X0)
+        X, report = result_cache.cached_ensemble_equilibrium_solution(self.solver, self.X0, cache=cache)
+        npt.assert_allclose(X, expected)
+        self.assertTrue(np.all(report.converged))
+        self.assertEqual(cache.stats()['misses'], 4)
+
+        X, report = result_cache.cached_ensemble_equilibrium_solution(self.solver, self.X0, cache=cache)
+        npt.assert_allclose(X, expected)
+        self.assertTrue(np.all(report.converged))
+        stats = cache.stats()
+        self.assertEqual(stats['memory_hits'], 4)
+        self.assertEqual(stats['hit_rate'], 0.5)
+
+    def test_disk_tier_is_shared_and_evicts(self):
+        path = os.path.join(self.directory, 'cache.sqlite')
+        writer = result_cache.EquilibriumCache(path, memory_entries=2, disk_entries=2)
+        interval = result_cache.DISK_EVICTION_INTERVAL
+        result_cache.DISK_EVICTION_INTERVAL = 3
+        try:
+            # the on-disk tier is only trimmed once enough entries have been written
+            writer.put_many([('a', np.array([1.0, 2.0])), ('b', np.array([3.0]))])
+            writer.put_many([('c', np.array([4.0]))])
+        finally:
+            result_cache.DISK_EVICTION_INTERVAL = interval
+
+        # the in-process tier only keeps the most recent entries
+        self.assertEqual(writer.stats()['memory_entries'], 2)
+
+        reader = result_cache.EquilibriumCache(path)
+        found = reader.get_many(['a', 'b', 'c'])
+        self.assertEqual(len(found), 2)
+        npt.assert_allclose(found['c'], [4.0])
+        self.assertEqual(reader.stats()['disk_hits'], 2)
+        self.assertEqual(reader.stats()['misses'], 1)
+
+        reader.get_many(['c'])
+        self.assertEqual(reader.stats()['memory_hits'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+__author__ = 'brian'
+
+import sys
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import numpy.testing as npt
+import pandas as pd
+
+sys.path.append( os.path.dirname( os.path.dirname( os.path.abspath(__file__) ) ) )
+
+from src import batch_process, custom_exceptions, result_writers
+
+this_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+class TestResultWriters(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.eqn_file = os.path.join(os.path.dirname(this_dir), 'models', 'Testosterone.model')
+        rng = np.random.RandomState(3)
+        n = 12
+        self.df = pd.DataFrame({'sample': ['s%d' % i for i in range(n)], 'T': rng.randint(1, 100, n),
+                                'SHBG': 10**rng.uniform(0, 2, n), 'Alb': [661538.46]*n},
+                               columns=['sample', 'T', 'SHBG', 'Alb'])
+        self.input_path = os.path.join(self.directory, 'input.txt')
+        self.df.to_csv(self.input_path, sep='\t', index=False)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_formats(self):
+        self.assertEqual(result_writers.available_formats(), ['arrow', 'csv', 'hdf5', 'parquet'])
+        installed = result_writers.installed_formats()
+        self.assertIn('csv', installed)
+        self.assertEqual(installed, [name for name in result_writers.available_formats()
+                                     if result_writers._writers[name].is_available()])
+        self.assertEqual(result_writers.format_from_path('out.PARQUET'), 'parquet')
+        self.assertEqual(result_writers.format_from_path('out.h5'), 'hdf5')
+        self.assertEqual(result_writers.format_from_path('out.dat'), 'csv')
+        self.assertEqual(result_writers._unique_columns(['T', 'A', 'T', 'T']), ['T', 'A', 'T.1', 'T.2'])
+        with self.assertRaises(custom_exceptions.UnknownOutputFormatException):
+            result_writers.get_writer(os.path.join(self.directory, 'out'), 'xlsx')
+
+        # only HDF5 stores trajectories
+        output_path = os.path.join(self.directory, 'output.csv')
+        with self.assertRaises(custom_exceptions.OutputFormatException):
+            batch_process.process_batch_file(self.input_path, output_path, self.eqn_file, trajectories=True)
+
+    def test_csv_in_chunks(self):
+        output_path = os.path.join(self.directory, 'output.csv')
+        with result_writers.get_writer(output_path) as writer:
+            writer.write(self.df.iloc[:5])
+            writer.write(self.df.iloc[5:])
+        result = result_writers.read_results(output_path)
+        self.assertEqual(result['sample'].tolist(), self.df['sample'].tolist())
+        npt.assert_array_equal(result['SHBG'].values, self.df['SHBG'].values)
+        self.assertEqual(result_writers.read_results(output_path, nrows=3).shape[0], 3)
+
+    def _check_columnar(self, output_format):
+        # the same chunks written as CSV, which is read back exactly
+        csv_path = os.path.join(self.directory, 'output.csv')
+        batch_process.process_batch_file(self.input_path, csv_path, self.eqn_file, chunk_size=5)
+        expected = result_writers.read_results(csv_path)
+
+        output_path = os.path.join(self.directory, 'output.' + output_format)
+        batch_process.process_batch_file(self.input_path, output_path, self.eqn_file, chunk_size=5)
+        result = result_writers.read_results(output_path)
+
+        # the repeated species get unique names, and the numbers are float64 at full precision
+        self.assertEqual(result.columns.tolist(), expected.columns.tolist())
+        self.assertEqual(result['sample'].tolist(), self.df['sample'].tolist())
+        self.assertEqual(result['T'].dtype, np.float64)
+        npt.assert_array_equal(result.iloc[:, 1:].values, expected.iloc[:, 1:].values.astype(float))
+        self.assertEqual(result_writers.read_results(output_path, nrows=7).shape[0], 7)
+
+    @unittest.skipUnless(result_writers.pyarrow is not None, 'pyarrow is not installed')
+    def test_parquet(self):
+        self._check_columnar('parquet')
+
+    @unittest.skipUnless(result_writers.pyarrow is not None, 'pyarrow is not installed')
+    def test_arrow(self):
+        self._check_columnar('arrow')
+
+    @unittest.skipUnless(result_writers.tables is not None, 'PyTables is not installed')
+    def test_hdf5_with_trajectories(self):
+        self._check_columnar('hdf5')
+        output_path = os.path.join(self.directory, 'output.hdf5')
+        batch_process.process_batch_file(self.input_path, output_path, self.eqn_file, chunk_size=5, trajectories=True)
+        trajectories = pd.read_hdf(output_path, result_writers.HDF_TRAJECTORIES_KEY)
+        self.assertEqual(sorted(set(trajectories['row'])), list(range(self.df.shape[0])))
+        first = trajectories[trajectories['row'] == 0]
+        self.assertEqual(first['time'].values[0], 0)
+        self.assertAlmostEqual(first['T'].values[0], self.df['T'].values[0])
+
+    @unittest.skipUnless(result_writers.pyarrow is None, 'pyarrow is installed')
+    def test_missing_package(self):
+        with self.assertRaises(custom_exceptions.OutputFormatException):
+            result_writers.get_writer(os.path.join(self.directory, 'output.parquet'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+__author__ = 'brian'
+
+import sys
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import numpy.testing as npt
+
+sys.path.append( os.path.dirname( os.path.dirname( os.path.abspath(__file__) ) ) )
+
+from src import model_solvers, models, reaction_factories, trajectory_store
+
+this_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+class TestTrajectoryStore(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'trajectory.npy')
+        self.block_points = trajectory_store.BLOCK_POINTS
+        eqn_file = os.path.join(os.path.dirname(this_dir), 'models', 'Testosterone.model')
+        self.solver = model_solvers.ODESolverWJacobian(models.Model(reaction_factories.FileReactionFactory(eqn_file)))
+
+    def tearDown(self):
+        trajectory_store.BLOCK_POINTS = self.block_points
+        shutil.rmtree(self.directory)
+
+    def test_store_is_indexed_like_an_array(self):
+        t = np.linspace(0, 1, 7)
+        X = np.random.RandomState(0).uniform(size=(7, 3, 4))
+        store = trajectory_store.TrajectoryStore.create(self.path, t, (3, 4))
+        store.write(0, X[:5])
+        store.write(5, X[5:])
+        store.flush()
+        del store
+
+        store = trajectory_store.TrajectoryStore.open(self.path)
+        npt.assert_array_equal(store.t, t)
+        self.assertEqual(store.states.shape, X.shape)
+        npt.assert_array_equal(store.states, X)
+        npt.assert_array_equal(store.states[:, 1, 2], X[:, 1, 2])
+        npt.assert_array_equal(store.states[-1], X[-1])
+        # the evolution of a species of a row is contiguous in the file
+        self.assertTrue(store.states[:, 1, 2].flags['C_CONTIGUOUS'])
+
+    def test_blocks_match_a_single_integration(self):
+        trajectory_store.BLOCK_POINTS = 300
+        mapping, expected, t = self.solver.equilibrium_solution(output=model_solvers.Solver.OUTPUT_TRAJECTORY)
+        mapping, stored, stored_t = self.solver.equilibrium_solution(output=model_solvers.Solver.OUTPUT_TRAJECTORY,
+                                                                     store=self.path)
+        self.assertIsInstance(stored, np.memmap)
+        npt.assert_array_equal(stored_t, t)
+        npt.assert_allclose(stored, expected, rtol=1e-5, atol=1e-8)
+
+        X0 = np.tile(self.solver.initial_conditions, (5, 1))
+        X0[:, mapping['T']] = np.linspace(1, 50, 5)
+        X0[2, 0] = np.nan
+        t, expected = self.solver.ensemble_trajectories(X0, output=model_solvers.Solver.OUTPUT_TRAJECTORY,
+                                                        chunk_size=2)
+        t, stored = self.solver.ensemble_trajectories(X0, output=model_solvers.Solver.OUTPUT_TRAJECTORY,
+                                                      chunk_size=2, store=self.path)
+        self.assertTrue(np.all(np.isnan(stored[:, 2])))
+        npt.assert_allclose(stored, expected, rtol=1e-5, atol=1e-8)
+
+
+if __name__ == '__main__':
+    unittest.main()
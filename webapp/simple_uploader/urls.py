@@ -3,5 +3,6 @@ from django.conf.urls import url
 import views
 
 urlpatterns = [
-	url(r'^$', views.process_batch)
+	url(r'^$', views.process_batch),
+	url(r'^progress/$', views.batch_progress)
 ]
@@ -4,6 +4,7 @@
 from django.http import JsonResponse
 from django.shortcuts import render
 from django.conf import settings
+from django.core.cache import cache
 
 import datetime
 import os
@@ -16,37 +17,75 @@ sys.path.append(settings.BACKEND_SRC)
 from forms import UploadFileForm
 
 import batch_process
+import lookup_tables
+import result_cache
+import result_writers
 
 MODELS_DIR = settings.MODELS_DIR
 MODEL_SUFFIX = settings.MODEL_SUFFIX
 CUSTOM_MODELS_DIR = settings.CUSTOM_MODELS_DIR
 
+# the number of result rows shown on the page; the full results are in the download
+PREVIEW_ROWS = 500
+
+# the content types of the downloads, by output format (see result_writers.installed_formats)
+CONTENT_TYPES = {'csv': 'text/plain', 'parquet': 'application/octet-stream',
+		'arrow': 'application/vnd.apache.arrow.file', 'hdf5': 'application/x-hdf5'}
+
+# the progress of a batch is kept in the Django cache for this long, in seconds, for the page to poll (see
+# batch_progress).  With several server processes the cache must be one they share.
+PROGRESS_TIMEOUT = 3600
+
+# equilibrium results are cached in each worker, and in a SQLite file shared by the workers if one is configured
+result_cache.configure_default_cache(getattr(settings, 'EQUILIBRIUM_CACHE_PATH', None))
+
+# the lookup tables of the standard models, if they have been built (see lookup_tables.build_table)
+lookup_tables.TABLE_DIRECTORY = getattr(settings, 'LOOKUP_TABLE_DIR', None)
+
 from django.contrib.auth.decorators import login_required
 
-def handle_file(f, modelfile):
+def handle_file(f, modelfile, output_format='csv', progress=None):
 	now = datetime.datetime.now().strftime('%d%m%y_%H%M%S')
 	uploaded_filepath = os.path.join(settings.UPLOAD_DIR, now + '.txt')
 	with(open(uploaded_filepath, 'wb+')) as destination:
 		for chunk in f.chunks():
 			destination.write(chunk)
-	input_df = pd.read_table(uploaded_filepath)
-	#result = batch_process.process_batch(uploaded_filepath, modelfile)
-	result = batch_process.process_batch(input_df, modelfile)
-	output_fn = now + '.csv'
+	output_fn = now + '.' + output_format
 	output = os.path.join(settings.TEMP_DIR, output_fn)
-	result.to_csv(output, sep=',', index=False)
+	# the upload is solved in chunks and streamed to the output file, so large files are never held in memory
+	batch_process.process_batch_file(uploaded_filepath, output, modelfile, workers=getattr(settings, 'BATCH_WORKERS', None), output_format=output_format, progress=progress)
+	result = result_writers.read_results(output, output_format, nrows=PREVIEW_ROWS)
 	storage_client = storage.Client()
 	bucket = storage_client.get_bucket(settings.DEFAULT_BUCKET)
 	blob = bucket.blob(output_fn)
-	blob.upload_from_file(open(output), content_type='text/plain')
+	blob.upload_from_file(open(output, 'rb'), content_type=CONTENT_TYPES.get(output_format, 'application/octet-stream'))
 	return result, blob
 
+def _progress_key(request):
+	return 'batch_progress_%s' % request.session.session_key
+
+@login_required
+def batch_progress(request):
+	# the rows solved so far by the batch of this session, if one is running
+	return JsonResponse(cache.get(_progress_key(request)) or {})
+
 @login_required
 def process_batch(request):
 	if request.method == 'POST':
 		linked_model = request.session.get('modelfile', None)
 		modelfile = os.path.join(CUSTOM_MODELS_DIR, linked_model)
-		dataframe, blob = handle_file(request.FILES['upfile'], modelfile)
+		# the format also names the output file, so only the known formats are accepted.  This is checked before
+		# the upload is solved, and formats whose packages are not installed on the server give CSV too.
+		output_format = request.POST.get('output_format', 'csv')
+		if output_format not in result_writers.installed_formats():
+			output_format = 'csv'
+		key = _progress_key(request)
+		def progress(rows, total_rows, elapsed):
+			cache.set(key, {'rows': rows, 'elapsed': elapsed}, PROGRESS_TIMEOUT)
+		try:
+			dataframe, blob = handle_file(request.FILES['upfile'], modelfile, output_format, progress)
+		finally:
+			cache.delete(key)
 		acl = blob.acl
 		entity = acl.all().grant_read()
 		#entity = acl.user(request.user.email)
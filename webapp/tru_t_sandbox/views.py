@@ -12,6 +12,9 @@ sys.path.append(settings.BACKEND_SRC)
 
 import reaction_factories
 import process_single
+import lookup_tables
+import result_cache
+import result_writers
 
 # this is where the models are stored:
 MODELS_DIR = settings.MODELS_DIR
@@ -19,6 +22,15 @@ MODEL_SUFFIX = settings.MODEL_SUFFIX
 
 CUSTOM_MODELS_DIR = settings.CUSTOM_MODELS_DIR
 
+# the names shown for the output formats offered for batch results (see result_writers.installed_formats)
+OUTPUT_FORMAT_LABELS = {'csv': 'CSV', 'parquet': 'Parquet', 'arrow': 'Arrow', 'hdf5': 'HDF5'}
+
+# equilibrium results are cached in each worker, and in a SQLite file shared by the workers if one is configured
+result_cache.configure_default_cache(getattr(settings, 'EQUILIBRIUM_CACHE_PATH', None))
+
+# the lookup tables of the standard models, if they have been built (see lookup_tables.build_table)
+lookup_tables.TABLE_DIRECTORY = getattr(settings, 'LOOKUP_TABLE_DIR', None)
+
 def get_available_models():
         model_files = glob.glob(os.path.join(MODELS_DIR, '*' + MODEL_SUFFIX))
         model_names = []
@@ -30,7 +42,8 @@ def get_available_models():
 @login_required
 def home_view(request):
         models = get_available_models()
-        return render(request, 'home.html', {'models':models}) 
+        output_formats = [(name, OUTPUT_FORMAT_LABELS.get(name, name)) for name in result_writers.installed_formats()]
+        return render(request, 'home.html', {'models':models, 'output_formats':output_formats})
 
 
 @login_required